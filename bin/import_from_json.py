@@ -1,58 +1,17 @@
 #!/usr/bin/env python
+"""Import factoids from a JSON or NDJSON file into a remote Papilotte server.
 
-import click
-import json
-import re
-import requests
+Factoids are sent concurrently via a pool of keep-alive connections. Each
+person and source is only sent once. The progress is stored in a
+checkpoint file, so an interrupted import can be resumed by running the
+same command again.
+"""
 import logging
-import urllib.parse
-
-
-class ImportError(Exception):
-    pass
-
-
-def post(url, data):
-    "A post request with some error handling."
-    r = requests.post(url, json=data)
-    if r.status_code > 210:
-        raise ImportError(r.text)
-    return r.json
-
+import os
 
-def put(url, data):
-    "A put request with some error handling."
-    r = requests.put(url, json=data)
-    if r.status_code > 210:
-        raise ImportError(r.text)
-    return r.json
-
-def insert_person(data, baseurl):
-    if data["@id"]:
-        url = "{}/persons/{}".format(baseurl, data['@id'])
-        person = put(url, data)
-    else:
-        url = "{}/persons".format(baseurl)
-        person = post(url, data)
-    return person
-
-def insert_source(data, baseurl):
-    if data["@id"]:
-        url = "{}/sources/{}".format(baseurl, data['@id'])
-        source = put(url, data)
-    else:
-        url = "{}/sources".format(baseurl)
-        source = post(url, data)
-    return source
+import click
 
-def insert_factoid(data, baseurl):
-    if data["@id"]:
-        url = "{}/factoids/{}".format(baseurl, data['@id'])
-        factoid = put(url, data)
-    else:
-        url = "{}/factoids".format(baseurl)
-        factoid = post(url, data)
-    return factoid
+from papilotte import client, importer
 
 
 def set_log_level(verbosity):
@@ -65,93 +24,42 @@ def set_log_level(verbosity):
         logging.basicConfig(level=logging.DEBUG)
 
 
-def is_valid_id(id_):
-    """Test if on allowed chars are in id.
-    
-    These chars are: [A-Za-z0-9_.\\-~]
-    See RFC3986#section-2.3
-    # Possibly extend to IRI?
-    """
-    if not re.match(r'^[%A-Za-z0-9_.\\\-~]*$', id_):
-        return False
-    return True
-
-def check_ids(factoids):
-    "Return True if all ids in factoid are RFC 3986 conform."
-    is_conform = True
-    for factoid in factoids:
-        if not is_valid_id(factoid['@id']):
-            print("Factoid id '{}' does not conform to RFC 3986#section-2.3".format(factoid['@id']))
-            is_conform = False
-        if not is_valid_id(factoid['person']['@id']):
-            print("Person id '{}' in Factoid '{}' does not conform to RFC 3986#section-2.3".format(factoid['person']['@id'], factoid['@id']))
-            is_conform = False
-        if not is_valid_id(factoid['source']['@id']):
-            print("Source id '{}' in Factoid '{}' does not conform to RFC 3986#section-2.3".format(factoid['source']['@id'], factoid['@id']))
-            is_conform = False
-        if not is_valid_id(factoid['statement']['@id']):
-            print("Statement id '{}' in Factoid '{}' does not conform to RFC 3986#section-2.3".format(factoid['statement']['@id'], factoid['@id']))
-            is_conform = False
-    return is_conform
-
-def import_factoids(data, baseurl,auto_escape=False):
-    inserted_f_ids = []
-    try:
-        for i, factoid in enumerate(data["factoids"]):
-            logging.info('Processing factoid {}/{}'.format(i, len(data["factoids"])))
-            person = factoid.pop('person')
-            if auto_escape:
-                person['@id'] = urllib.parse.quote(person['@id'])
-            insert_person(person, baseurl)
-            
-            source = factoid.pop('source')
-            if auto_escape:
-                source['@id'] = urllib.parse.quote(source['@id'])
-            insert_source(source, baseurl)
-
-            if auto_escape:
-                factoid['@id'] = urllib.parse.quote(factoid['@id'])
-            factoid['person'] = {'@id': person['@id']}
-            factoid['source'] = {'@id': source['@id']}
-            factoid = insert_factoid(factoid, baseurl)
-            #inserted_f_ids.append(factoid['@id'])
-            # TODO: to a rollback???
-
-    except ImportError as err:
-        # for p_id in p_ids:
-        #     requests.delete(baseurl + '/persons/' + p_id)
-        #     # fixme: zuerst die faktoide löschen, dann die anderen ggf, 409 abfangen 
-        #     # und ame ende noch einmalprobieren.
-        raise err
-
-
-
 @click.command()
-@click.argument("jsonfile")
+@click.argument("jsonfile", type=click.Path(exists=True, dir_okay=False))
 @click.option("-s", "--scheme", default="https", help="Scheme to use. Defaults to https")
 @click.option("-H", "--host", default="localhost", help="Hostname of the server")
 @click.option("-p", "--port", type=int, default=5000, help="Port of the server")
 @click.option("-b", "--base-path", default="/api", help="Base path to PAPI service on host")
 @click.option("-v", "--verbosity", is_flag=True, multiple=True, help="Increase verbosity")
 @click.option("-e", "--auto-escape-ids", is_flag=True, default=False, help="Automatically escape invald characters in '@id' values")
-def main(jsonfile, scheme, host, port, base_path, verbosity, auto_escape_ids):
+@click.option("-w", "--workers", type=click.IntRange(min=1), default=4, help="Number of concurrent requests")
+@click.option("-r", "--retries", type=click.IntRange(min=0), default=3, help="Number of retries for failing requests")
+@click.option("--batch-size", type=click.IntRange(min=1), default=100, help="Number of factoids between two checkpoints")
+@click.option("--checkpoint", type=click.Path(dir_okay=False), help="Checkpoint file (default: JSONFILE.checkpoint)")
+def main(jsonfile, scheme, host, port, base_path, verbosity, auto_escape_ids,
+         workers, retries, batch_size, checkpoint):
     set_log_level(verbosity)
     baseurl = '{}://{}:{}{}'.format(scheme, host, port, base_path)
     logging.info("Using '{}' as baseurl".format(baseurl))
     logging.debug("Reading file: '{}'".format(jsonfile))
-    with open(jsonfile) as fh:
-        data = json.load(fh)
-
-    if auto_escape_ids:
-        import_factoids(data, baseurl, True)
-    else:
-        if check_ids(data['factoids']):
-            import_factoids(data, baseurl)
-        else:
-            print(('Found at least one problematic \'@id\' value. \n'
-                   'Fix it manually or use the --auto-escape-ids option, which will escape '
-                    'the problematic id but will result in ugly urls.'))
-
+    checkpoint = checkpoint or jsonfile + '.checkpoint'
+    skip = importer.read_checkpoint(checkpoint, jsonfile)
+    if skip:
+        click.echo('Resuming after factoid {} (checkpoint {})'.format(skip, checkpoint))
+    remote = client.RemoteImporter(baseurl, client.make_session(workers, retries),
+                                   workers, auto_escape_ids)
+    with open(jsonfile, encoding='utf-8') as fh:
+        factoids = importer.read_factoids(fh, importer.detect_format(jsonfile))
+        try:
+            for stats, errors in remote.import_factoids(factoids, batch_size, skip):
+                for number, obj_id, message in errors:
+                    click.echo('Factoid {} ({}): {}'.format(number, obj_id, message), err=True)
+                importer.write_checkpoint(checkpoint, jsonfile, stats.done)
+                logging.info(str(stats))
+        except ValueError as err:
+            raise click.ClickException('Cannot read {}: {}'.format(jsonfile, err))
+    os.remove(checkpoint)
+    click.echo(str(stats))
 
 
 if __name__ == '__main__':
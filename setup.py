@@ -59,7 +59,11 @@ setup(
             "pytest",
             "coverage",
             "tox",
-        ]
+        ],
+        "compression": [
+            "brotli",
+            "zstandard",
+        ],
     },
     entry_points={"console_scripts": ["papilotte = papilotte.cli:main"]},
 )
@@ -1,6 +1,12 @@
+import base64
 import re
 import datetime
 import calendar
+import hashlib
+import json
+
+from flask import Response, request
+from werkzeug.http import http_date, quote_etag, unquote_etag
 
 from papilotte.exceptions import InvalidIdError
 
@@ -33,6 +39,233 @@ def split_sortby(sort_by):
     return sort_by_value, asc_desc
 
 
+def encode_cursor(sort_by, sort_order, obj):
+    """Return an opaque paging token pointing behind `obj`.
+
+    `obj` is the last (IPIF conform) object of a result page. The token
+    contains the value of the sort field and the id of this object, so
+    the connector can continue directly after it.
+    """
+    key = "@id" if sort_by == "id" else sort_by
+    data = [sort_by, sort_order.upper(), obj.get(key, ""), obj["@id"]]
+    token = base64.urlsafe_b64encode(json.dumps(data).encode("utf-8"))
+    return token.decode("ascii").rstrip("=")
+
+
+def decode_cursor(token, sort_by, sort_order):
+    """Return the (sort_value, id) tuple encoded in token.
+
+    :raises: ValueError if token is not a valid token or was created
+             for a different sort order.
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        token_sort_by, token_sort_order, value, obj_id = data
+    except (ValueError, TypeError):
+        raise ValueError("'{}' is not a valid cursor".format(token))
+    if token_sort_by != sort_by or token_sort_order != sort_order.upper():
+        raise ValueError("Cursor '{}' does not match the value of sortBy".format(token))
+    return value, obj_id
+
+
+def split_fields(fields, *required):
+    """Split the value of fields= into a list of field names.
+
+    Field names in `required` (eg. '@id') are always added.
+    Return None if fields is empty (all fields are requested).
+    """
+    if not fields:
+        return None
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    for name in required:
+        if name not in names:
+            names.append(name)
+    return names
+
+
+def make_search_response(key, objects, page, size, total_hits, sort_by, sort_order):
+    """Return the response body for a search result.
+
+    `objects` is the list returned by the connector's search. A connector
+    can return ready made JSON text (str) instead of dicts (eg. if
+    serialization is done by the database). In this case the documents
+    are put into the response unchanged.
+    """
+    protocol = {"page": page, "size": size, "totalHits": total_hits}
+    is_json_text = isinstance(objects[0], str)
+    if len(objects) == size:
+        last_obj = json.loads(objects[-1]) if is_json_text else objects[-1]
+        protocol["next"] = encode_cursor(sort_by, sort_order, last_obj)
+    if is_json_text:
+        body = '{{"protocol": {}, "{}": [{}]}}'.format(
+            json.dumps(protocol), key, ", ".join(objects))
+        return Response(body, mimetype="application/json")
+    return {
+        "protocol": protocol,
+        key: objects
+    }
+
+
+def make_export_response(objects):
+    """Return a streamed response with one JSON document per line (NDJSON).
+
+    `objects` is the generator returned by the connector's export(). It is
+    consumed while the response is sent, so only one batch of objects is
+    held in memory.
+    """
+    def generate():
+        for obj in objects:
+            yield (obj if isinstance(obj, str) else json.dumps(obj)) + "\n"
+    return Response(generate(), mimetype="application/x-ndjson")
+
+
+def stream_body(function):
+    """Mark function (a handler) as reading the request body itself.
+
+    connexion reads the whole request body into memory before it calls a
+    handler. Marked handlers are called directly instead (see
+    server.use_streamed_bodies), so they can read flask.request.stream while
+    the body is received. Their body and parameters are not validated by
+    connexion and they get no arguments.
+    """
+    function.stream_body = True
+    return function
+
+
+def make_many_response(key, objects):
+    """Return the response body for a multi-get request.
+
+    `objects` is the list returned by the connector's get_many(). Missing
+    objects are None and become null. As in make_search_response(),
+    documents delivered as JSON text are put into the response unchanged.
+    """
+    if not any(isinstance(obj, str) for obj in objects):
+        return {key: objects}
+    docs = [obj if isinstance(obj, str) else json.dumps(obj) for obj in objects]
+    body = '{{"{}": [{}]}}'.format(key, ", ".join(docs))
+    return Response(body, mimetype="application/json")
+
+
+def make_etag(*parts, weak=False):
+    "Return a (quoted) ETag computed from parts."
+    data = json.dumps(parts, default=str, sort_keys=True).encode("utf-8")
+    return quote_etag(hashlib.sha1(data).hexdigest(), weak)
+
+
+def item_validators(connector, obj_id):
+    """Return a tuple (exists, etag, last_modified) for the object with id
+    obj_id without loading the object.
+
+    Only the connector's get_last_modified() and get_write_version() are
+    used. The strong ETag depends on the request (path and query, so also
+    on fields), the id and modifiedWhen of the object and the write version,
+    so any write invalidates it. etag is None if the connector has no write
+    version. last_modified is the modifiedWhen of the object (a datetime)
+    or None.
+    """
+    exists, modified = connector.get_last_modified(obj_id)
+    if not exists:
+        return False, None, None
+    version = connector.get_write_version()
+    etag = None
+    if version is not None:
+        etag = make_etag(request.full_path, obj_id, modified, version)
+    if modified:
+        # http dates have no fractions of seconds
+        modified = modified.replace(microsecond=0)
+    return True, etag, modified
+
+
+def get_item(connector, obj_id, fields=None):
+    """Return the response for GET requests of a single object or None if
+    there is no object with id obj_id.
+
+    If-None-Match and If-Modified-Since are evaluated before the object is
+    loaded (see item_validators()), so the object is only loaded and
+    serialized if the client has no current copy. If the connector has no
+    write version, the ETag is a hash of the representation instead.
+    """
+    exists, etag, last_modified = item_validators(connector, obj_id)
+    if not exists:
+        return None
+    if is_not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
+    data = connector.get(obj_id, fields=fields)
+    if data is None:
+        # deleted in the meantime
+        return None
+    if etag is None:
+        etag = make_etag(request.full_path, data)
+        if is_not_modified(etag, last_modified):
+            return not_modified_response(etag, last_modified)
+    return add_headers(data, validator_headers(etag, last_modified))
+
+
+def collection_etag(connector):
+    """Return a weak ETag for a search request or None if the connector
+    does not support conditional requests.
+
+    The ETag depends on path and query string of the request and the write
+    version of the connector.
+    """
+    version = connector.get_write_version()
+    if version is None:
+        return None
+    return make_etag(request.full_path, version, weak=True)
+
+
+def is_not_modified(etag, last_modified=None):
+    """Return True if the client has a current version of the requested
+    resource (If-None-Match or If-Modified-Since).
+
+    If-Modified-Since is ignored if If-None-Match is set (RFC 7232).
+    """
+    if etag is None:
+        return False
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(unquote_etag(etag)[0])
+    if last_modified and request.if_modified_since:
+        return as_utc(last_modified) <= as_utc(request.if_modified_since)
+    return False
+
+
+def as_utc(value):
+    """Return the datetime value as timezone aware datetime in UTC.
+
+    Naive values (like modifiedWhen or If-Modified-Since with werkzeug < 2)
+    are taken as UTC.
+    """
+    if value.tzinfo is None:
+        return value.replace(tzinfo=datetime.timezone.utc)
+    return value.astimezone(datetime.timezone.utc)
+
+
+def validator_headers(etag, last_modified=None):
+    "Return a dict containing the ETag and Last-Modified headers (if set)."
+    headers = {}
+    if etag:
+        headers["ETag"] = etag
+    if last_modified:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+def not_modified_response(etag, last_modified=None):
+    "Return a '304 Not Modified' response."
+    return Response(status=304, headers=validator_headers(etag, last_modified))
+
+
+def add_headers(result, headers):
+    "Add headers to the return value (dict or flask Response) of an api function."
+    if not headers:
+        return result
+    if isinstance(result, Response):
+        result.headers.extend(headers)
+        return result
+    return result, 200, headers
+
+
 def parse_search_date(datestr, postquem=True):
     """Transform a single date (or part of a full date) into a iso style date format.
 
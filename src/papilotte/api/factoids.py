@@ -1,26 +1,25 @@
 """Handles all methods on .../persons
 """
+import json
+
 from connexion import problem
+from flask import Response
 from flask import current_app as app
 from flask import request
 
+from papilotte import validator
+
 from papilotte.exceptions import (CreationException, DeletionError,
                                   ReferentialIntegrityError, InvalidIdError)
-from papilotte.api import is_valid_id, split_sortby, fix_ids
+from papilotte.api import (is_valid_id, split_sortby, fix_ids, decode_cursor,
+                           make_search_response, make_export_response, make_many_response,
+                           split_fields, get_item,
+                           collection_etag, is_not_modified, not_modified_response,
+                           validator_headers, add_headers, stream_body)
 
 
 ALLOWED_SORT_BY_VALUES = ['id', 'createdWhen', 'createdBy', 'modifiedWhen', 'modifiedBy']
 
-# FIXME: nur für Faktoid!!!
-#    depth:
-#      in: query
-#      description: "declares the depth of description to be returned by a list of factoids. With the keyword 
-#      `reduced` the response should return only `id` for the source, the person, and the statement aggregated 
-#      by the factoid. If no value is given, the factoids return the full information."
-#        enum:
-#          - full
-#          - reduced
-
 # TODO: statementType fehlt hier?
 
 # These are cl0 filters (delete after all connectors are done)
@@ -51,19 +50,19 @@ def validate_search(func):
     "Validating decoration for search function."
     def wrapper(*args, **kwargs):
         # validate size
-        if kwargs["size"] > app.config["PAPI_MAX_SIZE"]:
+        if kwargs.get("size", 0) > app.config["PAPI_MAX_SIZE"]:
             return problem( 400, "Bad Request",
                 "Value of parameter size= must not be greater than %d"
                 % app.config["PAPI_MAX_SIZE"]
             )
-        # validate value of sortBy    
-        sort_by, _ = split_sortby(kwargs['sortBy'])
+        # validate value of sortBy
+        sort_by, _ = split_sortby(kwargs.get('sortBy', 'id'))
         if sort_by.lower() not in [v.lower() for v in ALLOWED_SORT_BY_VALUES]:
             return problem( 400, "Bad Request",
                 "Value '{}' of parameter sortBy= is not allowed. Use one of these values: {}".format(
                     kwargs['sortBy'], ", ".join(ALLOWED_SORT_BY_VALUES)))
         # validate filter names (depending on compliance level)
-        non_filters = ('size', 'page', 'sortBy', 'body')
+        non_filters = ('size', 'page', 'sortBy', 'cursor', 'depth', 'fields', 'body')
         if app.config['PAPI_COMPLIANCE_LEVEL'] == 0:
             for kw in kwargs:
                 if kw not in non_filters and not kw.lower() in ALLOWED_FILTERS_CL0:
@@ -79,8 +78,11 @@ def validate_search(func):
 
 
 @validate_search
-def get_factoids(size, page, sortBy='createdWhen', body=None, **filters):
+def get_factoids(size, page, sortBy='createdWhen', cursor=None, depth='full', fields=None,
+                 body=None, **filters):
     """Return a (filtered) list of factoids.
+
+    With depth=reduced person, source and statements only contain their '@id'.
     """
     connector = get_connector()
     # we assume all other kwargs are filters
@@ -90,23 +92,69 @@ def get_factoids(size, page, sortBy='createdWhen', body=None, **filters):
     from_ = filters.pop('from', '')
     if from_: filters['from_'] = from_
     
-    factoids = connector.search(size, page, sort_by, sort_order, **filters)
+    # the sort field is needed for the cursor in protocol.next
+    sort_key = '@id' if sort_by == 'id' else sort_by
+
+    # a cursor (if set) replaces page
+    if cursor:
+        try:
+            cursor = decode_cursor(cursor, sort_by, sort_order)
+        except ValueError as err:
+            return problem(400, "Bad Request", str(err))
+
+    etag = collection_etag(connector)
+    if is_not_modified(etag):
+        return not_modified_response(etag)
+
+    factoids, total_hits = connector.search_with_count(
+        size, page, sort_by, sort_order, cursor=cursor, depth=depth,
+        fields=split_fields(fields, '@id', sort_key), **filters)
     if not factoids:
         return problem(404, "Not found", "No (more) results found.")
-    total_hits = connector.count(**filters)
-    return {
-        "protocol": {"page": page, "size": size, "totalHits": total_hits},
-        "factoids": factoids
-    }
+    response = make_search_response("factoids", factoids, page, size, total_hits,
+                                    sort_by, sort_order)
+    return add_headers(response, validator_headers(etag))
 
 
-def get_factoid_by_id(id):
+@validate_search
+def export_factoids(depth='full', fields=None, body=None, **filters):
+    """Stream all (filtered) factoids as newline delimited JSON (ordered by id).
+    """
+    connector = get_connector()
+    # from is a reserved word, so we replace it with 'from_'
+    from_ = filters.pop('from', '')
+    if from_: filters['from_'] = from_
+
+    etag = collection_etag(connector)
+    if is_not_modified(etag):
+        return not_modified_response(etag)
+
+    factoids = connector.export(
+        app.config["PAPI_MAX_SIZE"], depth=depth, fields=split_fields(fields, '@id'), **filters)
+    return add_headers(make_export_response(factoids), validator_headers(etag))
+
+
+def get_many_factoids(body, fields=None):
+    """Return the factoids with the ids in body['ids'] in the same order.
+
+    Unknown ids result in null.
+    """
+    ids = body["ids"]
+    if len(ids) > app.config["PAPI_MAX_SIZE"]:
+        return problem(400, "Bad Request",
+                       "Not more than %d ids are allowed." % app.config["PAPI_MAX_SIZE"])
+    connector = get_connector()
+    factoids = connector.get_many(ids, fields=split_fields(fields, '@id'))
+    return make_many_response("factoids", factoids)
+
+
+def get_factoid_by_id(id, fields=None):
     "Return factoid object with id `id` or raise a 404 error."
     connector = get_connector()
-    data = connector.get(id)
-    if data is None:
+    result = get_item(connector, id, fields=split_fields(fields, '@id'))
+    if result is None:
         return problem(404, "Not found", "Factoid %s does not exist." % id)
-    return data
+    return result
 
 def create_factoid(body):
     # TODO: metadata enrichment if not set?
@@ -135,6 +183,80 @@ def create_factoid(body):
     except CreationException as err:
         return problem( 409, "Conflict", str(err))
 
+def parse_bulk_line(line):
+    """Return the factoid contained in a line of a bulk request.
+
+    :raises: ValueError or validator.JSONValidationError if line is not
+             a valid factoid.
+    """
+    factoid = json.loads(line)
+    validator.validate_stored_factoid(factoid)
+    return factoid
+
+
+def save_bulk_batch(connector, batch):
+    """Save the valid factoids of batch and yield a status line for each entry.
+
+    batch is a list of (line_no, factoid, error) tuples; factoid is None
+    if the line could not be parsed.
+    """
+    results = iter(connector.update_many([f for _, f, _ in batch if f is not None]))
+    for line_no, factoid, error in batch:
+        status = {"line": line_no}
+        if factoid is None:
+            status.update({"status": "error", "error": error})
+        else:
+            status["@id"] = factoid["@id"]
+            status["status"], message = next(results)
+            if message:
+                status["error"] = message
+        yield json.dumps(status) + "\n"
+
+
+def bulk_report(connector, lines, batch_size):
+    """Parse lines (one factoid per line) and save the factoids in batches of
+    batch_size factoids. Yield a status line (NDJSON) for each non-empty line.
+    """
+    batch = []
+    valid = 0
+    for line_no, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            batch.append((line_no, parse_bulk_line(line), None))
+            valid += 1
+        except (ValueError, validator.JSONValidationError) as err:
+            batch.append((line_no, None, str(err)))
+        if valid >= batch_size:
+            yield from save_bulk_batch(connector, batch)
+            batch = []
+            valid = 0
+    if batch:
+        yield from save_bulk_batch(connector, batch)
+
+
+@stream_body
+def bulk_factoids():
+    """Create or update factoids sent as newline delimited JSON.
+
+    Factoids are saved in batches of PAPI_BULK_BATCH_SIZE factoids (one
+    transaction per batch). The response contains a status line for each
+    line of the request. Only allowed in compliance level 2.
+    """
+    if app.config["PAPI_COMPLIANCE_LEVEL"] < 2:
+        return problem(
+            501,
+            "Not implemented",
+            "Compliance level {} does not allow POST requests.".format(
+                app.config["PAPI_COMPLIANCE_LEVEL"]
+            ),
+        )
+    connector = get_connector()
+    # the body is parsed line by line while it is received
+    lines = request.stream
+    return Response(bulk_report(connector, lines, app.config["PAPI_BULK_BATCH_SIZE"]),
+                    mimetype="application/x-ndjson")
+
 def update_factoid(id, body):
     # TODO: metadata enrichment if not set?
 
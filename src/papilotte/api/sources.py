@@ -7,7 +7,11 @@ from flask import current_app as app
 from papilotte.exceptions import DeletionError
 from papilotte.exceptions import (CreationException, DeletionError,
                                   ReferentialIntegrityError, InvalidIdError)
-from papilotte.api import is_valid_id, split_sortby, fix_ids
+from papilotte.api import (is_valid_id, split_sortby, fix_ids, decode_cursor,
+                           make_search_response, make_export_response, make_many_response,
+                           split_fields, get_item,
+                           collection_etag, is_not_modified, not_modified_response,
+                           validator_headers, add_headers)
 
 ALLOWED_SORT_BY_VALUES = ['id', 'label', 'createdWhen', 'createdBy', 'modifiedWhen', 'modifiedBy']
 # These are excluded by spec: ['createdAfter', 'createdBefore', 'createdBy', 'modifiedAfter', 'modifiedBefore', 'modifiedBy', 'sourceId']
@@ -29,19 +33,19 @@ def validate_search(func):
     "Validating decoration for search function."
     def wrapper(*args, **kwargs):
         # validate size
-        if kwargs["size"] > app.config["PAPI_MAX_SIZE"]:
+        if kwargs.get("size", 0) > app.config["PAPI_MAX_SIZE"]:
             return problem( 400, "Bad Request",
                 "Value of parameter size= must not be greater than %d"
                 % app.config["PAPI_MAX_SIZE"]
             )
-        # validate value of sortBy    
-        sort_by, _ = split_sortby(kwargs['sortBy'])
+        # validate value of sortBy
+        sort_by, _ = split_sortby(kwargs.get('sortBy', 'id'))
         if sort_by.lower() not in [v.lower() for v in ALLOWED_SORT_BY_VALUES]:
             return problem( 400, "Bad Request",
                 "Value '{}' of parameter sortBy= is not allowed. Use one of these values: {}".format(
                     kwargs['sortBy'], ", ".join(ALLOWED_SORT_BY_VALUES)))
         # validate filter names (depending on compliance level)
-        non_filters = ('size', 'page', 'sortBy', 'body')
+        non_filters = ('size', 'page', 'sortBy', 'cursor', 'fields', 'body')
         if app.config['PAPI_COMPLIANCE_LEVEL'] == 0:
             for kw in kwargs:
                 if kw not in non_filters and not kw.lower() in ALLOWED_FILTERS_CL0:
@@ -57,7 +61,8 @@ def validate_search(func):
 
 
 @validate_search
-def get_sources(size, page, sortBy='createdWhen', body=None, **filters):
+def get_sources(size, page, sortBy='createdWhen', cursor=None, fields=None, body=None,
+                **filters):
     """Return a (filtered) list of sources.
     """
     connector = get_connector()
@@ -68,23 +73,69 @@ def get_sources(size, page, sortBy='createdWhen', body=None, **filters):
     from_ = filters.pop('from', '')
     if from_: filters['from_'] = from_
     
-    sources = connector.search(size, page, sort_by, sort_order, **filters)
+    # the sort field is needed for the cursor in protocol.next
+    sort_key = '@id' if sort_by == 'id' else sort_by
+
+    # a cursor (if set) replaces page
+    if cursor:
+        try:
+            cursor = decode_cursor(cursor, sort_by, sort_order)
+        except ValueError as err:
+            return problem(400, "Bad Request", str(err))
+
+    etag = collection_etag(connector)
+    if is_not_modified(etag):
+        return not_modified_response(etag)
+
+    sources, total_hits = connector.search_with_count(
+        size, page, sort_by, sort_order, cursor=cursor,
+        fields=split_fields(fields, '@id', sort_key), **filters)
     if not sources:
         return problem(404, "Not found", "No (more) results found.")
-    total_hits = connector.count(**filters)
-    return {
-        "protocol": {"page": page, "size": size, "totalHits": total_hits},
-        "sources": sources
-    }
+    response = make_search_response("sources", sources, page, size, total_hits,
+                                    sort_by, sort_order)
+    return add_headers(response, validator_headers(etag))
 
 
-def get_source_by_id(id):
+@validate_search
+def export_sources(fields=None, body=None, **filters):
+    """Stream all (filtered) sources as newline delimited JSON (ordered by id).
+    """
+    connector = get_connector()
+    # from is a reserved word, so we replace it with 'from_'
+    from_ = filters.pop('from', '')
+    if from_: filters['from_'] = from_
+
+    etag = collection_etag(connector)
+    if is_not_modified(etag):
+        return not_modified_response(etag)
+
+    sources = connector.export(
+        app.config["PAPI_MAX_SIZE"], fields=split_fields(fields, '@id'), **filters)
+    return add_headers(make_export_response(sources), validator_headers(etag))
+
+
+def get_many_sources(body, fields=None):
+    """Return the sources with the ids in body['ids'] in the same order.
+
+    Unknown ids result in null.
+    """
+    ids = body["ids"]
+    if len(ids) > app.config["PAPI_MAX_SIZE"]:
+        return problem(400, "Bad Request",
+                       "Not more than %d ids are allowed." % app.config["PAPI_MAX_SIZE"])
+    connector = get_connector()
+    sources = connector.get_many(ids, fields=split_fields(fields, '@id'))
+    return make_many_response("sources", sources)
+
+
+def get_source_by_id(id, fields=None):
     "Return source object with id `id` or raise a 404 error."
     connector = get_connector()
-    data = connector.get(id)
-    if data is None:
+    result = get_item(connector, id, fields=split_fields(fields, '@id'))
+    if result is None:
         return problem(404, "Not found", "Source %s does not exist." % id)
-    return data
+    return result
 
 def create_source(body):
     # TODO: metadata enrichment if not set?
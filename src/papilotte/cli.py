@@ -1,10 +1,12 @@
 """Command line commands for papilotte.
 """
 import logging
+import os
 import click
 from clickclick import AliasedGroup
 from papilotte import __version__
-from papilotte import server
+from papilotte import configuration, importer, server
+from papilotte.exceptions import ConfigurationError
 
 logger = logging.getLogger(__name__)
 
@@ -61,5 +63,131 @@ def run(**params):
     app.run()
 
 
+def load_connector(config_file, **options):
+    """Return a tuple (connector_module, connector_configuration) for the
+    connector configured in config_file (and environment).
+
+    options are passed to the initialize() function of the connector.
+    """
+    try:
+        cfg = configuration.get_configuration(config_file)
+        connector_module = cfg['connector'].pop('connector_module')
+        connector_cfg = connector_module.initialize(cfg['connector'], **options)
+    except ConfigurationError as err:
+        raise click.ClickException(str(err))
+    return connector_module, connector_cfg
+
+
+@main.command('rebuild-fulltext')
+@click.option('--config-file', '-c', type=click.Path(),
+              help='Path to the configuration file.')
+def rebuild_fulltext(config_file):
+    """(Re)build the full text index of the connector.
+    """
+    connector_module, connector_cfg = load_connector(config_file)
+    if not hasattr(connector_module, 'rebuild_fulltext_index'):
+        raise click.ClickException(
+            "Connector '{}' does not support a full text index.".format(
+                connector_module.__name__))
+    try:
+        stats = connector_module.rebuild_fulltext_index(connector_cfg)
+    except ConfigurationError as err:
+        raise click.ClickException(str(err))
+    for entity_name, num in stats.items():
+        click.echo('{}: {} objects indexed'.format(entity_name, num))
+
+
+@main.command('import')
+@click.argument('input_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--config-file', '-c', type=click.Path(),
+              help='Path to the configuration file.')
+@click.option('--format', '-f', 'fmt', type=click.Choice(('auto', 'json', 'ndjson')),
+              default='auto', help='Format of INPUT_FILE (default: auto detect).')
+@click.option('--batch-size', '-b', type=click.IntRange(min=1), default=1000,
+              help='Number of factoids saved in one transaction.')
+@click.option('--checkpoint', type=click.Path(dir_okay=False),
+              help='Checkpoint file (default: INPUT_FILE.checkpoint).')
+@click.option('--no-validation', is_flag=True, default=False,
+              help='Do not validate factoids before saving them.')
+def import_(input_file, config_file, fmt, batch_size, checkpoint, no_validation):
+    """Import factoids from a JSON or NDJSON file into the database.
+
+    The progress is stored in a checkpoint file after each batch. If the
+    import is interrupted, running the same command again continues
+    after the last saved batch.
+    """
+    connector_module, connector_cfg = load_connector(config_file)
+    connector = connector_module.FactoidConnector(connector_cfg)
+    if fmt == 'auto':
+        fmt = importer.detect_format(input_file)
+    checkpoint = checkpoint or input_file + '.checkpoint'
+    skip = importer.read_checkpoint(checkpoint, input_file)
+    if skip:
+        click.echo('Resuming after factoid {} (checkpoint {})'.format(skip, checkpoint))
+    with open(input_file, encoding='utf-8') as fh:
+        factoids = importer.read_factoids(fh, fmt)
+        try:
+            for stats, errors in importer.import_factoids(
+                    connector, factoids, batch_size, skip, not no_validation):
+                for number, obj_id, message in errors:
+                    click.echo('Factoid {} ({}): {}'.format(number, obj_id, message), err=True)
+                importer.write_checkpoint(checkpoint, input_file, stats.done)
+                click.echo(str(stats))
+        except ValueError as err:
+            raise click.ClickException('Cannot read {}: {}'.format(input_file, err))
+    os.remove(checkpoint)
+    click.echo('Import finished.')
+
+
+@main.group(cls=AliasedGroup)
+def db():
+    "Maintenance commands for the database."
+
+
+@db.command('create-indexes')
+@click.option('--config-file', '-c', type=click.Path(),
+              help='Path to the configuration file.')
+def create_indexes(config_file):
+    """Add all missing tables and indexes to an existing database.
+
+    Existing data is kept. Duplicate rows in lookup tables (eg. roles
+    with the same label and uri) are merged before adding their unique
+    indexes.
+    """
+    connector_module, connector_cfg = load_connector(config_file, create_tables=False)
+    if not hasattr(connector_module, 'create_indexes'):
+        raise click.ClickException(
+            "Connector '{}' does not support creating indexes.".format(
+                connector_module.__name__))
+    created = connector_module.create_indexes(connector_cfg)
+    for name in created:
+        click.echo('Created index {}'.format(name))
+    if not created:
+        click.echo('All indexes exist.')
+
+
+@main.command('gc')
+@click.option('--config-file', '-c', type=click.Path(),
+              help='Path to the configuration file.')
+@click.option('--batch-size', '-b', type=click.IntRange(min=1),
+              help=('Number of rows deleted in one transaction '
+                    '(default: connector.gcBatchSize).'))
+def gc(config_file, batch_size):
+    """Delete orphaned rows from the database.
+
+    Removes persons, sources and statements which were used by deleted
+    factoids only and unused dates, roles, places, uris etc. Needed if
+    'connector.gc' is enabled and no server runs the garbage collector.
+    """
+    connector_module, connector_cfg = load_connector(config_file, background=False)
+    if not hasattr(connector_module, 'collect_garbage'):
+        raise click.ClickException(
+            "Connector '{}' does not support garbage collection.".format(
+                connector_module.__name__))
+    stats = connector_module.collect_garbage(connector_cfg, batch_size)
+    for entity_name, num in stats.items():
+        click.echo('{}: {} rows deleted'.format(entity_name, num))
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,238 @@
+"""Import factoids into a remote Papilotte (IPIF) server via HTTP.
+
+Used by bin/import_from_json.py for servers which cannot be accessed at
+the database level (use `papilotte import` otherwise).
+
+All requests share one keep-alive requests.Session, whose connection pool
+is sized for the number of workers. Factoids are sent concurrently by a
+thread pool. Each person and source is sent only once: the factoids only
+reference them by '@id'. Only the outcome of sent persons and sources is
+kept (for the most recent max_sent of them). Failing requests are retried with exponential
+backoff. Factoids are processed in batches; after each batch the progress
+can be stored in a checkpoint file (see papilotte.importer).
+"""
+import collections
+import concurrent.futures
+import threading
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from papilotte.api import is_valid_id
+from papilotte.importer import ImportStats
+
+# Status codes which are worth a retry
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Default number of sent persons and sources which are remembered
+MAX_SENT = 100000
+
+
+class RemoteError(Exception):
+    "Raised if the server does not accept an object."
+
+
+def make_session(workers=4, retries=3, backoff=0.5):
+    """Return a requests.Session for workers concurrent threads.
+
+    Idempotent requests (like PUT) are retried up to retries times on
+    connection errors and on the status codes in RETRY_STATUS_CODES.
+    The delay between two retries is backoff * 2 ** (retry - 1) seconds.
+    """
+    retry = Retry(total=retries, backoff_factor=backoff,
+                  status_forcelist=RETRY_STATUS_CODES, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class RemoteImporter:
+    """Send factoids to the IPIF server at baseurl.
+
+    :param baseurl: the url of the api including the base path, eg.
+                    'https://example.com/api'
+    :param session: a requests.Session (default: make_session(workers))
+    :param workers: number of concurrent requests
+    :param auto_escape: if True, invalid characters in ids are escaped.
+                        Otherwise factoids with such ids are rejected.
+    :param max_sent: number of sent persons and sources which are
+                     remembered. Older ones are sent again if they are
+                     referenced again.
+    """
+
+    def __init__(self, baseurl, session=None, workers=4, auto_escape=False,
+                 max_sent=MAX_SENT):
+        self.baseurl = baseurl.rstrip("/")
+        self.session = session or make_session(workers)
+        self.workers = workers
+        self.auto_escape = auto_escape
+        self.max_sent = max_sent
+        # persons and sources already sent, least recently used first:
+        # {(path, id): None or error message}
+        self.sent = collections.OrderedDict()
+        # persons and sources being sent: {(path, id): future}
+        self.pending = {}
+        self._lock = threading.Lock()
+
+    def send(self, path, data):
+        """PUT data to path/@id (POST to path if data has no '@id').
+
+        Return the response.
+        :raises: RemoteError if the server rejected the request.
+        """
+        if data.get("@id"):
+            url = "{}/{}/{}".format(self.baseurl, path, data["@id"])
+            response = self.session.put(url, json=data)
+        else:
+            response = self.session.post("{}/{}".format(self.baseurl, path), json=data)
+        if response.status_code >= 300:
+            raise RemoteError("{} {}: {}".format(
+                response.status_code, response.reason, response.text.strip()))
+        return response
+
+    def send_once(self, executor, path, data):
+        """Return a future for sending data to path (its result is None).
+
+        Objects with the same id are only sent once.
+        """
+        key = (path, data["@id"])
+        with self._lock:
+            future = self.pending.get(key)
+            if future is not None:
+                return future
+            if key in self.sent:
+                self.sent.move_to_end(key)
+                return self._done_future(self.sent[key])
+            future = executor.submit(self._send_object, path, data)
+            self.pending[key] = future
+        # called at once if the future is already done, so not with the lock
+        future.add_done_callback(lambda future: self._sent(key, future))
+        return future
+
+    def _send_object(self, path, data):
+        "Send data to path. Drop the response."
+        self.send(path, data)
+
+    def _sent(self, key, future):
+        "Remember the outcome of future (sending the object key)."
+        error = future.exception()
+        with self._lock:
+            self.pending.pop(key, None)
+            self.sent[key] = None if error is None else str(error)
+            while len(self.sent) > self.max_sent:
+                self.sent.popitem(last=False)
+
+    @staticmethod
+    def _done_future(error):
+        "Return a finished future, which fails with RemoteError(error) if error is set."
+        future = concurrent.futures.Future()
+        if error is None:
+            future.set_result(None)
+        else:
+            future.set_exception(RemoteError(error))
+        return future
+
+    def fix_ids(self, factoid):
+        """Check (or escape) the ids in factoid.
+
+        :raises: RemoteError if an id contains invalid characters.
+        """
+        objects = [("Factoid", factoid)]
+        for key in ("person", "source"):
+            if isinstance(factoid.get(key), dict):
+                objects.append((key.capitalize(), factoid[key]))
+        stmts = factoid.get("statements", [factoid.get("statement")])
+        objects.extend(("Statement", stmt) for stmt in stmts if isinstance(stmt, dict))
+        for name, obj in objects:
+            obj_id = obj.get("@id")
+            if not obj_id or is_valid_id(obj_id):
+                continue
+            if not self.auto_escape:
+                raise RemoteError(
+                    "{} id '{}' does not conform to RFC 3986#section-2.3".format(name, obj_id))
+            obj["@id"] = urllib.parse.quote(obj_id)
+
+    def submit(self, executor, factoid):
+        """Submit factoid (and its person and source, if not sent yet)
+        to executor. Return a future for the factoid.
+        """
+        self.fix_ids(factoid)
+        # the api only accepts a single statement
+        if "statements" in factoid:
+            if len(factoid["statements"]) != 1:
+                raise RemoteError("A factoid must contain exactly one statement")
+            factoid["statement"] = factoid.pop("statements")[0]
+        dependencies = []
+        for key, path in (("person", "persons"), ("source", "sources")):
+            obj = factoid.get(key)
+            # objects without id are created together with the factoid
+            if isinstance(obj, dict) and obj.get("@id") and len(obj) > 1:
+                dependencies.append((key, self.send_once(executor, path, obj)))
+                factoid[key] = {"@id": obj["@id"]}
+        return executor.submit(self._send_factoid, factoid, dependencies)
+
+    def _send_factoid(self, factoid, dependencies):
+        "Wait until person and source are sent, then send factoid."
+        for key, future in dependencies:
+            try:
+                future.result()
+            except (RemoteError, requests.RequestException) as err:
+                raise RemoteError("Cannot save {} '{}': {}".format(
+                    key, factoid[key]["@id"], err))
+        return self.send("factoids", factoid)
+
+    def import_factoids(self, factoids, batch_size=100, skip=0):
+        """Send factoids to the server, batch_size factoids at a time.
+
+        factoids is an iterable of (number, factoid, error) tuples as
+        returned by papilotte.importer.read_factoids(). The first skip
+        factoids are ignored (resume). After each batch a (stats, errors)
+        tuple is yielded as by papilotte.importer.import_factoids(). All
+        factoids of a batch are finished before the batch is reported, so
+        stats.done can be used as checkpoint. Saved factoids are counted as
+        updated unless the server answers with '201 Created'.
+        """
+        stats = ImportStats(skip)
+        with concurrent.futures.ThreadPoolExecutor(self.workers) as executor:
+            batch = []
+            for number, factoid, error in factoids:
+                if number <= skip:
+                    continue
+                if error is None:
+                    try:
+                        batch.append((number, factoid, self.submit(executor, factoid)))
+                    except RemoteError as err:
+                        error = str(err)
+                if error is not None:
+                    obj_id = factoid.get("@id") if isinstance(factoid, dict) else None
+                    batch.append((number, {"@id": obj_id}, error))
+                if len(batch) >= batch_size:
+                    yield stats, self._finish_batch(batch, stats)
+                    batch = []
+            yield stats, self._finish_batch(batch, stats)
+
+    @staticmethod
+    def _finish_batch(batch, stats):
+        """Wait for all factoids in batch. Update stats and return a list of
+        (number, id, message) tuples for all failed factoids.
+        """
+        errors = []
+        for number, factoid, result in batch:
+            if isinstance(result, concurrent.futures.Future):
+                try:
+                    result = result.result()
+                except (RemoteError, requests.RequestException) as err:
+                    result = str(err)
+            if isinstance(result, str):
+                stats.errors += 1
+                errors.append((number, factoid.get("@id"), result))
+            elif result.status_code == 201:
+                stats.created += 1
+            else:
+                stats.updated += 1
+            stats.done = number
+        return errors
@@ -0,0 +1,233 @@
+"""Compression of responses negotiated via `Accept-Encoding`.
+
+gzip is always available. br (brotli) and zstd are used if the packages
+`brotli` and `zstandard` are installed (`pip install papilotte[compression]`).
+Which encodings are offered, the compression level and the minimum size of
+a response body to be compressed are configured in the [server] section
+of the configuration.
+
+Streamed responses (eg. the NDJSON exports) are compressed on the fly,
+regardless of their size.
+
+Most responses have an ETag (see papilotte.api), which changes if the data
+changes. The compressed bodies of these responses are kept in a small LRU
+cache, keyed by ETag and encoding, so frequently requested pages are not
+compressed again and again.
+
+As the compressed body is not byte-identical to the original body, the
+ETag of a compressed response is weakened (as nginx does). Weak ETags are
+still accepted in If-None-Match, so conditional requests keep working.
+"""
+import gzip
+import threading
+import zlib
+from collections import OrderedDict
+
+from flask import request
+from werkzeug.http import quote_etag, unquote_etag
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Only responses with one of these mimetypes (or text/*) are compressed
+COMPRESSIBLE_MIMETYPES = (
+    "application/json",
+    "application/problem+json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+    "application/yaml",
+)
+
+
+def _gzip(data, level):
+    return gzip.compress(data, compresslevel=level)
+
+
+def _brotli(data, level):
+    return brotli.compress(data, quality=level)
+
+
+def _zstd(data, level):
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+def _gzip_stream(chunks, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _brotli_stream(chunks, level):
+    compressor = brotli.Compressor(quality=level)
+    for chunk in chunks:
+        data = compressor.process(chunk)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+def _zstd_stream(chunks, level):
+    compressor = zstandard.ZstdCompressor(level=level).compressobj()
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+STREAM_ENCODERS = {"gzip": _gzip_stream, "br": _brotli_stream, "zstd": _zstd_stream}
+
+
+def available_encodings():
+    "Return a dict mapping the names of all usable encodings to a compress function."
+    encodings = {"gzip": _gzip}
+    if brotli is not None:
+        encodings["br"] = _brotli
+    if zstandard is not None:
+        encodings["zstd"] = _zstd
+    return encodings
+
+
+def is_compressible(response):
+    "Return True if the mimetype of response is worth compressing."
+    mimetype = response.mimetype or ""
+    return mimetype.startswith("text/") or mimetype in COMPRESSIBLE_MIMETYPES
+
+
+class Compressor:
+    """Compress flask responses according to the Accept-Encoding header of
+    the request.
+
+    :param encodings: names of the encodings to offer in order of preference.
+           Encodings whose package is not installed are ignored.
+    :param level: compression level (1-9)
+    :param min_size: bodies smaller than min_size bytes are not compressed
+    :param cache_size: maximum number of compressed bodies to keep
+    """
+
+    def __init__(self, encodings=("br", "zstd", "gzip"), level=6, min_size=500,
+                 cache_size=256):
+        usable = available_encodings()
+        self.encodings = [(name, usable[name]) for name in encodings if name in usable]
+        self.level = level
+        self.min_size = min_size
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def negotiate(self, accept_encodings):
+        """Return the name and compress function of the encoding to use for
+        a werkzeug Accept object or (None, None) if the client accepts none
+        of the configured encodings.
+
+        The encoding with the highest quality wins, ties are broken by the
+        configured order.
+        """
+        best, best_quality = (None, None), 0
+        for name, func in self.encodings:
+            quality = accept_encodings.quality(name)
+            if quality > best_quality:
+                best, best_quality = (name, func), quality
+        return best
+
+    def compress(self, name, func, data, etag=None):
+        """Return data compressed with encoding name.
+
+        If etag is set, the result is cached (or taken from the cache).
+        """
+        if etag is None:
+            return func(data, self.level)
+        key = (etag, name)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return self.cache[key]
+        compressed = func(data, self.level)
+        with self.lock:
+            self.misses += 1
+            self.cache[key] = compressed
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return compressed
+
+    def clear(self):
+        "Empty the cache."
+        with self.lock:
+            self.cache.clear()
+
+    def process(self, request, response):
+        "Compress response (if possible and wanted). Use as after_request handler."
+        if (
+            response.status_code != 200
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+            or not is_compressible(response)
+        ):
+            return response
+        response.vary.add("Accept-Encoding")
+        if response.is_streamed:
+            return self.process_stream(request, response)
+        if response.content_length is not None and response.content_length < self.min_size:
+            return response
+        name, func = self.negotiate(request.accept_encodings)
+        if name is None:
+            return response
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+        etag, is_weak = unquote_etag(response.headers.get("ETag"))
+        response.set_data(self.compress(name, func, data, etag))
+        response.headers["Content-Encoding"] = name
+        if etag and not is_weak:
+            response.headers["ETag"] = quote_etag(etag, weak=True)
+        return response
+
+    def process_stream(self, request, response):
+        "Compress a streamed response chunk by chunk."
+        name, _ = self.negotiate(request.accept_encodings)
+        if name is None:
+            return response
+        response.response = STREAM_ENCODERS[name](response.iter_encoded(), self.level)
+        response.headers["Content-Encoding"] = name
+        response.headers.pop("Content-Length", None)
+        etag, is_weak = unquote_etag(response.headers.get("ETag"))
+        if etag and not is_weak:
+            response.headers["ETag"] = quote_etag(etag, weak=True)
+        return response
+
+
+def init_app(app, server_cfg):
+    """Register a Compressor configured by server_cfg (the [server] section
+    of the configuration) with flask app.
+
+    Does nothing if compression is disabled.
+    """
+    if not server_cfg["compression"]:
+        return None
+    compressor = Compressor(
+        encodings=server_cfg["compressionEncodings"],
+        level=server_cfg["compressionLevel"],
+        min_size=server_cfg["compressionMinSize"],
+        cache_size=server_cfg["compressionCacheSize"],
+    )
+    app.extensions["papilotte_compression"] = compressor
+
+    @app.after_request
+    def compress_response(response):  # pylint: disable=unused-variable
+        return compressor.process(request, response)
+
+    return compressor
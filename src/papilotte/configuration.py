@@ -22,6 +22,19 @@ schema = vt.Schema(
             ),
             vt.Required("strictValidation", default="True"): vt.Boolean(),
             vt.Required("responseValidation", default="False"): vt.Boolean(),
+            vt.Required("compression", default=True): vt.Boolean(),
+            vt.Required("compressionEncodings", default=["br", "zstd", "gzip"]): vt.All(
+                list, [vt.Any("br", "zstd", "gzip")]
+            ),
+            vt.Required("compressionLevel", default=6): vt.All(
+                vt.Coerce(int), vt.Range(min=1, max=9)
+            ),
+            vt.Required("compressionMinSize", default=500): vt.All(
+                vt.Coerce(int), vt.Range(min=0)
+            ),
+            vt.Required("compressionCacheSize", default=256): vt.All(
+                vt.Coerce(int), vt.Range(min=0)
+            ),
         },
         "logging": {
             vt.Required("logLevel", default="info"): vt.Any(
@@ -52,6 +65,9 @@ schema = vt.Schema(
             vt.Required("formats", default=["application/json"]): vt.All(
                 list, vt.Length(min=1)
             ),  # FIMXE: validation?
+            vt.Required("bulkBatchSize", default=1000): vt.All(
+                vt.Coerce(int), vt.Range(min=1)
+            ),
         },
         # FIMXE: should this be required withould default values?
         "metadata": {
@@ -1,5 +1,7 @@
 """Defines an abstract base class for all connectors.
 """
+import datetime
+import json
 
 # explain the exception (api consumes a limited number of exception)
 # it's the developers responsibility to catch all connector specific connection
@@ -28,20 +30,80 @@ class AbstractConnector:
                 )
             )
         
-    def get(self, obj_id):
+    def get(self, obj_id, fields=None):
         """Return the object with id obj_id.
 
         This method MUST be overriden by any custom implementation.
 
         :param obj_id: the id of the object to return
         :type obj_id: string
+        :param fields: a list of field names to return (sparse fieldset). Fields of
+                  nested objects are addressed by dotted names like 'statements.date'.
+                  If None, all fields are returned.
+        :type fields: list
         :return: The object as defined in the openAPI definition
         :rtype: dict
         :raises: KeyError?? # TODO: use more suitable Exception?
         """
         raise NotImplementedError("Abstract method 'get' must be overriden!")
 
-    def search(self, size, page, sort_by="createdWhen", sort_order='ASC', **filters):
+    def get_many(self, obj_ids, fields=None):
+        """Return a list containing the object for each id in obj_ids.
+
+        The list has the same order as obj_ids. For ids without an object
+        the list contains None.
+
+        This method SHOULD be overriden if the connector can fetch many
+        objects with a single query. The default implementation calls
+        get() for each id.
+
+        :param obj_ids: the ids of the objects to return
+        :type obj_ids: list
+        :param fields: a list of field names to return (see get()). If None, all
+                  fields are returned.
+        :type fields: list
+        :return: a list of objects (IPIF dicts or IPIF documents as JSON text) or None
+        :rtype: list
+        """
+        return [self.get(obj_id, fields=fields) for obj_id in obj_ids]
+
+    def get_last_modified(self, obj_id):
+        """Return a tuple (exists, modified_when) for the object with id obj_id.
+
+        exists is False if there is no such object. modified_when is the value
+        of modifiedWhen as datetime or None if not set. Used for Last-Modified
+        headers and conditional requests, so this should be cheap.
+
+        This method SHOULD be overriden if the connector can look up
+        modifiedWhen without loading the full object. The default
+        implementation uses get().
+
+        :param obj_id: the id of the object
+        :type obj_id: string
+        :rtype: tuple
+        """
+        data = self.get(obj_id, fields=["@id", "modifiedWhen"])
+        if data is None:
+            return False, None
+        if not data.get("modifiedWhen"):
+            return True, None
+        return True, datetime.datetime.fromisoformat(data["modifiedWhen"])
+
+    def get_write_version(self):
+        """Return a value which changes whenever data is created, updated
+        or deleted or None if the connector does not support this.
+
+        Used to build the ETags of search results and single objects. If
+        None is returned, conditional requests for searches are not
+        supported and ETags of single objects are hashes of their
+        representation (so the object is loaded for each request).
+
+        This method SHOULD be overriden by any custom implementation.
+        """
+        return None
+
+    def search(self, size, page, sort_by="createdWhen", sort_order='ASC', cursor=None,
+               depth="full", fields=None, **filters):
         """Find all objects that match the filter conditions set via
         filters.
 
@@ -60,13 +122,79 @@ class AbstractConnector:
                   default value is 'createdWhen', but allowed is any field name contained
                   in the response objects.
         :type sort_by: str
+        :param cursor: a (sort_value, id) tuple identifying the last object of the
+                  previous page. If set, page is ignored and the connector should
+                  return the `size` objects following this object (keyset paging).
+        :type cursor: tuple
+        :param depth: 'full' (default) or 'reduced'. Only used for factoids:
+                  with 'reduced' person, source and statements of a factoid only
+                  contain their '@id'. Other connectors can ignore this.
+        :type depth: str
+        :param fields: a list of field names to return (see get()). If None, all
+                  fields are returned.
+        :type fields: list
         :param **filters: **kwargs for filter parameter and values
         :type filters: dict
-        :return: a list of matching objects. May be empty.
+        :return: a list of matching objects. May be empty. Objects are IPIF dicts
+                 or IPIF documents as JSON text (str).
         :rtype: list
         """
         raise NotImplementedError("Abstract method 'find' must be overriden!")
 
+    def search_with_count(self, size, page, sort_by="createdWhen", sort_order='ASC',
+                          cursor=None, depth="full", fields=None, **filters):
+        """Like search(), but return a tuple (result, total_hits).
+
+        total_hits is the number of all objects matching filters (what
+        count(**filters) returns).
+
+        This method SHOULD be overriden if the connector can compute the
+        result page and the total number of hits in one go (eg. using a
+        `COUNT(*) OVER ()` window). The default implementation simply
+        calls search() and count().
+
+        :return: a tuple containing the list of objects and the number of
+                 all matching objects
+        :rtype: tuple
+        """
+        result = self.search(size, page, sort_by, sort_order, cursor=cursor, depth=depth,
+                             fields=fields, **filters)
+        total_hits = self.count(**filters) if result else 0
+        return result, total_hits
+
+    def export(self, batch_size=200, fields=None, **filters):
+        """Return a generator over all objects matching filters (ordered by id).
+
+        Used for streaming exports of the full dataset. The objects are
+        fetched in batches of batch_size objects. Each batch continues
+        directly after the last id of the previous batch (keyset paging),
+        so no OFFSET queries or counts are needed and memory usage does
+        not depend on the size of the result. Objects which are not changed
+        during the export are returned exactly once.
+
+        This method MAY be overriden by a custom implementation. The default
+        implementation uses search() with a cursor.
+
+        :param batch_size: number of objects fetched with one query
+        :type batch_size: int
+        :param fields: a list of field names to return (see get()). If None, all
+                  fields are returned.
+        :type fields: list
+        :param **filters: **kwargs for filter parameter and values (and
+                  depth for factoids)
+        :return: a generator of IPIF dicts or IPIF documents as JSON text (str)
+        """
+        cursor = None
+        while True:
+            batch = self.search(batch_size, 1, "id", "ASC", cursor=cursor,
+                                fields=fields, **filters)
+            yield from batch
+            if len(batch) < batch_size:
+                break
+            last = batch[-1]
+            last_id = json.loads(last)["@id"] if isinstance(last, str) else last["@id"]
+            cursor = (last_id, last_id)
+
     def count(self, **filters):
         """Return number of objects matching filter conditions.
 
@@ -114,6 +242,27 @@ class AbstractConnector:
             )
         )
 
+    def update_many(self, objects):
+        """Create or update a list of objects (IPIF dicts containing an '@id').
+
+        Used for bulk imports. Return a list containing a (status, message)
+        tuple for each object: status is 'created', 'updated' or 'error';
+        message explains the error (or is None).
+
+        This method SHOULD be overriden if the connector can save many
+        objects in a single transaction. The default implementation calls
+        update() for each object.
+        """
+        result = []
+        for data in objects:
+            try:
+                exists = self.get(data["@id"], fields=["@id"]) is not None
+                self.update(data["@id"], data)
+                result.append(("updated" if exists else "created", None))
+            except Exception as err:  # pylint: disable=broad-except
+                result.append(("error", str(err)))
+        return result
+
     def delete(self, obj_id):
         """Delete an exsting object specified by object_id.
 
@@ -1,12 +1,14 @@
 """A papilotte connector to relational databases using the pony ORM
 """
 
+import functools
+
 from flask import current_app as app
 from pony import orm
 
 from papilotte.exceptions import ConfigurationError
 
-from . import database
+from . import database, fulltext, ids, jsonsql, lookupcache, orphans, pool
 from .factoid import FactoidConnector
 from .person import PersonConnector
 from .source import SourceConnector
@@ -50,15 +52,98 @@ def validate(configuration):
         raise ConfigurationError(
             "Invalid value for 'connector.provider': '{}".format(provider)
         )
+    serialization = configuration.get("serialization", "python")
+    if serialization not in ("python", "database"):
+        raise ConfigurationError(
+            "Invalid value for 'connector.serialization': '{}'".format(serialization)
+        )
+    if serialization == "database" and provider == "mysql":
+        raise ConfigurationError(
+            "'connector.serialization = database' is not supported for mysql"
+        )
+    configuration["serialization"] = serialization
+    use_fulltext = configuration.get("fulltext", False)
+    if isinstance(use_fulltext, str):  # set via environment
+        use_fulltext = use_fulltext.lower() in ("true", "yes", "on", "1")
+    configuration["fulltext"] = bool(use_fulltext)
+    id_style = configuration.get("idStyle", "hash")
+    if id_style not in ids.ID_STYLES:
+        raise ConfigurationError(
+            "Invalid value for 'connector.idStyle': '{}'".format(id_style)
+        )
+    configuration["idStyle"] = id_style
+    try:
+        cache_size = int(configuration.get("lookupCacheSize", lookupcache.MAX_SIZE))
+    except ValueError:
+        cache_size = -1
+    if cache_size < 0:
+        raise ConfigurationError(
+            "Invalid value for 'connector.lookupCacheSize': '{}'".format(
+                configuration["lookupCacheSize"])
+        )
+    configuration["lookupCacheSize"] = cache_size
+    use_gc = configuration.get("gc", False)
+    if isinstance(use_gc, str):  # set via environment
+        use_gc = use_gc.lower() in ("true", "yes", "on", "1")
+    configuration["gc"] = bool(use_gc)
+    for key, default, minimum in (("gcInterval", orphans.INTERVAL, 0),
+                                  ("gcBatchSize", orphans.BATCH_SIZE, 1)):
+        try:
+            value = int(configuration.get(key, default))
+        except ValueError:
+            value = minimum - 1
+        if value < minimum:
+            raise ConfigurationError(
+                "Invalid value for 'connector.{}': '{}'".format(key, configuration[key])
+            )
+        configuration[key] = value
+    validate_pool(configuration)
     return configuration
 
 
-def initialize(connector_cfg):
+def validate_pool(configuration):
+    """Validate the settings of the connection pool (see pool).
+
+    poolMaxSize 0 (the default) keeps one connection per thread.
+    """
+    for key, default, minimum in (("poolMinSize", 0, 0), ("poolMaxSize", 0, 0),
+                                  ("poolTimeout", pool.TIMEOUT, 0.001),
+                                  ("poolRecycle", 0, 0),
+                                  ("poolLogInterval", pool.LOG_INTERVAL, 0)):
+        convert = float if key == "poolTimeout" else int
+        try:
+            value = convert(configuration.get(key, default))
+        except ValueError:
+            value = minimum - 1
+        if value < minimum:
+            raise ConfigurationError(
+                "Invalid value for 'connector.{}': '{}'".format(key, configuration[key])
+            )
+        configuration[key] = value
+    if configuration["poolMaxSize"] and configuration["poolMinSize"] > configuration["poolMaxSize"]:
+        raise ConfigurationError(
+            "'connector.poolMinSize' must not be greater than 'connector.poolMaxSize'"
+        )
+    init_sql = configuration.get("poolInitSql", [])
+    if isinstance(init_sql, str):  # set via environment
+        init_sql = [sql for sql in init_sql.split(";") if sql.strip()]
+    configuration["poolInitSql"] = list(init_sql)
+
+
+def initialize(connector_cfg, create_tables=True, background=True):
     """Prepare database and put it into configuration.
+
+    If create_tables is False, missing tables and indexes are not created
+    (see create_indexes()). If background is False, no garbage collector
+    thread is started (eg. for command line tools).
     """
     new_config = {}
     if connector_cfg["provider"] == "sqlite":
-        db = database.make_db(provider="sqlite", filename=connector_cfg["filename"])
+        db = database.make_db(
+            provider="sqlite",
+            filename=connector_cfg["filename"],
+            create_tables=create_tables,
+        )
     elif connector_cfg["provider"] in ("postgresql", "mysql"):
         db = database.make_db(
             provider=connector_cfg["provider"],
@@ -67,7 +152,79 @@ def initialize(connector_cfg):
             user=connector_cfg["user"],
             password=connector_cfg["password"],
             database=connector_cfg["database"],
+            create_tables=create_tables,
         )
+        if connector_cfg.get("poolMaxSize"):
+            pool.install(
+                db,
+                min_size=connector_cfg.get("poolMinSize", 0),
+                max_size=connector_cfg["poolMaxSize"],
+                timeout=connector_cfg.get("poolTimeout", pool.TIMEOUT),
+                recycle=connector_cfg.get("poolRecycle", 0),
+                init_sql=connector_cfg.get("poolInitSql", []),
+            )
+    if connector_cfg.get("serialization") == "database" and not jsonsql.is_supported(db):
+        raise ConfigurationError(
+            "'connector.serialization = database' needs a database with JSON support"
+        )
+    if connector_cfg.get("fulltext"):
+        if not fulltext.is_supported(db):
+            raise ConfigurationError(
+                "'connector.fulltext' needs SQLite >= 3.34 (FTS5) or PostgreSQL (pg_trgm)"
+            )
+        fulltext.enable(db)
+    ids.set_style(db, connector_cfg.get("idStyle", "hash"))
+    lookupcache.configure(db, connector_cfg.get("lookupCacheSize", lookupcache.MAX_SIZE))
+    gc_batch_size = connector_cfg.get("gcBatchSize", orphans.BATCH_SIZE)
+    if connector_cfg.get("gc"):
+        orphans.enable(db)
+        interval = connector_cfg.get("gcInterval", orphans.INTERVAL)
+        if background and interval:
+            collect = functools.partial(database.collect_garbage, db, gc_batch_size)
+            orphans.Collector(collect, interval).start()
     new_config["db"] = db
+    log_interval = connector_cfg.get("poolLogInterval", pool.LOG_INTERVAL)
+    if background and log_interval and pool.stats(db) is not None:
+        pool.Reporter(functools.partial(pool_stats, new_config), log_interval).start()
+    new_config["gcBatchSize"] = gc_batch_size
+    new_config["serialization"] = connector_cfg.get("serialization", "python")
     return new_config
 
+
+def rebuild_fulltext_index(connector_cfg):
+    """Rebuild the full text index for the configured database.
+
+    Return a dict containing the number of indexed objects per entity.
+    """
+    db = connector_cfg["db"]
+    if not fulltext.is_supported(db):
+        raise ConfigurationError(
+            "A full text index needs SQLite >= 3.34 (FTS5) or PostgreSQL (pg_trgm)"
+        )
+    return fulltext.rebuild(db)
+
+
+def create_indexes(connector_cfg):
+    """Add all missing tables and indexes to the configured database.
+
+    Return a list of the names of the created indexes.
+    """
+    return database.create_indexes(connector_cfg["db"])
+
+
+def collect_garbage(connector_cfg, batch_size=None):
+    """Delete orphaned rows from the configured database.
+
+    batch_size defaults to 'connector.gcBatchSize'. Return a dict
+    containing the number of deleted rows per entity.
+    """
+    batch_size = batch_size or connector_cfg.get("gcBatchSize", orphans.BATCH_SIZE)
+    return database.collect_garbage(connector_cfg["db"], batch_size)
+
+
+def pool_stats(connector_cfg):
+    """Return the statistics of the connection pool (see pool.ConnectionPool.stats).
+
+    Return None if no connection pool is configured.
+    """
+    return pool.stats(connector_cfg["db"])
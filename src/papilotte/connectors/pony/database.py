@@ -4,15 +4,15 @@ Defines the ORM-Classes in function define_entities.
 Provides a make_db() function which returns a configured
 pony database object.
 """
-import copy
 import datetime
 import time
-import hashlib
-import json
 import logging
 import re
 
 from pony import orm
+
+from . import fulltext, ids, labelindex, lookupcache, orphans, upsert, versions
+
 logger = logging.getLogger(__name__)
 
 def fix_datetime(dt):
@@ -50,13 +50,16 @@ class IPIFMixin:
         """Create a new ORM object from ipif_data.
 
         If '@id' is set, this will be respected; otherwise an id will be generated.
+        ipif_data is not modified.
         """
-        data = copy.deepcopy(ipif_data)
-        obj_id = data.pop("@id") if "@id" in data else cls.make_id(data)
+        obj_id = ipif_data["@id"] if "@id" in ipif_data else cls.make_id(ipif_data)
 
         # we use update() for setting data to have code in a single place
         orm_obj = cls(id=obj_id)
-        orm_obj.update_from_ipif(data)
+        if not orm_obj.update_from_ipif(ipif_data):
+            # an object without any data is a change, too
+            fulltext.update(cls._database_, orm_obj)
+            touch(cls._database_)
         return orm_obj
 
     def to_ipif(self):
@@ -82,36 +85,105 @@ class IPIFMixin:
 
     @classmethod
     def make_id(cls, data, extra=""):
-        """Generate a string id based on the hashed data.
-        Try to keep it short.
+        """Generate a string id for data.
+
+        Depending on the id style of the database this is a short hash of
+        data or a random uuid (see ids).
         """
-        d_str = json.dumps(data, default=str).encode("utf-8")
-        d_str += extra.encode("utf-8")
-        full_hash = hashlib.sha256(d_str).hexdigest()
-        for i in range(4, len(full_hash)):
-            if cls.get(id=full_hash[:i]) is None:
-                return full_hash[:i]
-        # if we did not find an unused id, we add the current timestamp and retry
-        return cls.make_id(data, datetime.datetime.now().isoformat())
+        return ids.allocator(cls._database_).make_id(cls, data, extra)
+
+
+def has_single_reference(collection):
+    """Return True if collection (eg. Role.statements) contains exactly one
+    object.
+
+    At most two rows are fetched, so popular lookup objects (referenced by
+    thousands of statements) are checked without loading the collection.
+    """
+    return len(collection.select()[:2]) == 1
+
+
+def lookup_changed(obj, deleted=False):
+    """Register a new or deleted row of a lookup table with the label index
+    (see labelindex) and the lookup cache (see lookupcache).
+
+    obj must have been flushed (needs an id). Deleted objects must be
+    registered before calling delete().
+    """
+    versions.changed(obj._database_, obj.__class__.__name__)
+    if isinstance(obj, LabelUriMixin):
+        labelindex.changed(obj, deleted)
+    lookupcache.changed(obj, deleted)
+
+
+def get_or_create_lookup(entity, **values):
+    """Return the row of lookup table entity with values (eg. label and uri).
+    If no such row exists, it will be created.
+
+    The row is looked up in the lookup cache first. Missing rows are
+    inserted with a single upsert if the table has a unique index (see
+    upsert).
+    """
+    obj = lookupcache.get(entity, tuple(values[name] for name in entity.lookup_key))
+    if obj is not None:
+        return obj
+    if upsert.is_enabled(entity):
+        obj = upsert.insert(entity, values)
+        if obj is not None:
+            lookup_changed(obj)
+            return obj
+    obj = entity.get(**values)
+    if obj:
+        lookupcache.add(obj)
+    else:
+        obj = entity(**values)
+        # we need the id for the label index and the lookup cache
+        obj.flush()
+        lookup_changed(obj)
+    return obj
+
 
+class LookupMixin:
+    """Mixin class for the lookup tables (Date, Role, PersonURI etc.).
 
-class LabelUriMixin:
+    Their rows are shared by many objects and deleted when no object uses
+    them any more. If garbage collection is enabled, this is left to the
+    garbage collector (see orphans).
+    """
+
+    # attributes identifying a row (see lookupcache)
+    lookup_key = ()
+    # the collection of objects using a row
+    references = "statements"
+
+    def safe_delete(self):
+        "Delete object, but only if it not referenced by other objects."
+        if orphans.is_enabled(self._database_):
+            return
+        if has_single_reference(getattr(self, self.references)):
+            lookup_changed(self, deleted=True)
+            self.delete()
+
+    def delete_if_unused(self):
+        "Delete object if it is not referenced by any object (any more)."
+        if orphans.is_enabled(self._database_):
+            return
+        if getattr(self, self.references).is_empty():
+            lookup_changed(self, deleted=True)
+            self.delete()
+
+
+class LabelUriMixin(LookupMixin):
     "Mixin class for all entities existing of uri and label"
 
+    lookup_key = ("label", "uri")
+
     @classmethod
     def get_or_create(cls, label="", uri=""):
         """Return an object with this combination of label and uri.
         If no such object exists, it will be created.
         """
-        role = cls.get(label=label, uri=uri)
-        if not role:
-            role = cls(label=label, uri=uri)
-        return role
-
-    def safe_delete(self):
-        "Delete object, but only if it not referenced by other objects."
-        if len(self.statements) == 1:
-            self.delete()
+        return get_or_create_lookup(cls, label=label, uri=uri)
 
     def to_ipif(self):
         "Return role as IPIF-config dict."
@@ -123,6 +195,128 @@ class LabelUriMixin:
         return ipif_dict
 
 
+class URIMixin(LookupMixin):
+    "Mixin class for the uri entities (PersonURI etc.)"
+
+    lookup_key = ("uri",)
+
+    @classmethod
+    def get_or_create(cls, uri):
+        """Return the object for uri.
+        If no such object exists, it will be created.
+        """
+        return get_or_create_lookup(cls, uri=uri)
+
+    def to_ipif(self):
+        "Return object in an IPIF-config way."
+        return self.uri
+
+
+def to_datetime(value):
+    """Return the ISO date string value as datetime (None for '').
+
+    Values which cannot be parsed are returned unchanged (pony validates them).
+    """
+    if not value:
+        return None
+    value = fix_datetime(value)
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return value
+
+
+def ipif_kwargs(ipif_data):
+    """Return a shallow copy of ipif_data without '@id' (and 'id').
+
+    The ingestion methods only replace top level values of the returned
+    dict and never change nested values, so the (possibly large) IPIF
+    document does not have to be copied.
+    """
+    return {key: value for key, value in ipif_data.items() if key not in ("@id", "id")}
+
+
+def set_changed(obj, data):
+    """Set only those attributes of obj in data which have a different value.
+
+    createdWhen and modifiedWhen are converted to datetimes before comparing.
+    Return True if any attribute was changed.
+    """
+    for key in ("createdWhen", "modifiedWhen"):
+        if key in data:
+            data[key] = to_datetime(data[key])
+    # unknown attributes are passed to set(), which raises a TypeError
+    changed = {key: value for key, value in data.items()
+               if key not in obj._adict_ or getattr(obj, key) != value}
+    if changed:
+        obj.set(**changed)
+    return bool(changed)
+
+
+def update_uris(collection, entity, uris):
+    """Make collection (eg. Person.uris) contain exactly the uris in uris.
+
+    Only added and removed uris are written. Removed uri objects are deleted
+    if no other object uses them. Return True if collection was changed.
+    """
+    current = {item.uri: item for item in collection}
+    removed = [item for uri, item in current.items() if uri not in uris]
+    added = [entity.get_or_create(uri)
+             for uri in dict.fromkeys(uris) if uri not in current]
+    if removed:
+        collection.remove(removed)
+        for item in removed:
+            item.delete_if_unused()
+    if added:
+        collection.add(added)
+    return bool(removed or added)
+
+
+def update_lookup(obj, attr, entity, value):
+    """Set attribute attr of statement obj to the lookup object (eg. a Role)
+    for value (a dict like {'label': .., 'uri': ..} or None).
+
+    Nothing is written if the current object has the same values. The old
+    object is deleted if it is not used any more. Return True if changed.
+    """
+    current = getattr(obj, attr)
+    if value is None:
+        if current is None:
+            return False
+        new = None
+    else:
+        if current is not None and current.to_ipif() == {k: v for k, v in value.items() if v}:
+            return False
+        new = entity.get_or_create(**value)
+        if new == current:
+            return False
+    setattr(obj, attr, new)
+    if current is not None:
+        current.delete_if_unused()
+    return True
+
+
+def update_lookups(collection, entity, values):
+    """Make collection (eg. Statement.places) contain exactly the lookup
+    objects for values (a list of dicts like {'label': .., 'uri': ..}).
+
+    Unchanged objects are kept, removed ones are deleted if not used any more.
+    Return True if collection was changed.
+    """
+    current = {(item.label, item.uri): item for item in collection}
+    wanted = {(value.get("label", ""), value.get("uri", "")): value for value in values}
+    removed = [item for key, item in current.items() if key not in wanted]
+    added = [entity.get_or_create(**value)
+             for key, value in wanted.items() if key not in current]
+    if removed:
+        collection.remove(removed)
+        for item in removed:
+            item.delete_if_unused()
+    if added:
+        collection.add(added)
+    return bool(removed or added)
+
+
 def define_entities(db):
     """Define all entities for db.
 
@@ -144,30 +338,24 @@ def define_entities(db):
             """Update Person using `ipifdata`.
 
             `ipifdata` is a IPIF conform dict.
+            Only changed values are written. Return True if anything was changed.
             """
-            data = copy.deepcopy(ipifdata)
-            # id must not be overwritten
-            data.pop("@id", None)
-            data.pop("id", None)
-            # Delete and recreate all uris to avoid orphaned uris
-            for uri in self.uris:
-                uri.safe_delete()
-                db.flush()
-            data["uris"] = [
-                PersonURI.get_for_update(uri=u) or PersonURI(uri=u) for u in data.get("uris", [])
-            ]
-            if data.get('createdWhen', ''):
-                data['createdWhen'] = fix_datetime(data['createdWhen'])
-            if data.get('modifiedWhen', ''):
-                data['modifiedWhen'] = fix_datetime(data['modifiedWhen'])
-            self.set(**data)
+            data = ipif_kwargs(ipifdata)
+            changed = update_uris(self.uris, PersonURI, data.pop("uris", []))
+            changed = set_changed(self, data) or changed
+            if changed:
+                fulltext.update(db, self)
+                touch(db)
+            return changed
 
         def deep_delete(self):
             """Like delete() but also removes PersonURIs if orphaned.
             """
             for uri in self.uris:
                 uri.safe_delete()
-            if self.factoids == []:
+            if self.factoids.is_empty():
+                fulltext.remove(db, self)
+                touch(db)
                 self.delete()
 
     class Source(db.Entity, IPIFMixin):
@@ -185,29 +373,24 @@ def define_entities(db):
             """Update Source using `ipifdata`.
 
             `ipifdata` is a IPIF conform dict.
+            Only changed values are written. Return True if anything was changed.
             """
-            data = copy.deepcopy(ipifdata)
-            # id must not be overwritten
-            data.pop("@id", None)
-            data.pop("id", None)
-            for uri in self.uris:
-                uri.safe_delete()
-                db.flush()
-            data["uris"] = [
-                SourceURI.get(uri=u) or SourceURI(uri=u) for u in data.get("uris", [])
-            ]
-            if data.get('createdWhen', ''):
-                data['createdWhen'] = fix_datetime(data['createdWhen'])
-            if data.get('modifiedWhen', ''):
-                data['modifiedWhen'] = fix_datetime(data['modifiedWhen'])
-            self.set(**data)
+            data = ipif_kwargs(ipifdata)
+            changed = update_uris(self.uris, SourceURI, data.pop("uris", []))
+            changed = set_changed(self, data) or changed
+            if changed:
+                fulltext.update(db, self)
+                touch(db)
+            return changed
 
         def deep_delete(self):
             """Like delete but also removes orphaned SourceURIs.
             """
             for uri in self.uris:
                 uri.safe_delete()
-            if self.factoids == []:
+            if self.factoids.is_empty():
+                fulltext.remove(db, self)
+                touch(db)
                 self.delete()
 
     class Statement(db.Entity, IPIFMixin):
@@ -232,61 +415,26 @@ def define_entities(db):
         def update_from_ipif(self, ipifdata):
             """Update Statement using `ipifdata`.
 
-            `ipifdata` is a IPIF conform dict.
+            `ipifdata` is a IPIF conform dict. Lookup objects (date, role,
+            places etc.) with unchanged values are kept, only changed values
+            are written. Return True if anything was changed.
             """
-            data = copy.deepcopy(ipifdata)
-            # id must not be overwritten
-            data.pop("@id", None)
-            data.pop("id", None)
+            data = ipif_kwargs(ipifdata)
+            changed = False
             # handle related tables
-            if self.date is not None:
-                self.date.safe_delete()
-            if "date" in data:
-                data["date"] = Date.get_or_create(**data["date"])
-
-            if self.role is not None:
-                self.role.safe_delete()
-            if "role" in data:
-                data["role"] = Role.get_or_create(**data["role"])
-
-            if self.memberOf is not None:
-                self.memberOf.safe_delete()
-            if "memberOf" in data:
-                data["memberOf"] = MemberGroup.get_or_create(**data["memberOf"])
-
-            if self.statementType is not None:
-                self.statementType.safe_delete()
-            if "statementType" in data:
-                data["statementType"] = StatementType.get_or_create(
-                    **data["statementType"]
-                )
-
+            for attr, entity in (("date", Date), ("role", Role), ("memberOf", MemberGroup),
+                                 ("statementType", StatementType)):
+                changed = update_lookup(self, attr, entity, data.pop(attr, None)) or changed
             # n:m
-            for place in self.places:
-                place.safe_delete()
-            for rel_pers in self.relatesToPersons:
-                rel_pers.safe_delete()
-            for uri in self.uris:
-                uri.safe_delete()
-            db.flush()
-            if "places" in data:
-                data["places"] = [
-                    Place.get_or_create(**place) for place in data["places"]
-                ]
-            if "relatesToPersons" in data:
-                data["relatesToPersons"] = [
-                    RelatesToPerson.get_or_create(**pers)
-                    for pers in data["relatesToPersons"]
-                ]
-            if "uris" in data:
-                data["uris"] = [
-                    StatementURI.get(uri=u) or StatementURI(uri=u) for u in data["uris"]
-                ]
-            if data.get('createdWhen', ''):
-                data['createdWhen'] = fix_datetime(data['createdWhen'])
-            if data.get('modifiedWhen', ''):
-                data['modifiedWhen'] = fix_datetime(data['modifiedWhen'])
-            self.set(**data)
+            for attr, entity in (("places", Place), ("relatesToPersons", RelatesToPerson)):
+                changed = update_lookups(
+                    getattr(self, attr), entity, data.pop(attr, [])) or changed
+            changed = update_uris(self.uris, StatementURI, data.pop("uris", [])) or changed
+            changed = set_changed(self, data) or changed
+            if changed:
+                fulltext.update(db, self)
+                touch(db)
+            return changed
 
         def to_ipif(self):
             "Return a ORM object as IPIF-conform dictionary."
@@ -318,11 +466,12 @@ def define_entities(db):
                 )  ##mk_label_uri_dict(data['statementType'])
             data["uris"] = sorted([u.to_ipif() for u in self.uris])
             data["places"] = sorted(
-                [p.to_ipif() for p in self.places], key=lambda x: x.get("label", "")
+                [p.to_ipif() for p in self.places],
+                key=lambda x: (x.get("label", ""), x.get("uri", "")),
             )
             data["relatesToPersons"] = sorted(
                 [rp.to_ipif() for rp in self.relatesToPersons],
-                key=lambda x: x.get("label", ""),
+                key=lambda x: (x.get("label", ""), x.get("uri", "")),
             )
             data["factoid-refs"] =[]
             if self.factoid:
@@ -333,26 +482,18 @@ def define_entities(db):
 
         def deep_delete(self):
             """Like delete but also removes orphaned referenced entries from other tables.
+
+            The statement is deleted first: deleting a referenced object before
+            would change the statement and make its deletion fail.
             """
-            if self.uris:
-                for uri in self.uris:
-                    uri.safe_delete()
-            if self.relatesToPersons:
-                for rel_pers in self.relatesToPersons:
-                    rel_pers.safe_delete()
-            if self.places:
-                for place in self.places:
-                    place.safe_delete()
-            if self.date:
-                self.date.safe_delete()
-            if self.role:
-                self.role.safe_delete()
-            if self.statementType:
-                self.statementType.safe_delete()
-            if self.memberOf:
-                self.memberOf.safe_delete()
-            #if self.factoid is None:
+            referenced = [self.date, self.role, self.statementType, self.memberOf]
+            referenced += list(self.uris) + list(self.relatesToPersons) + list(self.places)
+            fulltext.remove(db, self)
+            touch(db)
             self.delete()
+            for obj in referenced:
+                if obj is not None:
+                    obj.delete_if_unused()
 
     class Factoid(db.Entity, IPIFMixin):
         "A Factoid ORM entitiy."
@@ -370,9 +511,12 @@ def define_entities(db):
 
         @classmethod
         def create_from_ipif(cls, ipif_data):
-            "Create a factoid from a IPIF conform dictionary."
-            data = copy.deepcopy(ipif_data)
-            data["id"] = data.pop("@id") if "@id" in data else cls.make_id(data)
+            """Create a factoid from a IPIF conform dictionary.
+
+            ipif_data is not modified.
+            """
+            data = ipif_kwargs(ipif_data)
+            data["id"] = ipif_data["@id"] if "@id" in ipif_data else cls.make_id(ipif_data)
 
             data["person"] = Person.get(
                 id=data["person"]["@id"]
@@ -385,42 +529,58 @@ def define_entities(db):
                 data['createdWhen'] = fix_datetime(data['createdWhen'])
             if data.get('modifiedWhen', ''):
                 data['modifiedWhen'] = fix_datetime(data['modifiedWhen'])
-            return cls(**data)
+            factoid = cls(**data)
+            fulltext.update(db, factoid)
+            touch(db)
+            return factoid
 
         def update_from_ipif(self, ipifdata):
             """Update Factoid from IPIF conform json-like dict.
-            """
-            data = copy.deepcopy(ipifdata)
-            # id must not be overwritten
-            data.pop("@id", None)
-            data.pop("id", None)
-
-
-            if self.person.id == data["person"]["@id"]:
-                # Update data for existing person
-                self.person.update_from_ipif(data.pop("person"))
-            else:  # remove old person and a the new one
-                self.person.deep_delete()
-                # db.flush("places)
-                self.person = Person.create_from_ipif(data.pop("person"))
-
-            if self.source.id == data["source"]["@id"]:
-                # Update data for existing source
-                self.source.update_from_ipif(data.pop("source"))
-            else:  # remove old source and a the new one
-                self.source.deep_delete()
-                self.source = Source.create_from_ipif(data.pop("source"))
 
-            for stmt in self.statements:
-                stmt.deep_delete()
-            db.flush()
-            for stmt in data.pop('statements'):
-                self.statements.add(Statement.create_from_ipif(stmt))
-            if data.get('createdWhen', ''):
-                data['createdWhen'] = fix_datetime(data['createdWhen'])
-            if data.get('modifiedWhen', ''):
-                data['modifiedWhen'] = fix_datetime(data['modifiedWhen'])
-            self.set(**data)
+            Only the differences to the stored factoid are written.
+            Statements are matched by their '@id': existing statements are
+            updated, missing ones are deleted and new ones created. A person
+            or source containing only an '@id' is a reference and is not
+            updated. Return True if anything was changed.
+            """
+            data = ipif_kwargs(ipifdata)
+            changed = False
+            for attr, entity in (("person", Person), ("source", Source)):
+                new_data = data.pop(attr)
+                current = getattr(self, attr)
+                if current.id == new_data["@id"]:
+                    if len(new_data) > 1:
+                        # Update data for existing person/source
+                        changed = current.update_from_ipif(new_data) or changed
+                else:
+                    # use the new person/source, remove the old one if orphaned
+                    setattr(self, attr, entity.get(id=new_data["@id"])
+                            or entity.create_from_ipif(new_data))
+                    if orphans.is_enabled(db):
+                        orphans.defer(current)
+                    elif current.factoids.is_empty():
+                        current.deep_delete()
+                    changed = True
+
+            current = {stmt.id: stmt for stmt in self.statements}
+            kept = set()
+            for stmt_data in data.pop('statements'):
+                stmt = current.get(stmt_data.get("@id"))
+                if stmt is None:
+                    self.statements.add(Statement.create_from_ipif(stmt_data))
+                    changed = True
+                else:
+                    kept.add(stmt.id)
+                    changed = stmt.update_from_ipif(stmt_data) or changed
+            for stmt_id, stmt in current.items():
+                if stmt_id not in kept:
+                    stmt.deep_delete()
+                    changed = True
+            changed = set_changed(self, data) or changed
+            if changed:
+                fulltext.update(db, self)
+                touch(db)
+            return changed
 
         def to_ipif(self):
             "Return a ORM object as IPIF-conform dictionary."
@@ -437,7 +597,7 @@ def define_entities(db):
             data["person"] = self.person.to_ipif()
             data["source"] = self.source.to_ipif()
             data['statements'] = []
-            for stmt in self.statements:
+            for stmt in self.statements.order_by(lambda s: s.id):
                 data["statements"].append(stmt.to_ipif())
             data["person-ref"] = {'@id': self.person.id}
             data["source-ref"] = {'@id': self.source.id}
@@ -461,18 +621,30 @@ def define_entities(db):
 
         def deep_delete(self):
             """Like delete but also removes orphaned referenced entries from other tables.
+
+            If garbage collection is enabled, person, source and statements
+            are only recorded as candidates for the garbage collector.
             """
+            if orphans.is_enabled(db):
+                for obj in [self.person, self.source] + list(self.statements):
+                    orphans.defer(obj)
+                fulltext.remove(db, self)
+                touch(db)
+                self.delete()
+                return
             p_id = self.person.id
             s_id = self.source.id
             stmt_ids = [stmt.id for stmt in self.statements]
+            fulltext.remove(db, self)
+            touch(db)
             self.delete()
 
             person = Person[p_id]
-            if person.factoids.count() == 0:
+            if person.factoids.is_empty():
                 person.deep_delete()
 
             source = Source[s_id]
-            if source.factoids.count() == 0:
+            if source.factoids.is_empty():
                 source.deep_delete()
 
             for stmt_id in stmt_ids:
@@ -480,18 +652,15 @@ def define_entities(db):
                 if statement.factoid is None:
                     statement.deep_delete()
 
-    class Date(db.Entity):
+    class Date(db.Entity, LookupMixin):
         "A Date ORM entitiy as used in Statement."
         # we need an explicit id as all other fields are optional
         id = orm.PrimaryKey(int, auto=True)
-        sortDate = orm.Optional(datetime.date)
+        sortDate = orm.Optional(datetime.date, index=True)
         label = orm.Optional(str)
         statements = orm.Set(Statement)
 
-        def safe_delete(self):
-            "Delete object, but only if it not referenced by any other object."
-            if len(self.statements) == 1:
-                self.delete()
+        lookup_key = ("label", "sortDate")
 
         @classmethod
         def get_or_create(cls, label="", sortDate=None):
@@ -501,10 +670,12 @@ def define_entities(db):
             # IPIF allows '' as sortDate, but Pony wants a Date or None
             if sortDate is not None and sortDate == "":
                 sortDate = None
-            date = cls.get(label=label, sortDate=sortDate)
-            if not date:
-                date = cls(label=label, sortDate=sortDate)
-            return date
+            if isinstance(sortDate, str):
+                try:
+                    sortDate = datetime.date.fromisoformat(sortDate)
+                except ValueError:
+                    pass  # pony raises a proper error
+            return get_or_create_lookup(cls, label=label, sortDate=sortDate)
 
         def to_ipif(self):
             "Return date as IPIF-config dict."
@@ -558,7 +729,27 @@ def define_entities(db):
         label = orm.Optional(str)
         statements = orm.Set(Statement)
 
-    class PersonURI(db.Entity):
+    class ChangeLog(db.Entity):
+        """A committed change of data or of a lookup table (see versions).
+
+        name is versions.DATA or the name of the lookup table.
+        """
+
+        id = orm.PrimaryKey(int, auto=True)
+        name = orm.Required(str)
+
+    class GcCandidate(db.Entity):
+        """A Person, Source or Statement which might be orphaned.
+
+        Recorded instead of deleting orphans if garbage collection is
+        enabled (see orphans).
+        """
+
+        entity_name = orm.Required(str)
+        obj_id = orm.Required(str)
+        orm.PrimaryKey(entity_name, obj_id)
+
+    class PersonURI(db.Entity, URIMixin):
         """A PersonURI ORM entitiy as used in Person.
 
         A Person can have any number of uris.
@@ -567,16 +758,9 @@ def define_entities(db):
         uri = orm.PrimaryKey(str)
         persons = orm.Set(Person)
 
-        def safe_delete(self):
-            "Delete uri, but only if it is not referenced from any other person."
-            if len(self.persons) == 1:
-                self.delete()
+        references = "persons"
 
-        def to_ipif(self):
-            "Return object in an IPIF-config way."
-            return self.uri
-
-    class SourceURI(db.Entity):
+    class SourceURI(db.Entity, URIMixin):
         """A SourceURI ORM entitiy as used in Source.
 
         A Source can have any number of uris.
@@ -585,16 +769,9 @@ def define_entities(db):
         uri = orm.PrimaryKey(str)
         sources = orm.Set(Source)
 
-        def safe_delete(self):
-            "Delete uri, but only if it is not referenced from any other source"
-            if len(self.sources) == 1:
-                self.delete()
+        references = "sources"
 
-        def to_ipif(self):
-            "Return object in an IPIF-config way."
-            return self.uri
-
-    class StatementURI(db.Entity):
+    class StatementURI(db.Entity, URIMixin):
         """A StatementURI ORM entitiy as used in Statement.
 
         A Statement can have any number of uris.
@@ -603,20 +780,134 @@ def define_entities(db):
         uri = orm.PrimaryKey(str)
         statements = orm.Set(Statement)
 
-        def safe_delete(self):
-            "Delete uri, but only if it is not referenced from any other statement."
-            if len(self.statements) == 1:
-                self.delete()
 
-        def to_ipif(self):
-            "Return object in an IPIF-config way."
-            return self.uri
+def touch(db):
+    """Register a change of the data in the current transaction (see versions).
+
+    Must be called inside the db_session changing the data.
+    """
+    versions.changed(db, versions.DATA)
+
+
+def collect_garbage(db, batch_size=orphans.BATCH_SIZE):
+    """Delete orphaned rows (see orphans).
+
+    First the orphaned candidates (statements, persons and sources) are
+    deleted, then all unused rows of the lookup tables. Each batch of
+    batch_size rows is deleted in its own transaction. Return a dict
+    containing the number of deleted rows per entity.
+    """
+    stats = {}
+    for entity_name, owner in orphans.CANDIDATES.items():
+        entity = db.entities[entity_name]
+        deleted = 0
+        while True:
+            with orm.db_session:
+                result = orphans.delete_candidates(entity, owner, batch_size)
+                if result is None:
+                    break
+                if result:
+                    touch(db)
+            deleted += result
+        stats[entity_name] = deleted
+    lookup_tables = [entity for entity in db.entities.values() if issubclass(entity, LookupMixin)]
+    for entity in lookup_tables:
+        entity_name = entity.__name__
+        deleted = 0
+        while True:
+            with orm.db_session:
+                result = orphans.delete_unreferenced(entity, entity.references, batch_size)
+                if result:
+                    versions.changed(db, entity_name)
+            deleted += result
+            if result < batch_size:
+                break
+        stats[entity_name] = deleted
+    return stats
+
+
+def write_version(db):
+    "Return the write version of db (0 for a new database)."
+    with orm.db_session:
+        return versions.stored(db, versions.DATA)
+
+
+# Indexes in addition to those created by pony (primary keys, foreign keys
+# and join tables) as {entity_name: [attribute names, ...]}.
+# They are added to the schema after mapping, because pony makes all optional
+# attributes of a composite_index() nullable, which changes '' to None for
+# strings.
+INDEXES = {
+    # the sort orders used by search() (id is always the last sort field)
+    "Person": [
+        ("createdWhen", "id"),
+        ("modifiedWhen", "id"),
+        ("createdBy", "id"),
+        ("modifiedBy", "id"),
+    ],
+    "Source": [
+        ("createdWhen", "id"),
+        ("modifiedWhen", "id"),
+        ("createdBy", "id"),
+        ("modifiedBy", "id"),
+    ],
+    "Statement": [
+        ("createdWhen", "id"),
+        ("modifiedWhen", "id"),
+        ("createdBy", "id"),
+        ("modifiedBy", "id"),
+    ],
+    "Factoid": [
+        ("createdWhen", "id"),
+        ("modifiedWhen", "id"),
+        ("createdBy", "id"),
+        ("modifiedBy", "id"),
+    ],
+    # the versions (see versions.stored())
+    "ChangeLog": [("name", "id")],
+}
+
+# Unique indexes on the natural keys of the lookup tables (see upsert).
+# They are not part of the pony schema: see create_unique_indexes().
+UNIQUE_INDEXES = {
+    "Role": ("label", "uri"),
+    "MemberGroup": ("label", "uri"),
+    "StatementType": ("label", "uri"),
+    "Place": ("label", "uri"),
+    "RelatesToPerson": ("label", "uri"),
+    "Date": ("label", "sortDate"),
+}
+
+
+def declare_indexes(db):
+    "Add the indexes defined in INDEXES to the schema of db."
+    for entity_name, indexes in INDEXES.items():
+        entity = db.entities[entity_name]
+        table = db.schema.tables[entity._table_]
+        for attr_names in indexes:
+            columns = tuple(
+                table.column_dict[column]
+                for name in attr_names
+                for column in entity._adict_[name].columns
+            )
+            table.add_index(None, columns)
 
 
 def make_db(
-    provider="sqlite", filename="", host="", port="", user="", password="", database=""
+    provider="sqlite",
+    filename="",
+    host="",
+    port="",
+    user="",
+    password="",
+    database="",
+    create_tables=True,
 ):
-    "Return a Pony db object based on the parameters."
+    """Return a Pony db object based on the parameters.
+
+    If create_tables is True, missing tables and (non unique) indexes are
+    created. Otherwise the database is used as it is (see create_indexes()).
+    """
     db = orm.Database()
     if provider == "sqlite":
         if filename:
@@ -633,5 +924,160 @@ def make_db(
             database=database,
         )
     define_entities(db)
-    db.generate_mapping(create_tables=True)
+    db.generate_mapping(create_tables=False, check_tables=False)
+    versions.install(db)
+    declare_indexes(db)
+    if create_tables:
+        db.create_tables(check_tables=True)
+        create_unique_indexes(db)
+    else:
+        enable_upserts(db)
     return db
+
+
+def unique_index_commands(db, entity_name):
+    """Return a list of (index name, CREATE command) tuples for the unique
+    indexes of lookup table entity_name.
+
+    NULL values are distinct in unique indexes, so keys containing a
+    nullable column (Date.sortDate) need an extra partial index for the
+    rows where this column is NULL. MySQL does not support partial indexes.
+    """
+    entity = db.entities[entity_name]
+    quote_name = db.provider.quote_name
+    attrs = [entity._adict_[name] for name in UNIQUE_INDEXES[entity_name]]
+
+    def command(columns, where=""):
+        name = "uq_{}__{}".format(entity._table_.lower(), "_".join(columns).lower())
+        return name, "CREATE UNIQUE INDEX {} ON {} ({}){}".format(
+            quote_name(name), quote_name(entity._table_),
+            ", ".join(quote_name(column) for column in columns), where)
+
+    commands = [command([attr.column for attr in attrs])]
+    nullable = [attr.column for attr in attrs if attr.nullable]
+    if nullable and db.provider.dialect != "MySQL":
+        where = " WHERE " + " AND ".join(
+            "{} IS NULL".format(quote_name(column)) for column in nullable)
+        commands.append(command(
+            [attr.column for attr in attrs if not attr.nullable], where))
+    return commands
+
+
+def _missing_unique_indexes(db, entity_name):
+    "Return the (name, command) tuples of the missing unique indexes of entity_name."
+    connection = db.get_connection()
+    table_name = db.entities[entity_name]._table_
+    return [
+        (name, command)
+        for name, command in unique_index_commands(db, entity_name)
+        if db.provider.index_exists(connection, table_name, name, case_sensitive=False) is None
+    ]
+
+
+def _use_upserts(db, entity_name, missing):
+    "Return True if lookup table entity_name can use upserts."
+    entity = db.entities[entity_name]
+    complete = db.provider.dialect != "MySQL" or not any(
+        entity._adict_[name].nullable for name in UNIQUE_INDEXES[entity_name])
+    return complete and not missing and upsert.is_supported(db)
+
+
+def enable_upserts(db):
+    "Use upserts for all lookup tables of db having their unique indexes."
+    with orm.db_session:
+        for entity_name in UNIQUE_INDEXES:
+            missing = _missing_unique_indexes(db, entity_name)
+            upsert.enable(db, entity_name, _use_upserts(db, entity_name, missing))
+
+
+def has_duplicates(db, entity_name):
+    """Return True if lookup table entity_name contains rows with the same
+    key. Must be called inside a db_session.
+    """
+    entity = db.entities[entity_name]
+    quote_name = db.provider.quote_name
+    columns = ", ".join(quote_name(entity._adict_[name].column)
+                        for name in UNIQUE_INDEXES[entity_name])
+    return bool(db.select("SELECT 1 FROM {} GROUP BY {} HAVING COUNT(*) > 1 LIMIT 1".format(
+        quote_name(entity._table_), columns)))
+
+
+def merge_duplicates(db, entity_name):
+    """Merge all rows of lookup table entity_name with the same key into
+    the row with the lowest id.
+
+    The statements referencing a duplicate are moved to the remaining row.
+    Return the number of deleted rows. Must be called inside a db_session.
+    """
+    entity = db.entities[entity_name]
+    kept = {}
+    deleted = 0
+    for obj in entity.select().order_by(entity.id):
+        key = lookupcache.key_of(obj)
+        if key not in kept:
+            kept[key] = obj
+            continue
+        kept[key].statements.add(list(obj.statements))
+        lookup_changed(obj, deleted=True)
+        obj.delete()
+        deleted += 1
+    return deleted
+
+
+def create_unique_indexes(db, merge=False):
+    """Create the missing unique indexes of the lookup tables (see
+    UNIQUE_INDEXES) and use upserts for the tables having them.
+
+    Tables containing duplicates are skipped, unless merge is True: then
+    the duplicates are merged before creating the index (see
+    merge_duplicates()). Return a list of the names of the created indexes.
+    """
+    created = []
+    with orm.db_session:
+        for entity_name in UNIQUE_INDEXES:
+            missing = _missing_unique_indexes(db, entity_name)
+            if missing and has_duplicates(db, entity_name):
+                if not merge:
+                    logger.warning(
+                        "Table %s contains duplicates, run 'papilotte db create-indexes'",
+                        entity_name)
+                    upsert.enable(db, entity_name, False)
+                    continue
+                logger.info("Merged %d duplicates in table %s",
+                            merge_duplicates(db, entity_name), entity_name)
+                # the ORM has to write the changes before the index is created
+                orm.flush()
+            for name, command in missing:
+                db.execute(command)
+                created.append(name)
+            upsert.enable(db, entity_name, _use_upserts(db, entity_name, []))
+    return created
+
+
+def create_indexes(db):
+    """Create all tables and indexes declared by the entities which do not
+    exist in db yet.
+
+    Existing tables and data are kept. Duplicates in the lookup tables are
+    merged (see create_unique_indexes()). Return a list of the names of
+    the created indexes.
+    """
+    provider = db.provider
+    created = []
+    with orm.db_session:
+        connection = db.get_connection()
+        missing = [
+            index
+            for table in db.schema.tables.values()
+            for index in table.indexes.values()
+            if not index.is_pk and index.name is not None
+            and index.exists(provider, connection, case_sensitive=False) is None
+        ]
+        # creates missing tables and (like pony does) their non unique indexes
+        db.schema.create_tables(provider, connection)
+        for index in sorted(missing, key=lambda index: index.name):
+            if index.exists(provider, connection, case_sensitive=False) is None:
+                index.create(provider, connection)
+            created.append(index.name)
+        db.commit()
+    return created + create_unique_indexes(db, merge=True)
@@ -3,13 +3,26 @@
 import datetime
 
 from pony import orm
-# This is important as using orm.desc in a query leads to an Exception
-from pony.orm import desc
 
 from papilotte.connectors.abstractconnector import AbstractConnector
 from papilotte.exceptions import CreationException, ReferentialIntegrityError
 
-from . import filter_queries
+from . import database, jsonsql, paging, planner, serializer, snapshot
+
+
+def with_statements(data):
+    """Return factoid data with a list 'statements' instead of 'statement'.
+
+    data is not modified.
+    """
+    # FIXME: there seems to be an inconsisteny in the spec: in model each factoid only can have one statement,
+    #       but in refs statements is a list. As I need a running version quickly, I follow the actual spec
+    #       and put the single statement into a list before saving.
+    if 'statement' not in data:
+        return data
+    data = dict(data, statements=[data['statement']])
+    del data['statement']
+    return data
 
 
 class FactoidConnector(AbstractConnector):
@@ -18,12 +31,15 @@ class FactoidConnector(AbstractConnector):
 
     def __init__(self, connector_configuration):
         self.db = connector_configuration["db"]
+        self.serialization = connector_configuration.get("serialization", "python")
 
-    def get(self, obj_id):
+    def get(self, obj_id, fields=None):
         """Return the factoid dict with id factoid_id or None if no such factoid.
 
         :param obj_id: the id of the source object to return
         :type object_id: string
+        :param fields: a list of (dotted) field names to return. All fields if None.
+        :type fields: list
         :return: The object as defined in the openAPI definition or None
         :rtype: dict
         """
@@ -32,30 +48,93 @@ class FactoidConnector(AbstractConnector):
         with orm.db_session:
             factoid = Factoid.get(id=obj_id)
             if factoid:
-                result = factoid.to_ipif()
+                if fields:
+                    result = serializer.factoids_to_ipif(
+                        self.db, [factoid], serializer.field_tree(fields))[0]
+                else:
+                    result = factoid.to_ipif()
         return result
 
+    def get_many(self, obj_ids, fields=None):
+        """Return a list containing the factoid dict (or None) for each id in obj_ids.
+
+        All factoids are loaded with `IN` queries and serialized in one go
+        (see serialize()). The list has the same order as obj_ids.
+        """
+        Factoid = self.db.entities["Factoid"]
+        with orm.db_session:
+            factoids = list(serializer.load(Factoid, obj_ids).values())
+            documents = dict(zip((x.id for x in factoids), self.serialize(factoids, fields=fields)))
+        return [documents.get(obj_id) for obj_id in obj_ids]
+
+    def get_last_modified(self, obj_id):
+        """Return a tuple (exists, modified_when) for the factoid with id obj_id.
+
+        Only modifiedWhen is read from the database.
+        """
+        Factoid = self.db.entities["Factoid"]
+        with orm.db_session:
+            rows = orm.select(
+                (f.id, f.modifiedWhen) for f in Factoid if f.id == obj_id
+            )[:1]
+        if not rows:
+            return False, None
+        return True, rows[0][1]
+
+    def get_write_version(self):
+        "Return the write version of the database (see database.touch())."
+        return database.write_version(self.db)
+
     def filter(self, **filters):
         """Return a pony query object with all filters applied.
+
+        Only the subqueries needed for the set filters are used (see planner).
         # TODO: Discuss if metadata should be searched, too
         """
-        Factoid = self.db.entities["Factoid"]
-        subquery_person = filter_queries.person_query(self.db, **filters)
-        subquery_source = filter_queries.source_query(self.db, **filters)
-        subquery_statement = filter_queries.statement_query(self.db, **filters)
-        subquery_factoid = filter_queries.factoid_query(self.db, **filters)
-        query = orm.select(f for f in Factoid
-            if f in subquery_factoid
-#                for f in p.factoids
-                if (f.person in subquery_person
-                    and f.source in subquery_source)
-                    for stmt in f.statements 
-                        if stmt in subquery_statement
-        )
+        query, _ = planner.plan(self.db, "Factoid", **filters)
         return query
 
+    def sorted_query(self, sort_by="createdWhen", sort_order="ASC", **filters):
+        """Return a pony query object with all filters and sort order applied.
+        """
+        Factoid = self.db.entities["Factoid"]
+        if sort_by == "@id":
+            sort_by = "id"
+        if filters:
+            # TODO: replace datetime by anything which can handle dates bc
+            if "from_" in filters:
+                filters["from_"] = datetime.date.fromisoformat(filters["from_"])
+            if "to" in filters:
+                filters["to"] = datetime.date.fromisoformat(filters["to"])
+            query = self.filter(**filters)
+        else:
+            query = orm.select(f for f in Factoid)
+
+        # TODO: specifiy sort order values in spec. Sorting by uris should be excluded in
+        # spec (needs discussion)
+
+        # set descending order if necessary and add id as second sort field (if not first)
+        return paging.sort(query, sort_by, sort_order)
+
     @orm.db_session
-    def search(self, size, page, sort_by="createdWhen", sort_order="ASC", **filters):
+    def serialize(self, factoids, depth="full", fields=None):
+        """Return the IPIF documents for a list of Factoid objects.
+
+        Depending on the 'serialization' setting the documents are dicts
+        or JSON text built by the database (see jsonsql).
+        With depth 'reduced' person, source and statements only contain
+        their ids. If fields (a list of dotted field names) is set, only
+        these fields are loaded and returned.
+        """
+        fields = serializer.field_tree(fields)
+        if depth == "reduced":
+            return serializer.reduced_factoids_to_ipif(self.db, factoids, fields)
+        if self.serialization == "database" and fields is None:
+            return jsonsql.to_json(self.db, "Factoid", [x.id for x in factoids])
+        return serializer.factoids_to_ipif(self.db, factoids, fields)
+
+    def search(self, size, page, sort_by="createdWhen", sort_order="ASC", cursor=None,
+               depth="full", fields=None, **filters):
         """Find all objects which match the filter conditions set via
         filters.
 
@@ -69,39 +148,57 @@ class FactoidConnector(AbstractConnector):
                         It is suggegested to alway use '@id' as as second sort field, to
                         keep result order consistent for paging.
         :type sort_by: str
+        :param cursor: a (sort_value, id) tuple of the last object of the previous page.
+                       If set, `page` is ignored and the page following this object
+                       is returned.
+        :type cursor: tuple
+        :param depth: 'full' or 'reduced'. With 'reduced' person, source and
+                      statements of each factoid only contain their '@id'.
+        :type depth: str
+        :param fields: a list of (dotted) field names to return. All fields if None.
+        :type fields: list
         :return: a list of factoid objects (represented as dictionaries)
         :rtype: list
         """
         Factoid = self.db.entities["Factoid"]
-        if sort_by == "@id":
-            sort_by = "id"
         with orm.db_session:
-            if filters:
-                # TODO: replace datetime by anything which can handle dates bc
-                if "from_" in filters:
-                    filters["from_"] = datetime.date.fromisoformat(filters["from_"])
-                if "to" in filters:
-                    filters["to"] = datetime.date.fromisoformat(filters["to"])
-                query = self.filter(**filters)
+            query = self.sorted_query(sort_by, sort_order, **filters)
+            if cursor:
+                query = paging.seek(query, Factoid, sort_by, sort_order, cursor)
+                factoids = query.limit(size)
             else:
-                query = orm.select(f for f in Factoid)
+                factoids = query.page(page, size)
+            result = self.serialize(factoids, depth, fields)
+        return result
 
-            # TODO: specifiy sort order values in spec. Sorting by uris should be excluded in
-            # spec (needs discussion)
+    def search_with_count(self, size, page, sort_by="createdWhen", sort_order="ASC",
+                          cursor=None, depth="full", fields=None, **filters):
+        """Like search() but return a (result, total_hits) tuple.
 
-            # set descending order if necessary and add id as second sort field (if not first)
-            if sort_order.lower() == "desc":
-                sort_expression = "desc(f.{}), f.id".format(sort_by)
-                query = query.sort_by(sort_expression)
+        Filters are only evaluated once: if the database supports window
+        functions, the page and the number of all matching factoids are
+        fetched with a single query.
+        """
+        Factoid = self.db.entities["Factoid"]
+        with orm.db_session:
+            query = self.sorted_query(sort_by, sort_order, **filters)
+            if cursor:
+                # a window would only count the factoids behind the cursor
+                total = query.count()
+                factoids = paging.seek(query, Factoid, sort_by, sort_order, cursor).limit(size)
             else:
-                if sort_by == "id":
-                    sort_expression = "f.id"
-                else:
-                    sort_expression = "f.{}, f.id".format(sort_by)
-                query = query.sort_by(sort_expression)
-            result = [f.to_ipif() for f in query.page(page, size)]
-        return result
+                factoids, total = paging.fetch_with_count(
+                    query, Factoid, size, (page - 1) * size)
+            result = self.serialize(factoids, depth, fields)
+        return result, total
+
 
+    def export(self, batch_size=200, fields=None, **filters):
+        """Like AbstractConnector.export(), but all batches are read in one
+        transaction, so the export is consistent (see snapshot).
+        """
+        return snapshot.read(self.db, super().export(batch_size, fields, **filters),
+                             batch_size)
 
     def count(self, **filters):
         """Return the number of factoids matching the filters.
@@ -123,12 +220,7 @@ class FactoidConnector(AbstractConnector):
         """Create a new Factoid.
         """
         Factoid = self.db.entities["Factoid"]
-        # FIXME: there seems to be an inconsisteny in the spec: in model each factoid only can have one statement,
-        #       but in refs statements is a list. As I need a running version quickly, I follow the actual spec
-        #       and put the single statement into a list before saving.
-        if 'statement' in data:
-            stmt = data.pop('statement')
-            data['statements'] = [stmt]
+        data = with_statements(data)
         try:
             with orm.db_session:
                 factoid = Factoid.create_from_ipif(data)
@@ -144,22 +236,55 @@ class FactoidConnector(AbstractConnector):
         Update or created an object specified by obj_id.
         """
         Factoid = self.db.entities["Factoid"]
-        # FIXME: there seems to be an inconsisteny in the spec: in model each factoid only can have one statement,
-        #       but in refs statements is a list. As I need a running version quickly, I follow the actual spec
-        #       and put the single statement into a list before saving.
-        if 'statement' in data:
-            stmt = data.pop('statement')
-            data['statements'] = [stmt]
+        data = with_statements(data)
         with orm.db_session:
             factoid = Factoid.get_for_update(id=obj_id)
             if factoid is None:
-                data['@id'] = obj_id
-                factoid = Factoid.create_from_ipif(data)
+                factoid = Factoid.create_from_ipif(dict(data, **{'@id': obj_id}))
             else:
                 factoid.update_from_ipif(data)
             result = factoid.to_ipif()
         return result
 
+    def _save(self, data):
+        """Create or update a factoid from data. Return 'created' or 'updated'.
+
+        Must be called inside a db_session.
+        """
+        Factoid = self.db.entities["Factoid"]
+        data = with_statements(data)
+        factoid = Factoid.get_for_update(id=data["@id"])
+        if factoid is None:
+            Factoid.create_from_ipif(data)
+            return "created"
+        factoid.update_from_ipif(data)
+        return "updated"
+
+    def update_many(self, objects):
+        """Create or update a list of factoids in a single transaction.
+
+        If the transaction fails, each factoid is saved in its own
+        transaction to find out which factoids caused the error.
+        Return a list of (status, message) tuples (see AbstractConnector).
+        """
+        errors = (orm.OrmError, orm.DBException, KeyError, TypeError, ValueError)
+        try:
+            with orm.db_session:
+                return [(self._save(data), None) for data in objects]
+        except errors:
+            pass
+        result = []
+        for data in objects:
+            try:
+                # errors can be raised when the transaction is committed
+                with orm.db_session:
+                    status = self._save(data)
+            except errors as err:
+                result.append(("error", str(err)))
+            else:
+                result.append((status, None))
+        return result
+
     def delete(self, obj_id):
         """
         Delete factoid with id `obj_id`.
@@ -167,7 +292,7 @@ class FactoidConnector(AbstractConnector):
         Factoid = self.db.entities["Factoid"]
         try:
             with orm.db_session:
-                Factoid[obj_id].delete()
+                Factoid[obj_id].deep_delete()
         except orm.ConstraintError:
             with orm.db_session:
                 factoid = Factoid[obj_id]
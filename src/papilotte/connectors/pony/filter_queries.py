@@ -6,6 +6,8 @@ import datetime
 
 from pony import orm
 
+from . import fulltext, labelindex
+
 
 def source_query(db, sourceId="", label="", s="", **other_filters):
     """Construct a (sub)query based on named filters.
@@ -14,7 +16,10 @@ def source_query(db, sourceId="", label="", s="", **other_filters):
     The returned query can be used as variable within an other query.
     """
     Source = db.entities["Source"]
-    query = orm.select(s for s in Source)
+    if s and fulltext.can_search(db, s):
+        query = fulltext.select(db, "Source", s)
+    else:
+        query = orm.select(s for s in Source)
     if sourceId:
         query = query.filter(lambda source: source.id == sourceId)
     if label:
@@ -37,7 +42,10 @@ def person_query(db, personId="", p="", **other_filters):
     The returned query can be used as variable within an other query.
     """
     Person = db.entities["Person"]
-    query = orm.select(p for p in Person)
+    if p and fulltext.can_search(db, p):
+        query = fulltext.select(db, "Person", p)
+    else:
+        query = orm.select(p for p in Person)
     if personId:
         query = query.filter(lambda person: person.id == personId)
     if p:
@@ -54,7 +62,10 @@ def factoid_query(db, factoidId="", f="", **other_filters):
     The returned query can be used as variable within an other query.
     """
     Factoid = db.entities["Factoid"]
-    query = orm.select(f for f in Factoid)
+    if f and fulltext.can_search(db, f):
+        query = fulltext.select(db, "Factoid", f)
+    else:
+        query = orm.select(f for f in Factoid)
     if factoidId:
         query = query.filter(lambda factoid: factoid.id == factoidId)
     if f:  # TODO: Possibly f should search in all child elements?
@@ -81,6 +92,9 @@ def statement_place_query(db, needle):
     Returns a pony.query object which can be as sub query.
     """
     Statement = db.entities["Statement"]
+    ids = labelindex.resolve(db, "Place", needle)
+    if ids is not None:
+        return orm.select(st for st in Statement for p in st.places if p.id in ids)
     query = orm.select(st for st in Statement
         for p in st.places
         if needle.lower() in p.label.lower() or p.uri == needle
@@ -97,6 +111,9 @@ def statement_relpers_query(db, needle):
     Returns a pony.query object which can be as sub query.
     """
     Statement = db.entities["Statement"]
+    ids = labelindex.resolve(db, "RelatesToPerson", needle)
+    if ids is not None:
+        return orm.select(st for st in Statement for rp in st.relatesToPersons if rp.id in ids)
     query = orm.select(
         st
         for st in Statement
@@ -127,7 +144,16 @@ def statement_query(
     The returned query can be used as variable within an other query.
     """
     Statement = db.entities["Statement"]
-    query = orm.select(st for st in Statement)
+    # Use the full text index (if enabled) to restrict the query to the
+    # candidates of one of the fulltext filters.
+    needle = next(
+        (value for value in (st, statementContent, name) if fulltext.can_search(db, value)),
+        None
+    )
+    if needle:
+        query = fulltext.select(db, "Statement", needle)
+    else:
+        query = orm.select(st for st in Statement)
     if statementId:
         query = query.filter(lambda stmt: stmt.id == statementId)
     if st:
@@ -152,10 +178,14 @@ def statement_query(
     if from_:
         query = query.filter(lambda stmt: stmt.date.sortDate >= from_)
     if memberOf:
-        query = query.filter(
-            lambda stmt: memberOf.lower() in stmt.memberOf.label.lower()
-            or stmt.memberOf.uri == memberOf
-        )
+        ids = labelindex.resolve(db, "MemberGroup", memberOf)
+        if ids is not None:
+            query = query.filter(lambda stmt: stmt.memberOf.id in ids)
+        else:
+            query = query.filter(
+                lambda stmt: memberOf.lower() in stmt.memberOf.label.lower()
+                or stmt.memberOf.uri == memberOf
+            )
     if name:
         query = query.filter(lambda stmt: name.lower() in stmt.name.lower())
     if place:
@@ -165,19 +195,27 @@ def statement_query(
         subquery = statement_relpers_query(db, relatesToPerson)
         query = query.filter(lambda stmt: stmt in subquery)
     if role:
-        query = query.filter(
-            lambda stmt: role.lower() in stmt.role.label.lower()
-            or stmt.role.uri == role
-        )
+        ids = labelindex.resolve(db, "Role", role)
+        if ids is not None:
+            query = query.filter(lambda stmt: stmt.role.id in ids)
+        else:
+            query = query.filter(
+                lambda stmt: role.lower() in stmt.role.label.lower()
+                or stmt.role.uri == role
+            )
     if statementContent:
         query = query.filter(
             lambda stmt: statementContent.lower() in stmt.statementContent.lower()
         )
     if statementType:
-        query = query.filter(
-            lambda stmt: statementType.lower() in stmt.statementType.label.lower()
-            or stmt.statementType.uri == statementType
-        )
+        ids = labelindex.resolve(db, "StatementType", statementType)
+        if ids is not None:
+            query = query.filter(lambda stmt: stmt.statementType.id in ids)
+        else:
+            query = query.filter(
+                lambda stmt: statementType.lower() in stmt.statementType.label.lower()
+                or stmt.statementType.uri == statementType
+            )
     if to:
         query = query.filter(lambda stmt: stmt.date.sortDate <= to)
     return query
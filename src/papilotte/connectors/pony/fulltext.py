@@ -0,0 +1,280 @@
+"""An optional full text index for the fulltext filters.
+
+The filters f=, p=, s=, st= (and name=, statementContent=) search for
+substrings in many columns and related tables, which cannot be done
+using normal indexes. If the full text index is enabled (connector option
+`fulltext`), each Factoid, Person, Source and Statement gets a search
+document containing all its searchable texts. The filter queries use
+this index to find the candidate objects and only check the original
+conditions for these candidates.
+
+SQLite uses FTS5 tables with the trigram tokenizer (SQLite >= 3.34),
+PostgreSQL a text column with a pg_trgm GIN index. Both support substring
+search, which is needed to keep the semantics of the filters.
+
+The index is kept up to date by create_from_ipif(), update_from_ipif()
+and deep_delete(). rebuild() recreates the complete index.
+"""
+import sqlite3
+import weakref
+
+from pony import orm
+
+from . import serializer
+
+# The fields of the IPIF documents which are put into the search document
+FIELDS = {
+    "Factoid": ["@id"],
+    "Person": ["@id", "uris"],
+    "Source": ["@id", "label", "uris"],
+    "Statement": [
+        "@id",
+        "name",
+        "statementContent",
+        "date.label",
+        "role",
+        "memberOf",
+        "statementType",
+        "places",
+        "relatesToPersons",
+        "uris",
+    ],
+}
+
+SERIALIZERS = {
+    "Factoid": serializer.factoids_to_ipif,
+    "Person": serializer.persons_to_ipif,
+    "Source": serializer.sources_to_ipif,
+    "Statement": serializer.statements_to_ipif,
+}
+
+# Trigram indexes can not be used for shorter search strings
+MIN_LENGTH = 3
+
+# All databases with an enabled full text index
+_enabled = weakref.WeakSet()
+
+
+def table_name(entity_name):
+    "Return the name of the table containing the search documents of entity_name."
+    return "papi_fulltext_{}".format(entity_name.lower())
+
+
+def is_supported(db):
+    "Return True if a full text index can be used with db."
+    dialect = db.provider.dialect
+    if dialect == "SQLite":
+        # the trigram tokenizer was added in 3.34
+        if sqlite3.sqlite_version_info < (3, 34):
+            return False
+        try:
+            with orm.db_session:
+                db.execute(
+                    "CREATE VIRTUAL TABLE temp.papi_fts_test USING fts5(x, tokenize='trigram')"
+                )
+                db.execute("DROP TABLE temp.papi_fts_test")
+        except orm.DatabaseError:
+            return False
+        return True
+    return dialect == "PostgreSQL"
+
+
+def is_enabled(db):
+    "Return True if the full text index is enabled for db."
+    return db in _enabled
+
+
+def _create_statements(db, entity_name):
+    "Return the sql statements creating the index tables for entity_name."
+    if db.provider.dialect == "SQLite":
+        return [
+            "CREATE TABLE IF NOT EXISTS {0} ("
+            "id INTEGER PRIMARY KEY, obj_id TEXT NOT NULL UNIQUE, document TEXT NOT NULL)",
+            "CREATE VIRTUAL TABLE IF NOT EXISTS {0}_fts USING fts5("
+            "document, content='{0}', content_rowid='id', tokenize='trigram')",
+            "CREATE TRIGGER IF NOT EXISTS {0}_ai AFTER INSERT ON {0} BEGIN "
+            "INSERT INTO {0}_fts(rowid, document) VALUES (new.id, new.document); END",
+            "CREATE TRIGGER IF NOT EXISTS {0}_ad AFTER DELETE ON {0} BEGIN "
+            "INSERT INTO {0}_fts({0}_fts, rowid, document) "
+            "VALUES ('delete', old.id, old.document); END",
+        ]
+    return [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE TABLE IF NOT EXISTS {0} (obj_id TEXT PRIMARY KEY, document TEXT NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS {0}_trgm ON {0} USING gin (document gin_trgm_ops)",
+    ]
+
+
+def _drop_statements(db, entity_name):
+    "Return the sql statements dropping the index tables for entity_name."
+    if db.provider.dialect == "SQLite":
+        return ["DROP TABLE IF EXISTS {0}_fts", "DROP TABLE IF EXISTS {0}"]
+    return ["DROP TABLE IF EXISTS {0}"]
+
+
+def _table_exists(db, table):
+    if db.provider.dialect == "SQLite":
+        sql = "SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = $table"
+    else:
+        sql = "SELECT count(*) FROM information_schema.tables WHERE table_name = $table"
+    return db.select(sql, {"table": table})[0] > 0
+
+
+def enable(db):
+    """Enable the full text index for db.
+
+    Create the index tables if they do not exist yet. If they had to be
+    created, the index is built for all existing objects.
+    """
+    with orm.db_session:
+        is_new = not all(_table_exists(db, table_name(name)) for name in FIELDS)
+    if is_new:
+        rebuild(db)
+    _enabled.add(db)
+
+
+def disable(db):
+    "Stop using the full text index for db. The index tables are kept."
+    _enabled.discard(db)
+
+
+def document(data):
+    "Return the search document for an (reduced) IPIF dict as string."
+    texts = []
+
+    def collect(value):
+        if isinstance(value, dict):
+            for item in value.values():
+                collect(item)
+        elif isinstance(value, list):
+            for item in value:
+                collect(item)
+        elif isinstance(value, str) and value:
+            texts.append(value)
+
+    collect(data)
+    return "\n".join(texts)
+
+
+def documents(db, entity_name, objects):
+    "Return a list of (id, document) tuples for objects of entity_name."
+    tree = serializer.field_tree(FIELDS[entity_name])
+    return [
+        (data["@id"], document(data))
+        for data in SERIALIZERS[entity_name](db, objects, tree)
+    ]
+
+
+def _insert(db, entity_name, obj_id, doc):
+    db.execute(
+        "INSERT INTO {} (obj_id, document) VALUES ($obj_id, $doc)".format(
+            table_name(entity_name)
+        ),
+        {"obj_id": obj_id, "doc": doc},
+    )
+
+
+def _delete(db, entity_name, obj_id):
+    db.execute(
+        "DELETE FROM {} WHERE obj_id = $obj_id".format(table_name(entity_name)),
+        {"obj_id": obj_id},
+    )
+
+
+def update(db, obj):
+    """(Re)index obj (a Factoid, Person, Source or Statement).
+
+    Does nothing if the index is not enabled. Must be called inside a
+    db_session.
+    """
+    if not is_enabled(db):
+        return
+    entity_name = obj.__class__.__name__
+    for obj_id, doc in documents(db, entity_name, [obj]):
+        _delete(db, entity_name, obj_id)
+        _insert(db, entity_name, obj_id, doc)
+
+
+def remove(db, obj):
+    """Remove obj from the index.
+
+    Does nothing if the index is not enabled. Must be called inside a
+    db_session.
+    """
+    if is_enabled(db):
+        _delete(db, obj.__class__.__name__, obj.id)
+
+
+def remove_ids(db, entity_name, obj_ids):
+    """Remove the objects of entity_name with ids obj_ids from the index.
+
+    Does nothing if the index is not enabled. Must be called inside a
+    db_session.
+    """
+    if not is_enabled(db) or not obj_ids:
+        return
+    params = {"p{}".format(i): obj_id for i, obj_id in enumerate(obj_ids)}
+    db.execute(
+        "DELETE FROM {} WHERE obj_id IN ({})".format(
+            table_name(entity_name), ", ".join("$" + name for name in params)
+        ),
+        params,
+    )
+
+
+def rebuild(db):
+    """(Re)create the index tables and index all objects.
+
+    Return a dict containing the number of indexed objects per entity.
+    """
+    stats = {}
+    with orm.db_session:
+        for entity_name in FIELDS:
+            for sql in _drop_statements(db, entity_name) + _create_statements(
+                db, entity_name
+            ):
+                db.execute(sql.format(table_name(entity_name)))
+    for entity_name in FIELDS:
+        entity = db.entities[entity_name]
+        with orm.db_session:
+            ids = orm.select(x.id for x in entity)[:]
+        for chunk in serializer.chunks(ids):
+            with orm.db_session:
+                objects = orm.select(x for x in entity if x.id in chunk)[:]
+                for obj_id, doc in documents(db, entity_name, objects):
+                    _insert(db, entity_name, obj_id, doc)
+        stats[entity_name] = len(ids)
+    return stats
+
+
+def can_search(db, needle):
+    "Return True if the index can be used to search for needle."
+    return is_enabled(db) and len(needle) >= MIN_LENGTH
+
+
+def select(db, entity_name, needle):
+    """Return a pony query of all objects of entity_name whose search
+    document contains needle (case insensitive).
+
+    As the document contains the texts of all searchable fields, the result
+    is a superset of the objects matching any single field. It is meant to
+    be combined with the original filter conditions.
+    """
+    entity = db.entities[entity_name]
+    table = table_name(entity_name)
+    quote = db.provider.quote_name
+    id_column = "{}.{}".format(quote("x"), quote(entity._pk_columns_[0]))
+    if db.provider.dialect == "SQLite":
+        # a fts5 phrase query; with the trigram tokenizer this is a substring search
+        pattern = '"{}"'.format(needle.replace('"', '""'))
+        sql = (
+            "{0} IN (SELECT fts_doc.obj_id FROM {1} fts_doc "
+            "JOIN {1}_fts ON {1}_fts.rowid = fts_doc.id WHERE {1}_fts MATCH $pattern)"
+        ).format(id_column, table)
+    else:
+        escaped = needle.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        pattern = "%{}%".format(escaped)
+        sql = "{0} IN (SELECT obj_id FROM {1} WHERE document ILIKE $pattern)".format(
+            id_column, table
+        )
+    return orm.select(x for x in entity if orm.raw_sql(sql))
@@ -0,0 +1,93 @@
+"""Allocation of ids for new objects created without an '@id'.
+
+Two id styles are supported (connector setting 'idStyle'):
+
+  * 'hash' (default): the shortest unused prefix (at least MIN_LENGTH
+    characters) of the SHA-256 hash of the object data, eg. '3f9a'
+  * 'uuid': a random UUID (32 hex characters). No database query is
+    needed and ids never collide, even between processes.
+
+For 'hash' all existing ids starting with the minimal prefix are fetched
+with a single range query on the primary key; the shortest free prefix is
+then chosen in memory. Ids handed out by this process are reserved until
+RESERVED_IDS further ids were allocated, so concurrent or batched writers
+in the same process never get the same id before their objects are
+committed.
+"""
+import collections
+import datetime
+import hashlib
+import json
+import threading
+import uuid
+import weakref
+
+from pony import orm
+
+ID_STYLES = ("hash", "uuid")
+
+# Minimal length of a hash id
+MIN_LENGTH = 4
+
+# Number of allocated ids which are remembered
+RESERVED_IDS = 10000
+
+_allocators = weakref.WeakKeyDictionary()
+
+
+class IdAllocator:
+    "Allocates ids for the entities of one database."
+
+    def __init__(self, style="hash"):
+        if style not in ID_STYLES:
+            raise ValueError("Unknown id style '{}'".format(style))
+        self.style = style
+        self._lock = threading.Lock()
+        # (entity name, id) of recently allocated ids
+        self._reserved = collections.OrderedDict()
+
+    def _reserve(self, entity, candidates):
+        "Reserve and return the first candidate not reserved yet (or None)."
+        with self._lock:
+            for obj_id in candidates:
+                key = (entity.__name__, obj_id)
+                if key not in self._reserved:
+                    self._reserved[key] = True
+                    if len(self._reserved) > RESERVED_IDS:
+                        self._reserved.popitem(last=False)
+                    return obj_id
+        return None
+
+    def make_id(self, entity, data, extra=""):
+        """Return a new id for an object of entity built from data (a dict).
+
+        Must be called inside a db_session.
+        """
+        if self.style == "uuid":
+            return uuid.uuid4().hex
+        d_str = json.dumps(data, default=str).encode("utf-8")
+        d_str += extra.encode("utf-8")
+        full_hash = hashlib.sha256(d_str).hexdigest()
+        prefix = full_hash[:MIN_LENGTH]
+        # 'g' sorts behind all hex digits
+        used = set(orm.select(
+            x.id for x in entity if x.id >= prefix and x.id < prefix + "g"))
+        candidates = (full_hash[:i] for i in range(MIN_LENGTH, len(full_hash) + 1)
+                      if full_hash[:i] not in used)
+        obj_id = self._reserve(entity, candidates)
+        if obj_id is None:
+            # all prefixes are taken: add the current timestamp and retry
+            return self.make_id(entity, data, datetime.datetime.now().isoformat())
+        return obj_id
+
+
+def set_style(db, style):
+    "Use id style style ('hash' or 'uuid') for new objects in db."
+    _allocators[db] = IdAllocator(style)
+
+
+def allocator(db):
+    "Return the IdAllocator of db."
+    if db not in _allocators:
+        _allocators[db] = IdAllocator()
+    return _allocators[db]
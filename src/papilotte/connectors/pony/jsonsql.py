@@ -0,0 +1,391 @@
+"""Build IPIF documents inside the database.
+
+This module generates SQL which assembles the complete IPIF document of
+Factoids, Persons, Sources and Statements as JSON text using the JSON
+functions of the database (SQLite JSON1 or PostgreSQL). The result is
+exactly the same as json.dumps(obj.to_ipif()) (apart from formatting and
+key order), but no pony objects have to be created and no Python code is
+involved in building the documents.
+
+Table and column names are taken from the pony mapping.
+"""
+import datetime
+import sqlite3
+
+from pony import orm
+
+# Maximum number of ids used in a single `IN (...)` clause
+CHUNK_SIZE = 500
+
+
+def is_supported(db):
+    "Return True if the database behind db can build JSON documents."
+    dialect = db.provider.dialect
+    if dialect == "SQLite":
+        # json_patch() was added in 3.18. JSON1 might not be compiled in.
+        if sqlite3.sqlite_version_info < (3, 18):
+            return False
+        try:
+            with orm.db_session:
+                db.select("SELECT json_patch('{}', '{}')")
+        except orm.DatabaseError:
+            return False
+        return True
+    return dialect == "PostgreSQL"
+
+
+class SQLiteDialect:
+    "JSON functions of SQLite (JSON1)."
+
+    def object(self, pairs):
+        return "json_object({})".format(
+            ", ".join("'{}', {}".format(key, value) for key, value in pairs)
+        )
+
+    def strip_nulls(self, expr):
+        # json_patch removes all members with a null value
+        return "json_patch('{{}}', {})".format(expr)
+
+    def embed(self, subquery):
+        # Values returned from a subquery are no longer recognized as json
+        return "json({})".format(subquery)
+
+    def array(self, expr, from_where, order_by, is_json):
+        value = "json(x)" if is_json else "x"
+        # json_group_array() keeps the order of the subquery
+        return self.embed(
+            "(SELECT json_group_array({}) FROM (SELECT {} AS x {} ORDER BY {}))".format(
+                value, expr, from_where, order_by
+            )
+        )
+
+    def datetime(self, column):
+        # pony stores datetimes as 'yyyy-mm-dd hh:mm:ss.ffffff'
+        # isoformat() omits zero microseconds
+        return (
+            "CASE WHEN {0} IS NULL THEN '' "
+            "ELSE replace(replace({0}, ' ', 'T'), '.000000', '') END"
+        ).format(column)
+
+    def date(self, column):
+        return column
+
+    def text_order(self, column):
+        return column
+
+
+class PostgreSQLDialect:
+    "JSON functions of PostgreSQL."
+
+    def object(self, pairs):
+        return "json_build_object({})".format(
+            ", ".join("'{}', {}".format(key, value) for key, value in pairs)
+        )
+
+    def strip_nulls(self, expr):
+        return "json_strip_nulls({})".format(expr)
+
+    def embed(self, subquery):
+        return subquery
+
+    def array(self, expr, from_where, order_by, is_json):
+        return "(SELECT COALESCE(json_agg({} ORDER BY {}), '[]'::json) {})".format(
+            expr, order_by, from_where
+        )
+
+    def datetime(self, column):
+        return (
+            "CASE WHEN {0} IS NULL THEN '' "
+            "WHEN date_trunc('second', {0}) = {0} "
+            "THEN to_char({0}, 'YYYY-MM-DD\"T\"HH24:MI:SS') "
+            "ELSE to_char({0}, 'YYYY-MM-DD\"T\"HH24:MI:SS.US') END"
+        ).format(column)
+
+    def date(self, column):
+        return "to_char({}, 'YYYY-MM-DD')".format(column)
+
+    def text_order(self, column):
+        # Python sorts by code point
+        return '{} COLLATE "C"'.format(column)
+
+
+class JSONBuilder:
+    """Generates the SQL expressions building the IPIF documents.
+
+    Each method returns an sql expression for the object referenced by
+    table alias `alias`.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        if db.provider.dialect == "SQLite":
+            self.dialect = SQLiteDialect()
+        else:
+            self.dialect = PostgreSQLDialect()
+        self._num_of_aliases = 0
+
+    def alias(self):
+        "Return an unused table alias."
+        self._num_of_aliases += 1
+        return "j{}".format(self._num_of_aliases)
+
+    def table(self, entity_name, alias):
+        "Return `table alias` for entity_name."
+        table = self.db.entities[entity_name]._table_
+        return "{} {}".format(self.db.provider.quote_name(table), alias)
+
+    def column(self, alias, entity_name, attr_name):
+        "Return the qualified column of attribute attr_name."
+        attr = self.db.entities[entity_name]._adict_[attr_name]
+        return "{}.{}".format(alias, self.db.provider.quote_name(attr.column))
+
+    def collection(self, alias, entity_name, attr_name):
+        """Return (join_table_with_alias, owner_column, item_column) for a
+        many-to-many attribute.
+        """
+        attr = self.db.entities[entity_name]._adict_[attr_name]
+        join_alias = self.alias()
+        quote = self.db.provider.quote_name
+        return (
+            "{} {}".format(quote(attr.table), join_alias),
+            "{}.{}".format(join_alias, quote(attr.reverse.columns[0])),
+            "{}.{}".format(join_alias, quote(attr.columns[0])),
+        )
+
+    def columns(self, alias, entity_name):
+        """Return (key, expression) pairs for all columns of entity_name
+        as returned by to_ipif().
+        """
+        pairs = []
+        for attr in self.db.entities[entity_name]._attrs_:
+            if attr.is_collection:
+                continue
+            value = self.column(alias, entity_name, attr.name)
+            if attr.py_type is datetime.datetime:
+                value = self.dialect.datetime(value)
+            pairs.append(("@id" if attr.name == "id" else attr.name, value))
+        return pairs
+
+    def replace(self, pairs, key, value):
+        "Replace the value of key in pairs."
+        return [(k, value if k == key else v) for k, v in pairs]
+
+    def factoid_ref(self, alias):
+        "Return the factoid-refs entry (Factoid.get_refs()) of a factoid."
+        d = self.dialect
+        stmt = self.alias()
+        return d.object(
+            [
+                ("@id", self.column(alias, "Factoid", "id")),
+                ("source-ref", d.object([("@id", self.column(alias, "Factoid", "source"))])),
+                ("person-ref", d.object([("@id", self.column(alias, "Factoid", "person"))])),
+                (
+                    "statement-refs",
+                    d.array(
+                        d.object([("@id", self.column(stmt, "Statement", "id"))]),
+                        "FROM {} WHERE {} = {}".format(
+                            self.table("Statement", stmt),
+                            self.column(stmt, "Statement", "factoid"),
+                            self.column(alias, "Factoid", "id"),
+                        ),
+                        self.dialect.text_order(self.column(stmt, "Statement", "id")),
+                        True,
+                    ),
+                ),
+            ]
+        )
+
+    def factoid_refs(self, alias, entity_name, ref_attr):
+        """Return the sorted list of factoid-refs of all factoids where
+        factoid.<ref_attr> is the object referenced by alias.
+        """
+        factoid = self.alias()
+        return self.dialect.array(
+            self.factoid_ref(factoid),
+            "FROM {} WHERE {} = {}".format(
+                self.table("Factoid", factoid),
+                self.column(factoid, "Factoid", ref_attr),
+                self.column(alias, entity_name, "factoid" if ref_attr == "id" else "id"),
+            ),
+            self.dialect.text_order(self.column(factoid, "Factoid", "id")),
+            True,
+        )
+
+    def uris(self, alias, entity_name):
+        "Return the sorted list of uris of the object."
+        join_table, owner_column, item_column = self.collection(alias, entity_name, "uris")
+        return self.dialect.array(
+            item_column,
+            "FROM {} WHERE {} = {}".format(
+                join_table, owner_column, self.column(alias, entity_name, "id")
+            ),
+            self.dialect.text_order(item_column),
+            False,
+        )
+
+    def person_or_source(self, alias, entity_name):
+        "Return the IPIF document of a Person or Source."
+        pairs = self.columns(alias, entity_name)
+        pairs.append(("uris", self.uris(alias, entity_name)))
+        pairs.append(("factoid-refs", self.factoid_refs(alias, entity_name, entity_name.lower())))
+        return self.dialect.object(pairs)
+
+    def person(self, alias):
+        "Return the IPIF document of a Person."
+        return self.person_or_source(alias, "Person")
+
+    def source(self, alias):
+        "Return the IPIF document of a Source."
+        return self.person_or_source(alias, "Source")
+
+    def label_uri(self, alias, entity_name):
+        "Return the IPIF dict of a Role, Place etc. (see LabelUriMixin.to_ipif())."
+        return self.dialect.strip_nulls(
+            self.dialect.object(
+                [
+                    ("uri", "NULLIF({}, '')".format(self.column(alias, entity_name, "uri"))),
+                    ("label", "NULLIF({}, '')".format(self.column(alias, entity_name, "label"))),
+                ]
+            )
+        )
+
+    def date(self, alias):
+        "Return the IPIF dict of a Date."
+        return self.dialect.strip_nulls(
+            self.dialect.object(
+                [
+                    ("sortDate", self.dialect.date(self.column(alias, "Date", "sortDate"))),
+                    ("label", "NULLIF({}, '')".format(self.column(alias, "Date", "label"))),
+                ]
+            )
+        )
+
+    def statement(self, alias):
+        "Return the IPIF document of a Statement."
+        d = self.dialect
+        pairs = self.columns(alias, "Statement")
+        for attr_name, entity_name in (
+            ("date", "Date"),
+            ("role", "Role"),
+            ("memberOf", "MemberGroup"),
+            ("statementType", "StatementType"),
+        ):
+            related = self.alias()
+            if entity_name == "Date":
+                value = self.date(related)
+            else:
+                value = self.label_uri(related, entity_name)
+            # no row (NULL) if the attribute is not set
+            pairs = self.replace(
+                pairs,
+                attr_name,
+                d.embed(
+                    "(SELECT {} FROM {} WHERE {} = {})".format(
+                        value,
+                        self.table(entity_name, related),
+                        self.column(related, entity_name, "id"),
+                        self.column(alias, "Statement", attr_name),
+                    )
+                ),
+            )
+        pairs.append(("uris", self.uris(alias, "Statement")))
+        for attr_name, entity_name in (("places", "Place"), ("relatesToPersons", "RelatesToPerson")):
+            related = self.alias()
+            join_table, owner_column, item_column = self.collection(
+                alias, "Statement", attr_name
+            )
+            label = "COALESCE({}, '')".format(self.column(related, entity_name, "label"))
+            uri = "COALESCE({}, '')".format(self.column(related, entity_name, "uri"))
+            pairs.append(
+                (
+                    attr_name,
+                    d.array(
+                        self.label_uri(related, entity_name),
+                        "FROM {} JOIN {} ON {} = {} WHERE {} = {}".format(
+                            self.table(entity_name, related),
+                            join_table,
+                            item_column,
+                            self.column(related, entity_name, "id"),
+                            owner_column,
+                            self.column(alias, "Statement", "id"),
+                        ),
+                        "{}, {}".format(d.text_order(label), d.text_order(uri)),
+                        True,
+                    ),
+                )
+            )
+        pairs.append(("factoid-refs", self.factoid_refs(alias, "Statement", "id")))
+        return d.object(pairs)
+
+    def factoid(self, alias):
+        "Return the IPIF document of a Factoid."
+        d = self.dialect
+        pairs = self.columns(alias, "Factoid")
+        for attr_name, entity_name in (("person", "Person"), ("source", "Source")):
+            related = self.alias()
+            pairs = self.replace(
+                pairs,
+                attr_name,
+                d.embed(
+                    "(SELECT {} FROM {} WHERE {} = {})".format(
+                        self.person_or_source(related, entity_name),
+                        self.table(entity_name, related),
+                        self.column(related, entity_name, "id"),
+                        self.column(alias, "Factoid", attr_name),
+                    )
+                ),
+            )
+        stmt = self.alias()
+        statements_from = "FROM {} WHERE {} = {}".format(
+            self.table("Statement", stmt),
+            self.column(stmt, "Statement", "factoid"),
+            self.column(alias, "Factoid", "id"),
+        )
+        stmt_order = d.text_order(self.column(stmt, "Statement", "id"))
+        pairs.append(("statements", d.array(self.statement(stmt), statements_from, stmt_order, True)))
+        pairs.append(("person-ref", d.object([("@id", self.column(alias, "Factoid", "person"))])))
+        pairs.append(("source-ref", d.object([("@id", self.column(alias, "Factoid", "source"))])))
+        pairs.append(
+            (
+                "statement-refs",
+                d.array(
+                    d.object([("@id", self.column(stmt, "Statement", "id"))]),
+                    statements_from,
+                    stmt_order,
+                    True,
+                ),
+            )
+        )
+        return d.object(pairs)
+
+
+def make_sql(db, entity_name, num_of_ids):
+    """Return the sql selecting (id, json) for num_of_ids objects of entity_name.
+
+    The ids are passed as parameters $p0, $p1, ...
+    """
+    builder = JSONBuilder(db)
+    alias = builder.alias()
+    expression = getattr(builder, entity_name.lower())(alias)
+    return "SELECT {}, {} FROM {} WHERE {} IN ({})".format(
+        builder.column(alias, entity_name, "id"),
+        expression,
+        builder.table(entity_name, alias),
+        builder.column(alias, entity_name, "id"),
+        ", ".join("$p{}".format(i) for i in range(num_of_ids)),
+    )
+
+
+def to_json(db, entity_name, ids):
+    """Return a list of IPIF documents (as JSON text) for ids.
+
+    The list has the same order as ids. Must be called inside a db_session.
+    """
+    documents = {}
+    ids = list(ids)
+    for i in range(0, len(ids), CHUNK_SIZE):
+        chunk = ids[i:i + CHUNK_SIZE]
+        params = {"p{}".format(num): obj_id for num, obj_id in enumerate(chunk)}
+        for obj_id, document in db.select(make_sql(db, entity_name, len(chunk)), params):
+            documents[obj_id] = document
+    return [documents[obj_id] for obj_id in ids]
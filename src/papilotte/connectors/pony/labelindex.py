@@ -0,0 +1,172 @@
+"""An in-memory index for the label/uri lookup tables.
+
+Role, Place, MemberGroup, StatementType and RelatesToPerson are small
+lookup tables. Filters like role= or place= match if the filter value is
+a substring of the label (case insensitive) or equal to the uri. Instead
+of evaluating these conditions for each statement (via joins), the filter
+value is resolved to the ids of the matching lookup rows using an n-gram
+index held in memory. The statement query only has to check
+`role IN (...)` or the join table of places.
+
+Each process has its own index. Rows added by LabelUriMixin.get_or_create()
+or removed by safe_delete() are applied to the index of the current process
+when the transaction is committed. Every change creates a new version of
+the table (see versions). Before using an index, its version is compared
+to the stored one, so changes made by other processes lead to a reload.
+"""
+import threading
+import weakref
+from collections import defaultdict
+
+from pony import orm
+
+from . import versions
+
+# length of the n-grams
+N = 3
+
+# If a filter value matches more rows, the filter uses the label conditions
+MAX_IDS = 500
+
+# db -> {entity_name: LabelIndex}
+_indexes = weakref.WeakKeyDictionary()
+
+# pony session cache -> {entity_name: [(deleted, id, label, uri), ...]}
+_pending = weakref.WeakKeyDictionary()
+_pending_lock = threading.Lock()
+
+
+def ngrams(text):
+    "Return the set of all n-grams in text."
+    return {text[i:i + N] for i in range(len(text) - N + 1)}
+
+
+class LabelIndex:
+    """N-gram index over the labels (and a dict of the uris) of one lookup
+    table.
+    """
+
+    def __init__(self, version):
+        self.version = version
+        self.labels = {}
+        self.uris = {}
+        self.label_ngrams = defaultdict(set)
+        self.uri_ids = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def add(self, obj_id, label, uri):
+        "Add a row to the index."
+        with self.lock:
+            label = (label or "").lower()
+            self.labels[obj_id] = label
+            self.uris[obj_id] = uri
+            for ngram in ngrams(label):
+                self.label_ngrams[ngram].add(obj_id)
+            if uri:
+                self.uri_ids[uri].add(obj_id)
+
+    def remove(self, obj_id):
+        "Remove a row from the index."
+        with self.lock:
+            label = self.labels.pop(obj_id, "")
+            uri = self.uris.pop(obj_id, "")
+            for ngram in ngrams(label):
+                self.label_ngrams[ngram].discard(obj_id)
+            if uri:
+                self.uri_ids[uri].discard(obj_id)
+
+    def search(self, needle):
+        """Return the set of ids of all rows where needle is a substring of
+        the label (case insensitive) or equal to the uri.
+        """
+        lower_needle = needle.lower()
+        with self.lock:
+            if len(lower_needle) >= N:
+                candidates = set.intersection(
+                    *[self.label_ngrams.get(ngram, set()) for ngram in ngrams(lower_needle)]
+                )
+            else:
+                candidates = self.labels.keys()
+            result = {obj_id for obj_id in candidates if lower_needle in self.labels[obj_id]}
+            result.update(self.uri_ids.get(needle, ()))
+        return result
+
+
+def stored_version(db, entity_name):
+    "Return the version of the lookup table entity_name stored in db."
+    return versions.stored(db, entity_name)
+
+
+def load(db, entity_name, version):
+    "Build the index for lookup table entity_name."
+    entity = db.entities[entity_name]
+    index = LabelIndex(version)
+    for obj_id, label, uri in orm.select((x.id, x.label, x.uri) for x in entity):
+        index.add(obj_id, label, uri)
+    return index
+
+
+def get_index(db, entity_name):
+    """Return an up to date index for lookup table entity_name.
+
+    Must be called inside a db_session.
+    """
+    indexes = _indexes.setdefault(db, {})
+    version = stored_version(db, entity_name)
+    index = indexes.get(entity_name)
+    if index is None or index.version != version:
+        index = load(db, entity_name, version)
+        indexes[entity_name] = index
+    return index
+
+
+def resolve(db, entity_name, needle):
+    """Return a list of ids of all rows of lookup table entity_name matching
+    needle or None if there are too many matching rows (more than MAX_IDS).
+
+    Must be called inside a db_session.
+    """
+    ids = get_index(db, entity_name).search(needle)
+    if len(ids) > MAX_IDS:
+        return None
+    return sorted(ids)
+
+
+def changed(obj, deleted=False):
+    """Register a new or deleted row of a lookup table.
+
+    The index of this process is updated when the transaction is committed.
+    obj must have been flushed (needs an id).
+    """
+    db = obj._database_
+    versions.add_listener(db, _committed)
+    with _pending_lock:
+        changes = _pending.setdefault(db._get_cache(), {})
+        changes.setdefault(obj.__class__.__name__, []).append(
+            (deleted, obj.id, obj.label, obj.uri))
+
+
+def _committed(db, session, changes):
+    """Apply the changes of the committed transaction of session to the
+    indexes (see versions.add_listener()). Forget them on rollback.
+    """
+    with _pending_lock:
+        pending = _pending.pop(session, None)
+    if not pending or changes is None:
+        return
+    indexes = _indexes.get(db, {})
+    for entity_name, rows in pending.items():
+        index = indexes.get(entity_name)
+        if index is None:
+            continue
+        previous, version = changes.get(entity_name, (None, None))
+        if previous is None or index.version != previous:
+            # changed by another process: reload on next use
+            indexes.pop(entity_name, None)
+            continue
+        for deleted, obj_id, label, uri in rows:
+            if deleted:
+                index.remove(obj_id)
+            else:
+                index.add(obj_id, label, uri)
+        index.version = version
@@ -0,0 +1,233 @@
+"""An interning cache for the lookup tables.
+
+Date, Role, MemberGroup, StatementType, Place, RelatesToPerson and the uri
+tables (PersonURI, SourceURI, StatementURI) contain rows shared by many
+statements, persons and sources. Writing a statement needs the row for each
+of its values (see the get_or_create() methods). Instead of querying the
+database for each value, the cache maps the key of a row (the values of the
+attributes in `lookup_key`, eg. (label, uri) for a Role or (label, sortDate)
+for a Date) to its primary key. Objects for cached keys are created from the
+primary key without a query.
+
+Each process has a cache per lookup table, which is filled with (at most
+maxsize) rows on first use. If it grows beyond maxsize, the least recently
+used keys are dropped. Rows created or deleted in a transaction are only
+applied to the cache when the transaction is committed; on rollback they
+are discarded. As for the label index (see labelindex) every change
+creates a new version of the table (see versions). A cache is only used if
+its version matches the stored one, so changes made by other processes
+lead to a reload.
+"""
+import collections
+import threading
+import weakref
+
+from . import versions
+
+# Default number of keys cached per lookup table
+MAX_SIZE = 10000
+
+# db -> Caches
+_caches = weakref.WeakKeyDictionary()
+
+
+class LookupCache:
+    "Maps the keys of (some) rows of one lookup table to their primary keys."
+
+    def __init__(self, version, maxsize):
+        self.version = version
+        self.maxsize = maxsize
+        self.keys = collections.OrderedDict()
+
+    def get(self, key):
+        "Return the primary key for key or None."
+        pk = self.keys.get(key)
+        if pk is not None:
+            self.keys.move_to_end(key)
+        return pk
+
+    def add(self, key, pk):
+        "Add key, drop the least recently used key if the cache is full."
+        self.keys[key] = pk
+        self.keys.move_to_end(key)
+        if len(self.keys) > self.maxsize:
+            self.keys.popitem(last=False)
+
+    def remove(self, key):
+        "Remove key (if cached)."
+        self.keys.pop(key, None)
+
+
+class Pending:
+    """Rows of one lookup table created or deleted in the current transaction.
+
+    start_version is the stored version when the transaction first used
+    the table.
+    """
+
+    def __init__(self, version):
+        self.start_version = version
+        self.added = {}
+        self.removed = set()
+
+    @property
+    def is_clean(self):
+        "True if the transaction did not change the table (yet)."
+        return not self.added and not self.removed
+
+
+class Caches:
+    "The lookup caches of one database."
+
+    def __init__(self, maxsize=MAX_SIZE):
+        self.maxsize = maxsize
+        # entity name -> LookupCache
+        self.tables = {}
+        # pony session cache -> {entity name: Pending}
+        self.sessions = weakref.WeakKeyDictionary()
+        self.lock = threading.Lock()
+
+
+def key_of(obj):
+    "Return the cache key of obj."
+    return tuple(getattr(obj, name) for name in obj.lookup_key)
+
+
+def configure(db, maxsize=MAX_SIZE):
+    "Cache at most maxsize keys per lookup table of db (0 disables the cache)."
+    _caches[db] = Caches(maxsize)
+    versions.add_listener(db, _committed)
+
+
+def _get_caches(db):
+    if db not in _caches:
+        configure(db)
+    return _caches[db]
+
+
+def _committed(db, session, changes):
+    """Apply the changes of the committed transaction of session to the
+    caches (see versions.add_listener()). Forget them on rollback.
+    """
+    caches = _caches.get(db)
+    if caches is None:
+        return
+    with caches.lock:
+        tables = caches.sessions.pop(session, None)
+        if not tables or changes is None:
+            return
+        for name, pending in tables.items():
+            if pending.is_clean:
+                continue
+            previous, version = changes.get(name, (None, None))
+            table = caches.tables.get(name)
+            if (table is not None and previous is not None
+                    and table.version == pending.start_version == previous):
+                for key in pending.removed:
+                    table.remove(key)
+                for key, pk in pending.added.items():
+                    table.add(key, pk)
+                table.version = version
+            else:
+                caches.tables.pop(name, None)
+
+
+def _pending(caches, entity):
+    "Return the Pending object of entity for the current transaction."
+    db = entity._database_
+    session = db._get_cache()
+    with caches.lock:
+        pending = caches.sessions.setdefault(session, {}).get(entity.__name__)
+    if pending is None:
+        pending = Pending(versions.stored(db, entity.__name__))
+        with caches.lock:
+            caches.sessions[session][entity.__name__] = pending
+    return pending
+
+
+def _load(entity, version, maxsize):
+    "Fill a new cache for entity with up to maxsize rows."
+    table = LookupCache(version, maxsize)
+    for obj in entity.select()[:maxsize]:
+        table.add(key_of(obj), obj.get_pk())
+    return table
+
+
+def _table(caches, entity, pending):
+    """Return the cache of entity if it matches the version the transaction
+    started from (load it if possible) or None.
+    """
+    name = entity.__name__
+    with caches.lock:
+        table = caches.tables.get(name)
+    if table is not None and table.version == pending.start_version:
+        return table
+    if not pending.is_clean:
+        # the transaction would see its own uncommitted rows
+        return None
+    table = _load(entity, pending.start_version, caches.maxsize)
+    with caches.lock:
+        caches.tables[name] = table
+    return table
+
+
+def get(entity, key):
+    """Return the object of lookup table entity for key.
+
+    Return None if key is not cached: the caller has to query the database.
+    Must be called inside a db_session.
+    """
+    caches = _get_caches(entity._database_)
+    if not caches.maxsize:
+        return None
+    pending = _pending(caches, entity)
+    if key in pending.removed:
+        return None
+    pk = pending.added.get(key)
+    if pk is None:
+        table = _table(caches, entity, pending)
+        if table is None:
+            return None
+        with caches.lock:
+            pk = table.get(key)
+        if pk is None:
+            return None
+    # a 'seed' object: its attributes are only loaded when accessed
+    return entity._get_by_raw_pkval_((pk,))
+
+
+def add(obj):
+    """Add obj, an existing row found in the database, to the cache.
+
+    Must be called inside a db_session.
+    """
+    caches = _get_caches(obj._database_)
+    if not caches.maxsize:
+        return
+    pending = _pending(caches, obj.__class__)
+    if not pending.is_clean:
+        pending.added[key_of(obj)] = obj.get_pk()
+        return
+    with caches.lock:
+        table = caches.tables.get(obj.__class__.__name__)
+        if table is not None and table.version == pending.start_version:
+            table.add(key_of(obj), obj.get_pk())
+
+
+def changed(obj, deleted=False):
+    """Register the new (or deleted) row obj of a lookup table.
+
+    The cache is updated when the transaction is committed. Deleted objects
+    must be registered before calling delete().
+    """
+    caches = _get_caches(obj._database_)
+    if not caches.maxsize:
+        return
+    pending = _pending(caches, obj.__class__)
+    key = key_of(obj)
+    if deleted:
+        pending.added.pop(key, None)
+        pending.removed.add(key)
+    else:
+        pending.removed.discard(key)
+        pending.added[key] = obj.get_pk()
@@ -0,0 +1,197 @@
+"""Garbage collection of orphaned rows.
+
+Deleting a factoid (or replacing its person, source or statements) leaves
+rows which are not used any more: persons, sources and statements without
+a factoid and rows of the lookup tables (Date, Role, Place etc. and the uri
+tables) without statements, persons or sources. By default they are
+removed immediately by deep_delete() and delete_if_unused(), which costs
+extra queries (and locks) in every write.
+
+If garbage collection is enabled (connector setting 'gc'), writes skip this
+cleanup. Persons, sources and statements of deleted factoids are recorded
+as candidates (GcCandidate), because objects created via the api without a
+factoid must not be removed. database.collect_garbage() deletes orphaned
+candidates and all unused lookup rows with set based statements like
+
+    DELETE FROM "Role" WHERE "id" IN (...) AND NOT EXISTS (
+        SELECT 1 FROM "Statement" r WHERE r."role" = "Role"."id")
+
+(batch_size rows per transaction). It is run periodically by a background
+thread of the server (setting 'gcInterval') or by 'papilotte gc'.
+"""
+import logging
+import threading
+import weakref
+
+from . import fulltext
+
+logger = logging.getLogger(__name__)
+
+# Number of rows deleted in one transaction
+BATCH_SIZE = 500
+
+# Default seconds between two runs of the background thread
+INTERVAL = 300
+
+# Entities recorded as candidates and the attribute referencing their owner
+CANDIDATES = {
+    "Statement": "factoid",
+    "Person": "factoids",
+    "Source": "factoids",
+}
+
+# All databases with enabled garbage collection
+_enabled = weakref.WeakSet()
+
+
+def enable(db):
+    "Leave the removal of orphans in db to the garbage collector."
+    _enabled.add(db)
+
+
+def disable(db):
+    "Remove orphans of db immediately again."
+    _enabled.discard(db)
+
+
+def is_enabled(db):
+    "Return True if garbage collection is enabled for db."
+    return db in _enabled
+
+
+def defer(obj):
+    """Record obj (a Person, Source or Statement) as candidate for the
+    garbage collector. Must be called inside a db_session.
+    """
+    GcCandidate = obj._database_.entities["GcCandidate"]
+    key = {"entity_name": obj.__class__.__name__, "obj_id": obj.id}
+    if GcCandidate.get(**key) is None:
+        GcCandidate(**key)
+
+
+def _unreferenced(attr):
+    """Return an sql condition matching the rows of attr.entity which are
+    not referenced via attr (a Set like Role.statements or an Optional like
+    Statement.factoid).
+    """
+    quote_name = attr.entity._database_.provider.quote_name
+    entity = attr.entity
+    if not attr.is_collection:
+        return "{}.{} IS NULL".format(quote_name(entity._table_), quote_name(attr.column))
+    reverse = attr.reverse
+    table = attr.table if reverse.is_collection else reverse.entity._table_
+    return "NOT EXISTS (SELECT 1 FROM {} r WHERE r.{} = {}.{})".format(
+        quote_name(table), quote_name(reverse.columns[0]),
+        quote_name(entity._table_), quote_name(entity._pk_columns_[0]))
+
+
+def _in_list(values):
+    "Return a tuple (sql list of parameters, parameter dict) for values."
+    params = {"p{}".format(i): value for i, value in enumerate(values)}
+    return "({})".format(", ".join("$" + name for name in params)), params
+
+
+def _delete_rows(entity, obj_ids, attr):
+    """Delete the rows obj_ids of entity which are not referenced via attr
+    and their links in join tables. Return the number of deleted rows.
+
+    obj_ids were selected by an earlier statement, so the condition is
+    checked again by each DELETE: a concurrent transaction may have added
+    a reference since.
+    """
+    db = entity._database_
+    quote_name = db.provider.quote_name
+    table = quote_name(entity._table_)
+    pk_column = quote_name(entity._pk_columns_[0])
+    in_list, params = _in_list(obj_ids)
+    condition = _unreferenced(attr)
+    if db.provider.dialect != "SQLite":
+        # lock the rows, so no references can be added until they are deleted
+        db.select("SELECT {0}.{1} FROM {0} WHERE {0}.{1} IN {2} AND {3} FOR UPDATE".format(
+            table, pk_column, in_list, condition), params)
+    for link_attr in entity._attrs_:
+        # the join table of attr has no rows for unreferenced objects
+        if link_attr.is_collection and link_attr.reverse.is_collection and link_attr is not attr:
+            join_table = quote_name(link_attr.table)
+            column = quote_name(link_attr.reverse.columns[0])
+            db.execute(
+                "DELETE FROM {0} WHERE {0}.{1} IN {2} AND EXISTS ("
+                "SELECT 1 FROM {3} WHERE {3}.{4} = {0}.{1} AND {5})".format(
+                    join_table, column, in_list, table, pk_column, condition), params)
+    cursor = db.execute("DELETE FROM {0} WHERE {0}.{1} IN {2} AND {3}".format(
+        table, pk_column, in_list, condition), params)
+    return cursor.rowcount
+
+
+def delete_unreferenced(entity, attr_name, batch_size=BATCH_SIZE):
+    """Delete up to batch_size rows of entity which are not referenced via
+    attribute attr_name. Return the number of deleted rows.
+
+    Must be called inside a db_session.
+    """
+    db = entity._database_
+    quote_name = db.provider.quote_name
+    attr = entity._adict_[attr_name]
+    obj_ids = db.select("SELECT {0}.{1} FROM {0} WHERE {2} LIMIT {3}".format(
+        quote_name(entity._table_), quote_name(entity._pk_columns_[0]),
+        _unreferenced(attr), int(batch_size)))
+    if not obj_ids:
+        return 0
+    return _delete_rows(entity, obj_ids, attr)
+
+
+def delete_candidates(entity, owner, batch_size=BATCH_SIZE):
+    """Process up to batch_size candidates of entity: delete those which
+    are not referenced via attribute owner and forget all of them.
+
+    Return the number of deleted objects or None if there are no
+    candidates left. Must be called inside a db_session.
+    """
+    db = entity._database_
+    quote_name = db.provider.quote_name
+    candidates = db.select(
+        'SELECT obj_id FROM {} WHERE entity_name = $name ORDER BY obj_id LIMIT {}'.format(
+            quote_name(db.entities["GcCandidate"]._table_), int(batch_size)),
+        {"name": entity.__name__})
+    if not candidates:
+        return None
+    deleted = _delete_rows(entity, candidates, entity._adict_[owner])
+    in_list, params = _in_list(candidates)
+    if deleted:
+        kept = set(db.select("SELECT {0}.{1} FROM {0} WHERE {0}.{1} IN {2}".format(
+            quote_name(entity._table_), quote_name(entity._pk_columns_[0]), in_list), params))
+        fulltext.remove_ids(db, entity.__name__,
+                            [obj_id for obj_id in candidates if obj_id not in kept])
+    params["name"] = entity.__name__
+    db.execute("DELETE FROM {} WHERE entity_name = $name AND obj_id IN {}".format(
+        quote_name(db.entities["GcCandidate"]._table_), in_list), params)
+    return deleted
+
+
+class Collector(threading.Thread):
+    """A background thread calling collect() every interval seconds.
+
+    collect is a function without arguments (eg. a partial of
+    database.collect_garbage).
+    """
+
+    def __init__(self, collect, interval=INTERVAL):
+        super().__init__(name="papilotte-gc", daemon=True)
+        self.collect = collect
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                stats = self.collect()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Garbage collection failed")
+                continue
+            deleted = {name: num for name, num in stats.items() if num}
+            if deleted:
+                logger.info("Garbage collection deleted %s", deleted)
+
+    def stop(self):
+        "Stop the thread (after the current run)."
+        self.stopped.set()
@@ -0,0 +1,180 @@
+"""Helpers for sorting and paging pony queries.
+
+These functions are used by the search() methods of all pony connectors.
+"""
+import datetime
+import sqlite3
+
+import pony
+from pony import orm
+
+# Pony versions whose internal apis are used by fetch_with_count()
+PONY_VERSIONS = ("0.7.",)
+
+# Dialects which sort NULL after all other values in ascending order
+NULLS_LAST = {"PostgreSQL", "Oracle"}
+
+
+def sort(query, sort_by, sort_order):
+    """Return query sorted by attribute `sort_by` and id.
+
+    The sort expressions do not depend on the name of the query variable,
+    so this works for all queries built by the filter planner.
+    """
+    if sort_order.lower() == "desc":
+        return query.sort_by(lambda x: (orm.desc(getattr(x, sort_by)), x.id))
+    if sort_by == "id":
+        return query.sort_by(lambda x: x.id)
+    return query.sort_by(lambda x: (getattr(x, sort_by), x.id))
+
+
+def to_sort_value(entity, sort_by, value):
+    """Convert a sort value taken from an IPIF dict back to the python type
+    of attribute `sort_by` of `entity`.
+
+    IPIF uses '' for missing datetimes, which are stored as NULL.
+    """
+    py_type = entity._adict_[sort_by].py_type
+    if py_type is datetime.datetime:
+        if not value:
+            return None
+        return datetime.datetime.fromisoformat(value)
+    return value
+
+
+def nulls_first(db, sort_order):
+    """Return True if NULL values come first in sort_order ('ASC' or
+    'DESC') on the database behind db.
+
+    NULL is the smallest value in SQLite and MySQL, the largest in the
+    dialects in NULLS_LAST.
+    """
+    descending = sort_order.lower() == "desc"
+    return descending == (db.provider.dialect in NULLS_LAST)
+
+
+def seek(query, entity, sort_by, sort_order, cursor):
+    """Return query restricted to all objects following `cursor`.
+
+    `cursor` is a (sort_value, id) tuple of the last object of the previous
+    page. Instead of skipping all objects of the previous pages (OFFSET)
+    this adds a condition to the WHERE clause, so the database can seek
+    directly to the first object of the requested page.
+
+    The order must be the one set by search(): `sort_by` ascending or
+    descending, `id` always ascending. Missing values (NULL) are sorted
+    as the database does (see nulls_first()).
+    """
+    if sort_by == "@id":
+        sort_by = "id"
+    value, last_id = cursor
+    value = to_sort_value(entity, sort_by, value)
+    descending = sort_order.lower() == "desc"
+    if sort_by == "id":
+        if descending:
+            return query.filter(lambda x: x.id < last_id)
+        return query.filter(lambda x: x.id > last_id)
+    if nulls_first(entity._database_, sort_order):
+        if value is None:
+            return query.filter(
+                lambda x: getattr(x, sort_by) is not None
+                or (getattr(x, sort_by) is None and x.id > last_id)
+            )
+        if descending:
+            return query.filter(
+                lambda x: getattr(x, sort_by) < value
+                or (getattr(x, sort_by) == value and x.id > last_id)
+            )
+        return query.filter(
+            lambda x: getattr(x, sort_by) > value
+            or (getattr(x, sort_by) == value and x.id > last_id)
+        )
+    if value is None:
+        return query.filter(
+            lambda x: getattr(x, sort_by) is None and x.id > last_id
+        )
+    if descending:
+        return query.filter(
+            lambda x: getattr(x, sort_by) < value
+            or getattr(x, sort_by) is None
+            or (getattr(x, sort_by) == value and x.id > last_id)
+        )
+    return query.filter(
+        lambda x: getattr(x, sort_by) > value
+        or getattr(x, sort_by) is None
+        or (getattr(x, sort_by) == value and x.id > last_id)
+    )
+
+
+def supports_window_functions(db):
+    "Return True if the database behind db can handle COUNT(*) OVER ()."
+    dialect = db.provider.dialect
+    if dialect == "SQLite":
+        return sqlite3.sqlite_version_info >= (3, 25)
+    if dialect == "MySQL":
+        # MySQL >= 8 or any MariaDB (10.x)
+        version = db.get_connection().get_server_info()
+        return int(version.split(".")[0]) >= 8
+    return dialect == "PostgreSQL"
+
+
+class _RowList:
+    "Makes a list of already fetched rows look like a db cursor for pony."
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def fetchmany(self, size):
+        return self.rows[:size]
+
+    def fetchall(self):
+        return self.rows
+
+
+def _window_query(query, size, offset):
+    """Return a tuple (sql, arguments, attr_offsets) for the page of query
+    with an additional last column `COUNT(*) OVER ()`.
+
+    Return None if this is not possible: pony does not support window
+    functions, so the sql is built from the syntax tree of query using
+    internal pony apis, which are only known to work with PONY_VERSIONS.
+    The window is evaluated before DISTINCT, so distinct queries are not
+    supported either.
+    """
+    if not pony.__version__.startswith(PONY_VERSIONS) or query._distinct:
+        return None
+    sql_ast, attr_offsets = query._translator.construct_sql_ast(
+        size, offset, query._distinct, None, None, None,
+        query._for_update, query._nowait, query._skip_locked)
+    if sql_ast[0] != "SELECT" or sql_ast[1][0] != "ALL":
+        return None
+    # ORDER BY, LIMIT and OFFSET stay in the same query as the window
+    columns = sql_ast[1] + [["RAWSQL", "COUNT(*) OVER ()"]]
+    sql, adapter = query._database.provider.ast2sql([sql_ast[0], columns] + sql_ast[2:])
+    return sql, adapter(query._vars), attr_offsets
+
+
+def fetch_with_count(query, entity, size, offset=0):
+    """Return a (objects, total) tuple for a sorted query.
+
+    objects is a list of at most `size` entity objects starting at
+    `offset`, total is the number of all objects matching the query.
+
+    `COUNT(*) OVER ()` is added to the columns of the query, so the filter
+    conditions are only evaluated once (the window is computed before
+    LIMIT and OFFSET are applied). Databases without window functions
+    fall back to two queries.
+    """
+    db = entity._database_
+    window = _window_query(query, size, offset) if supports_window_functions(db) else None
+    if window is None:
+        return list(query.limit(size, offset=offset)), query.count()
+
+    sql, arguments, attr_offsets = window
+    rows = db._exec_sql(sql, arguments).fetchall()
+    if not rows:
+        # no window value available for pages behind the last one
+        return [], query.count()
+    total = rows[0][-1]
+    objects = entity._fetch_objects(_RowList([row[:-1] for row in rows]), attr_offsets)
+    return objects, total
@@ -3,13 +3,11 @@
 import datetime
 
 from pony import orm
-# This is important as using orm.desc in a query leads to an Exception
-from pony.orm import desc
 
 from papilotte.connectors.abstractconnector import AbstractConnector
 from papilotte.exceptions import CreationException, ReferentialIntegrityError
 
-from . import filter_queries
+from . import database, jsonsql, paging, planner, serializer, snapshot
 
 
 class PersonConnector(AbstractConnector):
@@ -18,12 +16,15 @@ class PersonConnector(AbstractConnector):
 
     def __init__(self, connector_configuration):
         self.db = connector_configuration["db"]
+        self.serialization = connector_configuration.get("serialization", "python")
 
-    def get(self, obj_id):
+    def get(self, obj_id, fields=None):
         """Return the person dict with id person_id or None.
 
         :param obj_id: the id or uri of the person object to return
         :type object_id: string
+        :param fields: a list of (dotted) field names to return. All fields if None.
+        :type fields: list
         :return: The object as defined in the openAPI definition or None
         :rtype: dict
         """
@@ -32,30 +33,92 @@ class PersonConnector(AbstractConnector):
             Person = self.db.entities["Person"]
             person = Person.get(lambda p: p.id == obj_id or obj_id in p.uris.uri)
             if person:
-                result = person.to_ipif()
+                if fields:
+                    result = serializer.persons_to_ipif(
+                        self.db, [person], serializer.field_tree(fields))[0]
+                else:
+                    result = person.to_ipif()
         return result
 
+    def get_many(self, obj_ids, fields=None):
+        """Return a list containing the person dict (or None) for each id in obj_ids.
+
+        As in get(), ids can also be uris of the person. All persons are
+        loaded with `IN` queries and serialized in one go (see serialize()).
+        The list has the same order as obj_ids.
+        """
+        Person = self.db.entities["Person"]
+        with orm.db_session:
+            objects = serializer.load_by_id_or_uri(Person, obj_ids)
+            persons = list({x.id: x for x in objects.values()}.values())
+            documents = dict(zip((x.id for x in persons), self.serialize(persons, fields=fields)))
+        return [documents.get(objects[obj_id].id) if obj_id in objects else None
+                for obj_id in obj_ids]
+
+    def get_last_modified(self, obj_id):
+        """Return a tuple (exists, modified_when) for the person with id obj_id.
+
+        Only modifiedWhen is read from the database.
+        """
+        Person = self.db.entities["Person"]
+        with orm.db_session:
+            rows = orm.select(
+                (p.id, p.modifiedWhen) for p in Person if p.id == obj_id or obj_id in p.uris.uri
+            )[:1]
+        if not rows:
+            return False, None
+        return True, rows[0][1]
+
+    def get_write_version(self):
+        "Return the write version of the database (see database.touch())."
+        return database.write_version(self.db)
+
     def filter(self, **filters):
         """Return a pony query object with all filters applied.
+
+        Only the subqueries needed for the set filters are used (see planner).
         # TODO: Discuss if metadata should be searched, too
         """
-        Person = self.db.entities["Person"]
-        #with orm.db_session:
-        subquery_person = filter_queries.person_query(self.db, **filters)
-        subquery_source = filter_queries.source_query(self.db, **filters)
-        subquery_statement = filter_queries.statement_query(self.db, **filters)
-        subquery_factoid = filter_queries.factoid_query(self.db, **filters)
-        query = orm.select(p for p in Person
-            if p in subquery_person
-                for f in p.factoids
-                    if (f in subquery_factoid
-                        and f.source in subquery_source)
-                    for stmt in f.statements 
-                        if stmt in subquery_statement
-        )
+        query, _ = planner.plan(self.db, "Person", **filters)
         return query
 
-    def search(self, size, page, sort_by="createdWhen", sort_order="ASC", **filters):
+    def sorted_query(self, sort_by="createdWhen", sort_order="ASC", **filters):
+        """Return a pony query object with all filters and sort order applied.
+        """
+        Person = self.db.entities["Person"]
+        if sort_by == "@id":
+            sort_by = "id"
+        if filters:
+            # TODO: replace datetime by anything which can handle dates bc
+            if "from_" in filters:
+                filters["from_"] = datetime.date.fromisoformat(filters["from_"])
+            if "to" in filters:
+                filters["to"] = datetime.date.fromisoformat(filters["to"])
+            query = self.filter(**filters)
+        else:
+            query = orm.select(p for p in Person)
+
+        # TODO: specifiy sort order values in spec. Sorting by uris should be excluded in
+        # spec (needs discussion)
+
+        # set descending order if necessary and add id as second sort field (if not first)
+        return paging.sort(query, sort_by, sort_order)
+
+    def serialize(self, persons, fields=None):
+        """Return the IPIF documents for a list of Person objects.
+
+        Depending on the 'serialization' setting the documents are dicts
+        or JSON text built by the database (see jsonsql). If fields (a list
+        of dotted field names) is set, only these fields are loaded and
+        returned.
+        """
+        fields = serializer.field_tree(fields)
+        if self.serialization == "database" and fields is None:
+            return jsonsql.to_json(self.db, "Person", [x.id for x in persons])
+        return serializer.persons_to_ipif(self.db, persons, fields)
+
+    def search(self, size, page, sort_by="createdWhen", sort_order="ASC", cursor=None,
+               fields=None, **filters):
         """Find all objects which match the filter conditions set via
         filters.
 
@@ -70,39 +133,53 @@ class PersonConnector(AbstractConnector):
                         It is suggegested to alway use '@id' as as second sort field, to
                         keep result order consistent for paging.
         :type sort_by: str
+        :param cursor: a (sort_value, id) tuple of the last object of the previous page.
+                       If set, `page` is ignored and the page following this object
+                       is returned.
+        :type cursor: tuple
+        :param fields: a list of (dotted) field names to return. All fields if None.
+        :type fields: list
         :return: a list of person objects (represented as dictionaries)
         :rtype: list
         """
         Person = self.db.entities["Person"]
-        if sort_by == "@id":
-            sort_by = "id"
         with orm.db_session:
-            if filters:
-                # TODO: replace datetime by anything which can handle dates bc
-                if "from_" in filters:
-                    filters["from_"] = datetime.date.fromisoformat(filters["from_"])
-                if "to" in filters:
-                    filters["to"] = datetime.date.fromisoformat(filters["to"])
-                query = self.filter(**filters)
+            query = self.sorted_query(sort_by, sort_order, **filters)
+            if cursor:
+                query = paging.seek(query, Person, sort_by, sort_order, cursor)
+                persons = query.limit(size)
             else:
-                with orm.db_session:
-                    query = orm.select(p for p in Person)
+                persons = query.page(page, size)
+            result = self.serialize(persons, fields)
+        return result
 
-            # TODO: specifiy sort order values in spec. Sorting by uris should be excluded in
-            # spec (needs discussion)
+    def search_with_count(self, size, page, sort_by="createdWhen", sort_order="ASC",
+                          cursor=None, fields=None, **filters):
+        """Like search() but return a (result, total_hits) tuple.
 
-            # set descending order if necessary and add id as second sort field (if not first)
-            if sort_order.lower() == "desc":
-                sort_expression = "desc(p.{}), p.id".format(sort_by)
-                query = query.sort_by(sort_expression)
+        Filters are only evaluated once: if the database supports window
+        functions, the page and the number of all matching persons are
+        fetched with a single query.
+        """
+        Person = self.db.entities["Person"]
+        with orm.db_session:
+            query = self.sorted_query(sort_by, sort_order, **filters)
+            if cursor:
+                # a window would only count the persons behind the cursor
+                total = query.count()
+                persons = paging.seek(query, Person, sort_by, sort_order, cursor).limit(size)
             else:
-                if sort_by == "id":
-                    sort_expression = "p.id"
-                else:
-                    sort_expression = "p.{}, p.id".format(sort_by)
-                query = query.sort_by(sort_expression)
-            result = [p.to_ipif() for p in query.page(page, size)]
-        return result
+                persons, total = paging.fetch_with_count(
+                    query, Person, size, (page - 1) * size)
+            result = self.serialize(persons, fields)
+        return result, total
+
+    def export(self, batch_size=200, fields=None, **filters):
+        """Like AbstractConnector.export(), but all batches are read in one
+        transaction, so the export is consistent (see snapshot).
+        """
+        return snapshot.read(self.db, super().export(batch_size, fields, **filters),
+                             batch_size)
 
     def count(self, **filters):
         """Return the number of persons matching the filters.
@@ -140,7 +217,7 @@ class PersonConnector(AbstractConnector):
         """
         Person = self.db.entities["Person"]
         with orm.db_session:
-            person = Person.get_for_update(id=obj_id) or Person(id=obj_id)
+            person = Person.get_for_update(id=obj_id) or Person.create_from_ipif({"@id": obj_id})
             person.update_from_ipif(data)
             result = person.to_ipif()
         return result
@@ -153,6 +230,7 @@ class PersonConnector(AbstractConnector):
         with orm.db_session:
             try:
                 Person[obj_id].delete()
+                database.touch(self.db)
             except orm.ConstraintError:
                 person = Person[obj_id]
                 msg = (
@@ -0,0 +1,143 @@
+"""Build the filter queries of the connectors from the filters actually set.
+
+Each filter belongs to one of the entities Person, Source, Factoid or
+Statement (see FILTERS). Only the subqueries for entities with at least one
+filter set are built. The other entities are connected to the queried
+entity with EXISTS semi-joins (or `IN` for n:1 relations), so the query
+never has to join the statements of a factoid and DISTINCT over the result
+if no statement filter is set.
+
+plan() returns the query and a list of lines describing the chosen plan.
+The plan is logged with level DEBUG; explain() returns the plan together
+with the generated SQL.
+"""
+import logging
+
+from pony import orm
+
+from . import filter_queries
+
+logger = logging.getLogger(__name__)
+
+# The names of the filters handled by the subquery of each entity
+FILTERS = {
+    "Person": ("personId", "p"),
+    "Source": ("sourceId", "label", "s"),
+    "Factoid": ("factoidId", "f"),
+    "Statement": (
+        "statementId",
+        "st",
+        "from_",
+        "memberOf",
+        "name",
+        "place",
+        "relatesToPerson",
+        "role",
+        "statementContent",
+        "statementType",
+        "to",
+    ),
+}
+
+SUBQUERIES = {
+    "Person": filter_queries.person_query,
+    "Source": filter_queries.source_query,
+    "Factoid": filter_queries.factoid_query,
+    "Statement": filter_queries.statement_query,
+}
+
+
+def used_filters(entity_name, filters):
+    "Return the names of all filters of entity_name which are set in filters."
+    return [name for name in FILTERS[entity_name] if filters.get(name)]
+
+
+def needed_entities(filters):
+    "Return the set of entity names with at least one filter set."
+    return {name for name in FILTERS if used_filters(name, filters)}
+
+
+def _own_query(db, entity_name, filters, lines, indent):
+    "Return the query for entity_name restricted by its own filters."
+    used = used_filters(entity_name, filters)
+    if not used:
+        lines.append("{}{}: all".format(indent, entity_name))
+        entity = db.entities[entity_name]
+        return entity.select()
+    lines.append("{}{}: filter {}".format(indent, entity_name, ", ".join(used)))
+    return SUBQUERIES[entity_name](db, **filters)
+
+
+def _factoid_query(db, filters, needed, lines, indent):
+    """Return the query of all factoids matching the filters of the
+    entities in needed (a subset of Factoid, Person, Source, Statement).
+    """
+    query = _own_query(db, "Factoid", filters, lines, indent)
+    indent += "  "
+    if "Person" in needed:
+        subquery_person = SUBQUERIES["Person"](db, **filters)
+        query = query.filter(lambda f: f.person in subquery_person)
+        lines.append(
+            "{}IN Person (factoid.person): filter {}".format(
+                indent, ", ".join(used_filters("Person", filters))
+            )
+        )
+    if "Source" in needed:
+        subquery_source = SUBQUERIES["Source"](db, **filters)
+        query = query.filter(lambda f: f.source in subquery_source)
+        lines.append(
+            "{}IN Source (factoid.source): filter {}".format(
+                indent, ", ".join(used_filters("Source", filters))
+            )
+        )
+    if "Statement" in needed:
+        subquery_statement = SUBQUERIES["Statement"](db, **filters)
+        query = query.filter(
+            lambda f: orm.exists(s for s in f.statements if s in subquery_statement)
+        )
+        lines.append(
+            "{}EXISTS Statement (factoid.statements): filter {}".format(
+                indent, ", ".join(used_filters("Statement", filters))
+            )
+        )
+    return query
+
+
+def plan(db, entity_name, **filters):
+    """Return a (query, lines) tuple for entity_name (Person, Source,
+    Factoid or Statement).
+
+    query is a pony query with all filters applied, lines is a list of
+    strings describing the plan.
+    """
+    needed = needed_entities(filters)
+    lines = []
+    if entity_name == "Factoid":
+        query = _factoid_query(db, filters, needed, lines, "")
+    else:
+        query = _own_query(db, entity_name, filters, lines, "")
+        # the filters which have to be checked via the factoids
+        others = needed - {entity_name}
+        if entity_name in ("Person", "Source"):
+            key = entity_name.lower()
+            if others:
+                lines.append("  EXISTS Factoid ({}.factoids):".format(key))
+                subquery_factoid = _factoid_query(db, filters, others, lines, "    ")
+                query = query.filter(
+                    lambda x: orm.exists(f for f in x.factoids if f in subquery_factoid)
+                )
+        elif others:
+            lines.append("  IN Factoid (statement.factoid):")
+            subquery_factoid = _factoid_query(db, filters, others, lines, "    ")
+            query = query.filter(lambda s: s.factoid in subquery_factoid)
+    logger.debug("Filter plan for %s:\n%s", entity_name, "\n".join(lines))
+    return query, lines
+
+
+def explain(db, entity_name, **filters):
+    """Return the plan for entity_name and filters and the resulting SQL
+    as string (for debugging).
+    """
+    query, lines = plan(db, entity_name, **filters)
+    sql = query._construct_sql_and_arguments()[0]
+    return "{}\n\n{}".format("\n".join(lines), sql)
@@ -0,0 +1,251 @@
+"""A bounded connection pool shared by all threads.
+
+Pony keeps one connection per thread (and never closes it). With a
+threaded server this means an unlimited number of connections to the
+database server. install() replaces the pool of a db by a ConnectionPool:
+
+  * at most max_size connections exist; a db_session waits up to timeout
+    seconds for a free connection (else PoolTimeout is raised)
+  * min_size connections are opened on start and always kept
+  * connections idle for more than recycle seconds are closed
+  * the sql commands in init_sql (eg. "SET statement_timeout = '30s'") are
+    executed on each new connection
+
+Connections are created by the original pony pool, so the driver
+specific setup of pony (encoding, converters) is kept. stats() returns
+counters for sizing the pool; the server logs them periodically (see
+Reporter). A PoolTimeout is answered with '503 Service Unavailable'.
+"""
+import collections
+import logging
+import os
+import threading
+import time
+
+from papilotte.exceptions import ServiceUnavailableError
+
+logger = logging.getLogger(__name__)
+
+# Default seconds to wait for a free connection
+TIMEOUT = 30
+
+# Seconds after which a client should retry after a PoolTimeout
+RETRY_AFTER = 5
+
+# Default seconds between two log entries of the Reporter
+LOG_INTERVAL = 300
+
+
+class PoolTimeout(ServiceUnavailableError):
+    "Raised if no connection is available within the timeout."
+
+    def __init__(self, message):
+        super().__init__(message, RETRY_AFTER)
+
+
+class ConnectionPool:
+    """A pool of at most max_size connections created by factory (a pony
+    Pool object).
+
+    Implements the interface of the pony pools (connect, release, drop,
+    disconnect).
+    """
+
+    def __init__(self, factory, min_size=0, max_size=10, timeout=TIMEOUT,
+                 recycle=0, init_sql=()):
+        self.factory = factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.init_sql = list(init_sql)
+        # (connection, time of release) with the most recently used last
+        self.idle = collections.deque()
+        self.size = 0
+        self.pid = os.getpid()
+        self.counters = collections.Counter()
+        self.max_wait = 0.0
+        self.condition = threading.Condition()
+        for _ in range(min_size):
+            con = self._open()
+            with self.condition:
+                self.size += 1
+                self.idle.append((con, time.monotonic()))
+
+    def _open(self):
+        "Open a new connection and run the init sql commands."
+        self.factory._connect()
+        con, self.factory.con = self.factory.con, None
+        try:
+            if self.init_sql:
+                cursor = con.cursor()
+                for sql in self.init_sql:
+                    cursor.execute(sql)
+                con.commit()
+        except Exception:
+            con.close()
+            raise
+        with self.condition:
+            self.counters["created"] += 1
+        return con
+
+    @staticmethod
+    def _close(con):
+        try:
+            con.close()
+        except Exception:  # pylint: disable=broad-except
+            logger.warning("Cannot close database connection", exc_info=True)
+
+    def _check_fork(self):
+        "Forget the connections of the parent process after a fork."
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.idle.clear()
+            self.size = 0
+
+    def _expired(self, now):
+        "Remove and return the connections idle for too long."
+        expired = []
+        if self.recycle:
+            # the least recently used connections come first
+            while (self.idle and self.size - len(expired) > self.min_size
+                   and now - self.idle[0][1] > self.recycle):
+                expired.append(self.idle.popleft()[0])
+            self.size -= len(expired)
+            self.counters["recycled"] += len(expired)
+        return expired
+
+    def connect(self):
+        """Return a tuple (connection, is_new_connection).
+
+        Wait for a free connection if the pool is exhausted.
+        """
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self.condition:
+            self._check_fork()
+            expired = self._expired(start)
+            waited = False
+            while not self.idle and self.size >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.counters["timeouts"] += 1
+                    logger.warning("Connection pool exhausted: %s", self._stats())
+                    raise PoolTimeout(
+                        "No database connection available within {} seconds".format(
+                            self.timeout))
+                waited = True
+                self.condition.wait(remaining)
+            if waited:
+                self.counters["waits"] += 1
+                self.max_wait = max(self.max_wait, time.monotonic() - start)
+            self.counters["acquired"] += 1
+            con = self.idle.pop()[0] if self.idle else None
+            if con is None:
+                self.size += 1
+        for old in expired:
+            self._close(old)
+        if con is not None:
+            return con, False
+        try:
+            return self._open(), True
+        except Exception:
+            self._removed()
+            raise
+
+    def _removed(self):
+        "Free the slot of a closed connection."
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+    def release(self, con):
+        "Return con to the pool."
+        try:
+            con.rollback()
+        except Exception:
+            self.drop(con)
+            raise
+        with self.condition:
+            if self.pid != os.getpid():
+                return
+            self.idle.append((con, time.monotonic()))
+            self.condition.notify()
+
+    def drop(self, con):
+        "Close the (broken) connection con."
+        self._close(con)
+        with self.condition:
+            self.counters["dropped"] += 1
+        self._removed()
+
+    def disconnect(self):
+        "Close all idle connections."
+        with self.condition:
+            self._check_fork()
+            idle = [con for con, _ in self.idle]
+            self.idle.clear()
+            self.size -= len(idle)
+        for con in idle:
+            self._close(con)
+
+    def _stats(self):
+        stats = {
+            "size": self.size,
+            "idle": len(self.idle),
+            "in_use": self.size - len(self.idle),
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "max_wait": round(self.max_wait, 3),
+        }
+        for name in ("acquired", "created", "recycled", "dropped", "waits", "timeouts"):
+            stats[name] = self.counters[name]
+        return stats
+
+    def stats(self):
+        """Return a dict with the current number of connections (size, idle,
+        in_use) and counters since the start: acquired connections, created,
+        recycled and dropped connections, number of waits for a free
+        connection, timeouts and the longest wait in seconds.
+        """
+        with self.condition:
+            return self._stats()
+
+
+class Reporter(threading.Thread):
+    """A background thread logging the statistics returned by stats() (a
+    function without arguments) every interval seconds.
+    """
+
+    def __init__(self, stats, interval=LOG_INTERVAL):
+        super().__init__(name="papilotte-pool-stats", daemon=True)
+        self.stats = stats
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            logger.info("Connection pool: %s", self.stats())
+
+    def stop(self):
+        "Stop the thread."
+        self.stopped.set()
+
+
+def install(db, min_size=0, max_size=10, timeout=TIMEOUT, recycle=0, init_sql=()):
+    "Use a ConnectionPool for db. Return the pool."
+    provider = db.provider
+    factory = provider.pool
+    # close the connection pony opened for this thread
+    factory.disconnect()
+    pool = ConnectionPool(factory, min_size, max_size, timeout, recycle, init_sql)
+    provider.pool = pool
+    return pool
+
+
+def stats(db):
+    "Return the statistics of the pool of db (None if no ConnectionPool is used)."
+    pool = db.provider.pool
+    if isinstance(pool, ConnectionPool):
+        return pool.stats()
+    return None
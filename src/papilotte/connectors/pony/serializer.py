@@ -0,0 +1,326 @@
+"""Batched serialization of pony entities into IPIF dictionaries.
+
+Calling to_ipif() on each object of a result page lazily loads every
+related object and collection, which results in a number of queries
+growing with the page size. The functions in this module first load all
+related data for a whole list of objects with a small, fixed number of
+`IN (...)` queries and then build the IPIF dicts from this data.
+
+The resulting dicts are the same as those returned by the to_ipif()
+methods of the entities.
+"""
+from collections import defaultdict
+
+from pony import orm
+
+# Maximum number of values used in a single `IN (...)` clause
+CHUNK_SIZE = 500
+
+
+def chunks(values):
+    "Split values into lists of at most CHUNK_SIZE values."
+    values = list(values)
+    for i in range(0, len(values), CHUNK_SIZE):
+        yield values[i:i + CHUNK_SIZE]
+
+
+def field_tree(fields):
+    """Turn a list of (dotted) field names into a tree of nested dicts.
+
+    ['@id', 'statements.date'] becomes {'@id': None, 'statements': {'date': None}}.
+    None means all fields (of the object or subobject) are requested.
+    """
+    if not fields:
+        return None
+    tree = {}
+    for field in fields:
+        node = tree
+        parts = field.split(".")
+        for part in parts[:-1]:
+            if part in node and node[part] is None:
+                break
+            node = node.setdefault(part, {})
+        else:
+            node[parts[-1]] = None
+    return tree
+
+
+def wanted(fields, key):
+    "Return True if key is requested by field tree fields."
+    return fields is None or key in fields
+
+
+def subfields(fields, key):
+    "Return the field tree for the value(s) of key."
+    if fields is None:
+        return None
+    return fields.get(key)
+
+
+def prune(data, fields):
+    "Remove all keys from data (dict or list of dicts) not requested by fields."
+    if fields is None:
+        return data
+    if isinstance(data, list):
+        return [prune(value, fields) for value in data]
+    if not isinstance(data, dict):
+        return data
+    return {key: prune(value, fields[key]) for key, value in data.items() if key in fields}
+
+
+def load(entity, ids):
+    """Load all objects of entity with a primary key in ids into the pony cache.
+
+    Return a dict mapping the ids to the loaded objects.
+    """
+    objects = {}
+    for chunk in chunks(set(ids)):
+        for obj in orm.select(x for x in entity if x.id in chunk):
+            objects[obj.id] = obj
+    return objects
+
+
+def load_by_id_or_uri(entity, keys):
+    """Like load(), but keys can also be uris of the objects (as in the
+    connector's get()).
+
+    Return a dict mapping the found keys to the loaded objects. Keys which
+    are no id are looked up with one more `IN` query on the uris. If several
+    objects have the same uri, the one with the smallest id is returned.
+    """
+    objects = load(entity, keys)
+    by_uri = {}
+    for chunk in chunks(set(keys) - set(objects)):
+        query = orm.select((u.uri, x) for x in entity for u in x.uris if u.uri in chunk)
+        for uri, obj in query.without_distinct():
+            if uri not in by_uri or obj.id < by_uri[uri].id:
+                by_uri[uri] = obj
+    objects.update(by_uri)
+    return objects
+
+
+def load_collection(entity, attr, ids):
+    """Return a dict mapping each id in ids to the list of objects
+    in collection `attr` of entity.
+
+    Eg. load_collection(Person, 'uris', ['P1']) returns {'P1': [PersonURI[...], ...]}.
+    Only the primary keys of the returned objects are loaded.
+    """
+    values = defaultdict(list)
+    for chunk in chunks(set(ids)):
+        query = orm.select(
+            (x.id, item) for x in entity for item in getattr(x, attr) if x.id in chunk
+        )
+        for obj_id, item in query.without_distinct():
+            values[obj_id].append(item)
+    return values
+
+
+def meta_to_ipif(obj):
+    "Return the columns of obj (see to_dict()) in an IPIF-conform way."
+    data = obj.to_dict()
+    data["@id"] = data.pop("id")
+    for key in ("createdWhen", "modifiedWhen"):
+        if data.get(key):
+            data[key] = data[key].isoformat()
+        else:
+            data[key] = ""
+    return data
+
+
+def statement_ids(db, factoid_ids):
+    """Return a dict mapping each id in factoid_ids to the sorted list of
+    the ids of its statements.
+    """
+    Statement = db.entities["Statement"]
+    stmt_ids = defaultdict(list)
+    for chunk in chunks(set(factoid_ids)):
+        query = orm.select((s.factoid.id, s.id) for s in Statement if s.factoid.id in chunk)
+        for factoid_id, stmt_id in query.without_distinct():
+            stmt_ids[factoid_id].append(stmt_id)
+    for values in stmt_ids.values():
+        values.sort()
+    return stmt_ids
+
+
+def factoid_refs(db, key, ids):
+    """Return a dict mapping each id in ids to the list of factoid-refs
+    of all factoids where `factoid.<key>.id` is one of ids.
+
+    key is one of 'id', 'person' or 'source'.
+    """
+    Factoid = db.entities["Factoid"]
+    rows = []
+    for chunk in chunks(set(ids)):
+        if key == "id":
+            query = orm.select(
+                (f.id, f.id, f.person.id, f.source.id) for f in Factoid if f.id in chunk
+            )
+        else:
+            query = orm.select(
+                (getattr(f, key).id, f.id, f.person.id, f.source.id)
+                for f in Factoid
+                if getattr(f, key).id in chunk
+            )
+        rows.extend(query.without_distinct())
+    stmt_ids = statement_ids(db, set(row[1] for row in rows))
+
+    refs = defaultdict(list)
+    for obj_id, factoid_id, person_id, source_id in rows:
+        refs[obj_id].append(
+            {
+                "@id": factoid_id,
+                "source-ref": {"@id": source_id},
+                "person-ref": {"@id": person_id},
+                "statement-refs": [{"@id": stmt_id} for stmt_id in stmt_ids[factoid_id]],
+            }
+        )
+    for ref_list in refs.values():
+        ref_list.sort(key=lambda f: f["@id"])
+    return refs
+
+
+def _persons_or_sources_to_ipif(db, entity_name, objects, fields=None):
+    "Serialize a list of Person or Source objects."
+    entity = db.entities[entity_name]
+    ids = [obj.id for obj in objects]
+    result = []
+    for obj in objects:
+        result.append(meta_to_ipif(obj))
+    if wanted(fields, "uris"):
+        uris = load_collection(entity, "uris", ids)
+        for obj, data in zip(objects, result):
+            data["uris"] = sorted(u.uri for u in uris[obj.id])
+    if wanted(fields, "factoid-refs"):
+        refs = factoid_refs(db, entity_name.lower(), ids)
+        for obj, data in zip(objects, result):
+            data["factoid-refs"] = refs[obj.id]
+    return prune(result, fields)
+
+
+def persons_to_ipif(db, persons, fields=None):
+    """Return a list of IPIF dicts for a list of Person objects.
+
+    The same as `[p.to_ipif() for p in persons]`, but with a fixed
+    number of queries. If fields (a field tree, see field_tree()) is set,
+    only the requested fields are loaded and returned.
+    """
+    return _persons_or_sources_to_ipif(db, "Person", persons, fields)
+
+
+def sources_to_ipif(db, sources, fields=None):
+    """Return a list of IPIF dicts for a list of Source objects.
+
+    The same as `[s.to_ipif() for s in sources]`, but with a fixed
+    number of queries. If fields (a field tree, see field_tree()) is set,
+    only the requested fields are loaded and returned.
+    """
+    return _persons_or_sources_to_ipif(db, "Source", sources, fields)
+
+
+def statements_to_ipif(db, statements, fields=None):
+    """Return a list of IPIF dicts for a list of Statement objects.
+
+    The same as `[s.to_ipif() for s in statements]`, but with a fixed
+    number of queries. If fields (a field tree, see field_tree()) is set,
+    only the requested fields are loaded and returned.
+    """
+    Statement = db.entities["Statement"]
+    ids = [stmt.id for stmt in statements]
+    result = [meta_to_ipif(stmt) for stmt in statements]
+    # Load all requested n:1 objects into the pony cache.
+    # Reading the id of a related object does not trigger a query.
+    for attr, entity_name in (
+        ("date", "Date"),
+        ("role", "Role"),
+        ("memberOf", "MemberGroup"),
+        ("statementType", "StatementType"),
+    ):
+        if not wanted(fields, attr):
+            continue
+        related_ids = [getattr(stmt, attr).id for stmt in statements if getattr(stmt, attr)]
+        load(db.entities[entity_name], related_ids)
+        for stmt, data in zip(statements, result):
+            if getattr(stmt, attr):
+                data[attr] = getattr(stmt, attr).to_ipif()
+    if wanted(fields, "uris"):
+        uris = load_collection(Statement, "uris", ids)
+        for stmt, data in zip(statements, result):
+            data["uris"] = sorted(u.uri for u in uris[stmt.id])
+    for attr, entity_name in (("places", "Place"), ("relatesToPersons", "RelatesToPerson")):
+        if not wanted(fields, attr):
+            continue
+        values = load_collection(Statement, attr, ids)
+        load(db.entities[entity_name], [x.id for objs in values.values() for x in objs])
+        for stmt, data in zip(statements, result):
+            data[attr] = sorted(
+                [x.to_ipif() for x in values[stmt.id]],
+                key=lambda x: (x.get("label", ""), x.get("uri", "")),
+            )
+    if wanted(fields, "factoid-refs"):
+        refs = factoid_refs(db, "id", [stmt.factoid.id for stmt in statements if stmt.factoid])
+        for stmt, data in zip(statements, result):
+            data["factoid-refs"] = refs[stmt.factoid.id] if stmt.factoid else []
+    return prune(result, fields)
+
+
+def factoids_to_ipif(db, factoids, fields=None):
+    """Return a list of IPIF dicts for a list of Factoid objects.
+
+    The same as `[f.to_ipif() for f in factoids]`, but with a fixed
+    number of queries. If fields (a field tree, see field_tree()) is set,
+    only the requested fields are loaded and returned.
+    """
+    Statement = db.entities["Statement"]
+    ids = [factoid.id for factoid in factoids]
+    result = [meta_to_ipif(factoid) for factoid in factoids]
+    for attr, func in (("person", persons_to_ipif), ("source", sources_to_ipif)):
+        if not wanted(fields, attr):
+            continue
+        related = load(db.entities[attr.capitalize()], [getattr(f, attr).id for f in factoids])
+        dicts = dict(zip(related, func(db, list(related.values()), subfields(fields, attr))))
+        for factoid, data in zip(factoids, result):
+            data[attr] = dicts[getattr(factoid, attr).id]
+    if wanted(fields, "statements"):
+        statements = []
+        for chunk in chunks(set(ids)):
+            statements.extend(orm.select(s for s in Statement if s.factoid.id in chunk))
+        statements.sort(key=lambda s: s.id)
+        statement_dicts = defaultdict(list)
+        stmt_ids = defaultdict(list)
+        for stmt, data in zip(
+            statements, statements_to_ipif(db, statements, subfields(fields, "statements"))
+        ):
+            statement_dicts[stmt.factoid.id].append(data)
+            stmt_ids[stmt.factoid.id].append(stmt.id)
+        for factoid, data in zip(factoids, result):
+            data["statements"] = statement_dicts[factoid.id]
+    elif wanted(fields, "statement-refs"):
+        stmt_ids = statement_ids(db, ids)
+    for factoid, data in zip(factoids, result):
+        data["person-ref"] = {"@id": factoid.person.id}
+        data["source-ref"] = {"@id": factoid.source.id}
+        if wanted(fields, "statement-refs"):
+            data["statement-refs"] = [{"@id": stmt_id} for stmt_id in stmt_ids[factoid.id]]
+    return prune(result, fields)
+
+
+def reduced_factoids_to_ipif(db, factoids, fields=None):
+    """Return a list of reduced IPIF dicts (depth=reduced) for a list of
+    Factoid objects.
+
+    Person, source and statements only contain their '@id'. Only the
+    factoid rows and the ids of their statements are read from the database.
+    """
+    stmt_ids = statement_ids(db, [factoid.id for factoid in factoids])
+    result = []
+    for factoid in factoids:
+        data = meta_to_ipif(factoid)
+        data["person"] = {"@id": factoid.person.id}
+        data["source"] = {"@id": factoid.source.id}
+        data["statements"] = [{"@id": stmt_id} for stmt_id in stmt_ids[factoid.id]]
+        data["person-ref"] = {"@id": factoid.person.id}
+        data["source-ref"] = {"@id": factoid.source.id}
+        data["statement-refs"] = [{"@id": stmt_id} for stmt_id in stmt_ids[factoid.id]]
+        result.append(data)
+    return prune(result, fields)
@@ -0,0 +1,77 @@
+"""Consistent reads over many batches (used for exports).
+
+An export fetches all objects in batches of a few hundred objects. If
+each batch used its own transaction, objects changed during the export
+could be missing or appear in an older and a newer version. read() runs
+all batches in one read only transaction, in which every query sees the
+data as committed at its start:
+
+  * PostgreSQL: REPEATABLE READ
+  * MySQL: a consistent snapshot (REPEATABLE READ)
+  * SQLite: a deferred transaction, if the database is in WAL mode. In
+    other journal modes writers could not commit until the export is
+    finished, so no snapshot is used there (nor for in-memory databases,
+    whose connection is shared by all threads).
+
+The transaction is started with plain sql, so pony neither locks the
+database (as with immediate=True) nor ends the transaction itself.
+Pony keeps every object loaded in a db_session, so the session cache is
+cleared after each batch.
+"""
+from pony import orm
+
+BEGIN_STATEMENTS = {
+    "PostgreSQL": ["BEGIN ISOLATION LEVEL REPEATABLE READ, READ ONLY"],
+    "MySQL": ["SET TRANSACTION ISOLATION LEVEL REPEATABLE READ",
+              "START TRANSACTION WITH CONSISTENT SNAPSHOT"],
+    "SQLite": ["BEGIN"],
+}
+
+
+def _begin_statements(db):
+    "Return the sql commands starting a snapshot on db (empty if not supported)."
+    dialect = db.provider.dialect
+    if dialect == "SQLite":
+        if getattr(db.provider.pool, "filename", None) == ":memory:":
+            return []
+        if db._exec_sql("PRAGMA journal_mode").fetchone()[0].lower() != "wal":
+            return []
+    return BEGIN_STATEMENTS.get(dialect, [])
+
+
+def clear_cache(db):
+    """Forget all objects loaded in the current db_session.
+
+    Only for sessions which do not change data. Must be called inside a
+    db_session.
+    """
+    cache = db._get_cache()
+    assert not cache.modified
+    cache.objects.clear()
+    cache.indexes.clear()
+    cache.seeds.clear()
+    cache.query_results.clear()
+    cache.collection_statistics.clear()
+    cache.dbvals_deduplication_cache.clear()
+
+
+def read(db, objects, batch_size):
+    """Return a generator over objects (an iterator fetching its objects
+    from db in batches of batch_size objects) which reads all batches in
+    one snapshot.
+
+    The db_session stays open until the generator is exhausted or closed,
+    so no other db_session must be used in this thread meanwhile.
+    """
+    with orm.db_session:
+        begin = _begin_statements(db)
+        for sql in begin:
+            db._exec_sql(sql)
+        try:
+            for number, obj in enumerate(objects, 1):
+                yield obj
+                if number % batch_size == 0:
+                    clear_cache(db)
+        finally:
+            if begin:
+                db._exec_sql("ROLLBACK")
@@ -3,13 +3,11 @@
 import datetime
 
 from pony import orm
-# This is important as using orm.desc in a query leads to an Exception
-from pony.orm import desc
 
 from papilotte.connectors.abstractconnector import AbstractConnector
 from papilotte.exceptions import CreationException, ReferentialIntegrityError
 
-from . import filter_queries
+from . import database, jsonsql, paging, planner, serializer, snapshot
 
 
 class SourceConnector(AbstractConnector):
@@ -18,12 +16,15 @@ class SourceConnector(AbstractConnector):
 
     def __init__(self, connector_configuration):
         self.db = connector_configuration["db"]
+        self.serialization = connector_configuration.get("serialization", "python")
 
-    def get(self, obj_id):
+    def get(self, obj_id, fields=None):
         """Return the source dict with id source_id or None if no such source.
 
         :param obj_id: the id or uri of the source object to return
         :type object_id: string
+        :param fields: a list of (dotted) field names to return. All fields if None.
+        :type fields: list
         :return: The object as defined in the openAPI definition or None
         :rtype: dict
         """
@@ -32,30 +33,92 @@ class SourceConnector(AbstractConnector):
         with orm.db_session:
             source = Source.get(lambda s: s.id == obj_id or obj_id in s.uris.uri)
             if source:
-                result = source.to_ipif()
+                if fields:
+                    result = serializer.sources_to_ipif(
+                        self.db, [source], serializer.field_tree(fields))[0]
+                else:
+                    result = source.to_ipif()
         return result
 
+    def get_many(self, obj_ids, fields=None):
+        """Return a list containing the source dict (or None) for each id in obj_ids.
+
+        As in get(), ids can also be uris of the source. All sources are
+        loaded with `IN` queries and serialized in one go (see serialize()).
+        The list has the same order as obj_ids.
+        """
+        Source = self.db.entities["Source"]
+        with orm.db_session:
+            objects = serializer.load_by_id_or_uri(Source, obj_ids)
+            sources = list({x.id: x for x in objects.values()}.values())
+            documents = dict(zip((x.id for x in sources), self.serialize(sources, fields=fields)))
+        return [documents.get(objects[obj_id].id) if obj_id in objects else None
+                for obj_id in obj_ids]
+
+    def get_last_modified(self, obj_id):
+        """Return a tuple (exists, modified_when) for the source with id obj_id.
+
+        Only modifiedWhen is read from the database.
+        """
+        Source = self.db.entities["Source"]
+        with orm.db_session:
+            rows = orm.select(
+                (s.id, s.modifiedWhen) for s in Source if s.id == obj_id or obj_id in s.uris.uri
+            )[:1]
+        if not rows:
+            return False, None
+        return True, rows[0][1]
+
+    def get_write_version(self):
+        "Return the write version of the database (see database.touch())."
+        return database.write_version(self.db)
+
     def filter(self, **filters):
         """Return a pony query object with all filters applied.
+
+        Only the subqueries needed for the set filters are used (see planner).
         # TODO: Discuss if metadata should be searched, too
         """
-        Source = self.db.entities["Source"]
-        subquery_source = filter_queries.source_query(self.db, **filters)
-        subquery_person = filter_queries.person_query(self.db, **filters)
-        subquery_statement = filter_queries.statement_query(self.db, **filters)
-        subquery_factoid = filter_queries.factoid_query(self.db, **filters)
-        query = orm.select(s for s in Source
-            if s in subquery_source
-                for f in s.factoids
-                    if (f in subquery_factoid
-                        and f.person in subquery_person)
-                    for stmt in f.statements 
-                        if stmt in subquery_statement
-        )
+        query, _ = planner.plan(self.db, "Source", **filters)
         return query
 
+    def sorted_query(self, sort_by="createdWhen", sort_order="ASC", **filters):
+        """Return a pony query object with all filters and sort order applied.
+        """
+        Source = self.db.entities["Source"]
+        if sort_by == "@id":
+            sort_by = "id"
+        if filters:
+            # TODO: replace datetime by anything which can handle dates bc
+            if "from_" in filters:
+                filters["from_"] = datetime.date.fromisoformat(filters["from_"])
+            if "to" in filters:
+                filters["to"] = datetime.date.fromisoformat(filters["to"])
+            query = self.filter(**filters)
+        else:
+            query = orm.select(s for s in Source)
+
+        # TODO: specifiy sort order values in spec. Sorting by uris should be excluded in
+        # spec (needs discussion)
+
+        # set descending order if necessary and add id as second sort field (if not first)
+        return paging.sort(query, sort_by, sort_order)
+
+    def serialize(self, sources, fields=None):
+        """Return the IPIF documents for a list of Source objects.
+
+        Depending on the 'serialization' setting the documents are dicts
+        or JSON text built by the database (see jsonsql). If fields (a list
+        of dotted field names) is set, only these fields are loaded and
+        returned.
+        """
+        fields = serializer.field_tree(fields)
+        if self.serialization == "database" and fields is None:
+            return jsonsql.to_json(self.db, "Source", [x.id for x in sources])
+        return serializer.sources_to_ipif(self.db, sources, fields)
 
-    def search(self, size, page, sort_by="createdWhen", sort_order="ASC", **filters):
+    def search(self, size, page, sort_by="createdWhen", sort_order="ASC", cursor=None,
+               fields=None, **filters):
         """Find all objects which match the filter conditions set via
         filters.
 
@@ -69,38 +132,53 @@ class SourceConnector(AbstractConnector):
                         It is suggegested to alway use '@id' as as second sort field, to
                         keep result order consistent for paging.
         :type sort_by: str
+        :param cursor: a (sort_value, id) tuple of the last object of the previous page.
+                       If set, `page` is ignored and the page following this object
+                       is returned.
+        :type cursor: tuple
+        :param fields: a list of (dotted) field names to return. All fields if None.
+        :type fields: list
         :return: a list of source objects (represented as dictionaries)
         :rtype: list
         """
         Source = self.db.entities["Source"]
-        if sort_by == "@id":
-            sort_by = "id"
         with orm.db_session:
-            if filters:
-                # TODO: replace datetime by anything which can handle dates bc
-                if "from_" in filters:
-                    filters["from_"] = datetime.date.fromisoformat(filters["from_"])
-                if "to" in filters:
-                    filters["to"] = datetime.date.fromisoformat(filters["to"])
-                query = self.filter(**filters)
+            query = self.sorted_query(sort_by, sort_order, **filters)
+            if cursor:
+                query = paging.seek(query, Source, sort_by, sort_order, cursor)
+                sources = query.limit(size)
             else:
-                query = orm.select(s for s in Source)
+                sources = query.page(page, size)
+            result = self.serialize(sources, fields)
+        return result
 
-            # TODO: specifiy sort order values in spec. Sorting by uris should be excluded in
-            # spec (needs discussion)
+    def search_with_count(self, size, page, sort_by="createdWhen", sort_order="ASC",
+                          cursor=None, fields=None, **filters):
+        """Like search() but return a (result, total_hits) tuple.
 
-            # set descending order if necessary and add id as second sort field (if not first)
-            if sort_order.lower() == "desc":
-                sort_expression = "desc(s.{}), s.id".format(sort_by)
-                query = query.sort_by(sort_expression)
+        Filters are only evaluated once: if the database supports window
+        functions, the page and the number of all matching sources are
+        fetched with a single query.
+        """
+        Source = self.db.entities["Source"]
+        with orm.db_session:
+            query = self.sorted_query(sort_by, sort_order, **filters)
+            if cursor:
+                # a window would only count the sources behind the cursor
+                total = query.count()
+                sources = paging.seek(query, Source, sort_by, sort_order, cursor).limit(size)
             else:
-                if sort_by == "id":
-                    sort_expression = "s.id"
-                else:
-                    sort_expression = "s.{}, s.id".format(sort_by)
-                query = query.sort_by(sort_expression)
-            result = [s.to_ipif() for s in query.page(page, size)]
-        return result
+                sources, total = paging.fetch_with_count(
+                    query, Source, size, (page - 1) * size)
+            result = self.serialize(sources, fields)
+        return result, total
+
+    def export(self, batch_size=200, fields=None, **filters):
+        """Like AbstractConnector.export(), but all batches are read in one
+        transaction, so the export is consistent (see snapshot).
+        """
+        return snapshot.read(self.db, super().export(batch_size, fields, **filters),
+                             batch_size)
 
     def count(self, **filters):
         """Return the number of sources matching the filters.
@@ -138,7 +216,7 @@ class SourceConnector(AbstractConnector):
         """
         Source = self.db.entities["Source"]
         with orm.db_session:
-            source = Source.get_for_update(id=obj_id) or Source(id=obj_id)
+            source = Source.get_for_update(id=obj_id) or Source.create_from_ipif({"@id": obj_id})
             source.update_from_ipif(data)
             result = source.to_ipif()
         return result
@@ -151,6 +229,7 @@ class SourceConnector(AbstractConnector):
         with orm.db_session:
             try:
                 Source[obj_id].delete()
+                database.touch(self.db)
             except orm.ConstraintError:
                 source = Source[obj_id]
                 msg = (
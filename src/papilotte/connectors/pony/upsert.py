@@ -0,0 +1,80 @@
+"""Native upserts for the lookup tables.
+
+The lookup tables (Role, Place, Date etc.) have unique indexes on their
+natural keys (see database.UNIQUE_INDEXES). get_or_create() inserts a
+missing row with a single statement which does nothing if another
+transaction has already inserted a row with the same key:
+
+  * SQLite >= 3.35 and PostgreSQL: INSERT ... ON CONFLICT DO NOTHING RETURNING
+  * MySQL: INSERT IGNORE
+
+Upserts are only used for tables whose unique indexes exist (see enable()).
+Databases created by older versions of papilotte can contain duplicates;
+'papilotte db create-indexes' merges them and adds the indexes.
+"""
+import sqlite3
+import weakref
+
+# db -> set of names of the entities using upserts
+_enabled = weakref.WeakKeyDictionary()
+
+
+def is_supported(db):
+    "Return True if db supports upserts."
+    dialect = db.provider.dialect
+    if dialect == "SQLite":
+        # RETURNING was added in 3.35
+        return sqlite3.sqlite_version_info >= (3, 35)
+    return dialect in ("PostgreSQL", "MySQL")
+
+
+def enable(db, entity_name, enabled=True):
+    "Use (or stop using) upserts for the lookup table entity_name."
+    names = _enabled.setdefault(db, set())
+    if enabled:
+        names.add(entity_name)
+    else:
+        names.discard(entity_name)
+
+
+def is_enabled(entity):
+    "Return True if upserts are used for the lookup table entity."
+    return entity.__name__ in _enabled.get(entity._database_, ())
+
+
+def insert(entity, values):
+    """Insert a row with values (a dict: attribute name -> value) into the
+    lookup table entity unless a row with the same key exists.
+
+    Return the new object or None if the row existed. Must be called
+    inside a db_session.
+    """
+    db = entity._database_
+    quote_name = db.provider.quote_name
+    attrs = [entity._adict_[name] for name in values]
+    params = {"v{}".format(i): attr.validate(values[attr.name], None, entity)
+              for i, attr in enumerate(attrs)}
+    pk_attr = entity._pk_attrs_[0]
+    sql = "INSERT {}INTO {} ({}) VALUES ({})".format(
+        "IGNORE " if db.provider.dialect == "MySQL" else "",
+        quote_name(entity._table_),
+        ", ".join(quote_name(attr.column) for attr in attrs),
+        ", ".join("$v{}".format(i) for i in range(len(attrs))),
+    )
+    if db.provider.dialect == "MySQL":
+        cursor = db.execute(sql, params)
+        if cursor.rowcount != 1:
+            return None
+        pk = values.get(pk_attr.name, cursor.lastrowid)
+    else:
+        sql += " ON CONFLICT DO NOTHING RETURNING {}".format(quote_name(pk_attr.column))
+        row = db.execute(sql, params).fetchone()
+        if row is None:
+            return None
+        pk = row[0]
+    obj = entity._get_by_raw_pkval_((pk,))
+    # set the values like pony does for loaded rows, so no query is needed
+    # to read them
+    obj._db_set_({attr: params["v{}".format(i)] for i, attr in enumerate(attrs)
+                  if not attr.is_pk})
+    return obj
@@ -0,0 +1,173 @@
+"""Versions of the data and of the lookup tables.
+
+ETags of search results (see api.collection_etag), the label indexes (see
+labelindex) and the lookup caches (see lookupcache) need to know if data
+was changed, also by other processes. Instead of counters in a single row,
+which every writer would have to lock until its commit, each transaction
+changing data appends a row to ChangeLog for every changed name: DATA for
+any change of factoids, persons, sources or statements and the entity name
+for rows added to or removed from a lookup table. The version of a name is
+the largest id of its rows. Appending rows never waits for other writers.
+
+On PostgreSQL and MySQL the rows are appended right after the commit (in a
+short transaction of their own). So a version read before the data is
+never newer than the data: a change committed after reading the version
+always gets a larger id. (Rows appended before the commit could be
+overtaken by a concurrent transaction with a larger id, which would make
+a version current before the change is visible.) SQLite serializes writing
+transactions, so there the rows are appended before the commit.
+
+After the commit the functions registered with add_listener() are called
+with the new versions, so the indexes of this process can apply their
+changes instead of reloading the table.
+"""
+import logging
+import weakref
+
+logger = logging.getLogger(__name__)
+
+# The name for changes of factoids, persons, sources and statements
+DATA = "data"
+
+# Whenever an id is a multiple of PRUNE_EVERY, older rows are deleted (the
+# last row of each name is kept)
+PRUNE_EVERY = 1000
+
+# pony session cache -> set of names changed in the current transaction
+_changed = weakref.WeakKeyDictionary()
+
+# db -> list of functions called after each commit and rollback
+_listeners = weakref.WeakKeyDictionary()
+
+
+def install(db):
+    """Append the rows for the changes of a transaction when it is committed.
+
+    Pony has no hooks for the end of a transaction, so the methods of the
+    provider are wrapped.
+    """
+    provider = db.provider
+    if getattr(provider, "_versions_hooks", False):
+        return
+    commit, rollback, drop = provider.commit, provider.rollback, provider.drop
+
+    def commit_hook(connection, cache=None):
+        names = _changed.pop(cache, None) if cache is not None else None
+        changes = {}
+        if names and provider.dialect == "SQLite":
+            changes = _append(db, connection, names)
+            commit(connection, cache)
+        else:
+            commit(connection, cache)
+            if names:
+                try:
+                    changes = _append(db, connection, names)
+                    connection.commit()
+                except Exception:  # pylint: disable=broad-except
+                    # the data is committed anyway
+                    logger.exception("Cannot store the versions of %s", sorted(names))
+                    changes = None
+        if cache is not None:
+            _notify(db, cache, changes)
+
+    def rollback_hook(connection, cache=None):
+        if cache is not None:
+            _changed.pop(cache, None)
+            _notify(db, cache, None)
+        rollback(connection, cache)
+
+    def drop_hook(connection, cache=None):
+        if cache is not None:
+            _changed.pop(cache, None)
+            _notify(db, cache, None)
+        drop(connection, cache)
+
+    provider.commit = commit_hook
+    provider.rollback = rollback_hook
+    provider.drop = drop_hook
+    provider._versions_hooks = True
+
+
+def add_listener(db, listener):
+    """Call listener(db, session, changes) after each commit or rollback.
+
+    session is the pony session cache of the transaction. changes is a dict
+    {name: (previous, new)} of the versions of the changed names or None if
+    the transaction was rolled back. previous is the version before the
+    change or None if it is unknown (eg. other transactions appending at the
+    same time): only if previous matches its version a listener can apply
+    the changes of the transaction.
+    """
+    install(db)
+    listeners = _listeners.setdefault(db, [])
+    if listener not in listeners:
+        listeners.append(listener)
+
+
+def _notify(db, session, changes):
+    for listener in _listeners.get(db, ()):
+        listener(db, session, changes)
+
+
+def changed(db, name):
+    """Register a change of name (DATA or the name of a lookup table) in
+    the current transaction. Must be called inside a db_session.
+
+    Nothing is recorded if the transaction does not write to the database.
+    """
+    install(db)
+    _changed.setdefault(db._get_cache(), set()).add(name)
+
+
+def stored(db, name):
+    """Return the current version of name (0 if it was never changed).
+
+    Must be called inside a db_session.
+    """
+    quote_name = db.provider.quote_name
+    version = db.select("SELECT MAX({}) FROM {} WHERE {} = $name".format(
+        quote_name("id"), quote_name(db.entities["ChangeLog"]._table_), quote_name("name")),
+        {"name": name})[0]
+    return version or 0
+
+
+def _append(db, connection, names):
+    """Append a row for each of names using connection (a dbapi connection).
+
+    Return a dict {name: (previous, new)} (see add_listener()).
+    """
+    provider = db.provider
+    quote_name = provider.quote_name
+    table = quote_name(db.entities["ChangeLog"]._table_)
+    id_column, name_column = quote_name("id"), quote_name("name")
+    cursor = connection.cursor()
+    new_ids = {}
+    for name in sorted(names):
+        # names are entity names, so they can be part of the sql
+        assert name.isidentifier(), name
+        sql = "INSERT INTO {} ({}) VALUES ('{}')".format(table, name_column, name)
+        if provider.dialect == "PostgreSQL":
+            cursor.execute(sql + " RETURNING {}".format(id_column))
+            new_ids[name] = cursor.fetchone()[0]
+        else:
+            cursor.execute(sql)
+            new_ids[name] = cursor.lastrowid
+    changes = {}
+    for name, new in new_ids.items():
+        cursor.execute("SELECT MAX({0}) FROM {1} WHERE {2} = '{3}' AND {0} < {4}".format(
+            id_column, table, name_column, name, new))
+        previous = cursor.fetchone()[0] or 0
+        # missing ids in between: rows of other transactions which are not
+        # committed yet (or pruned)
+        cursor.execute("SELECT COUNT(*) FROM {1} WHERE {0} > {2} AND {0} < {3}".format(
+            id_column, table, previous, new))
+        if cursor.fetchone()[0] != new - previous - 1:
+            previous = None
+        changes[name] = (previous, new)
+    if any(new % PRUNE_EVERY == 0 for new in new_ids.values()):
+        cursor.execute(
+            "DELETE FROM {1} WHERE {0} < {2} AND {0} NOT IN ("
+            "SELECT {0} FROM (SELECT MAX({0}) AS {0} FROM {1} GROUP BY {3}) m)".format(
+                id_column, table, max(new_ids.values()) - PRUNE_EVERY, name_column))
+    return changes
+
@@ -19,6 +19,16 @@ class CreationException(APIException):
     """Must be raised for any Exception during creation of an object.
     """
 
+class ServiceUnavailableError(APIException):
+    """Raised by connectors if a request cannot be served at the moment
+    (eg. no database connection is free). The client should retry after
+    retry_after seconds.
+    """
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
 class InvalidIdError(APIException):
     "Will be raise if an id contains a charachter not allowed in RFC3986#section-2.3."
     pass
\ No newline at end of file
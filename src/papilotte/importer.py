@@ -0,0 +1,214 @@
+"""Import factoids from JSON or NDJSON files.
+
+Two input formats are supported:
+
+  * JSON: a document like `{"factoids": [...]}` (as written by
+    bin/generate_mockdata.py) or a plain array of factoids
+  * NDJSON: one factoid per line (as returned by /factoids/export)
+
+Files are read incrementally, so only one batch of factoids is held in
+memory. The factoids are saved in batches via the update_many() method
+of a connector. After each batch the number of processed factoids can be
+written to a checkpoint file, which allows to resume an interrupted
+import.
+"""
+import json
+import os
+import re
+import time
+
+from papilotte import validator
+
+# Number of characters read at once from JSON files
+CHUNK_SIZE = 64 * 1024
+
+_ARRAY_START = re.compile(r'^\s*\[|"factoids"\s*:\s*\[')
+
+
+class ImportStats:
+    "Counts the processed factoids of an import."
+
+    def __init__(self, skipped=0):
+        self.skipped = skipped
+        self.done = skipped
+        self.created = 0
+        self.updated = 0
+        self.errors = 0
+        self.start = time.monotonic()
+
+    @property
+    def processed(self):
+        "Number of factoids processed since the start (without skipped ones)."
+        return self.done - self.skipped
+
+    def rate(self):
+        "Return the number of processed factoids per second."
+        elapsed = time.monotonic() - self.start
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self):
+        return "{} factoids processed ({} created, {} updated, {} errors), {:.1f} factoids/s".format(
+            self.done, self.created, self.updated, self.errors, self.rate()
+        )
+
+
+def iter_ndjson(fh):
+    """Yield a (number, factoid, error) tuple for each non-empty line of fh.
+
+    factoid is None and error contains a message if the line is not valid JSON.
+    """
+    number = 0
+    for line in fh:
+        if not line.strip():
+            continue
+        number += 1
+        try:
+            yield number, json.loads(line), None
+        except ValueError as err:
+            yield number, None, "Invalid JSON: {}".format(err)
+
+
+def iter_json(fh):
+    """Yield a (number, factoid, None) tuple for each factoid in a JSON file.
+
+    The file contains either `{"factoids": [...]}` or an array of factoids.
+    Only the current factoid is parsed, the file is never loaded completely.
+
+    :raises: ValueError if the file is not valid JSON.
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    while True:
+        match = _ARRAY_START.search(buf)
+        if match:
+            break
+        more = fh.read(CHUNK_SIZE)
+        if not more:
+            raise ValueError("No array of factoids found")
+        buf += more
+    buf = buf[match.end():]
+    pos = 0
+    number = 0
+    while True:
+        # skip whitespace and separators
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+        if pos == len(buf):
+            more = fh.read(CHUNK_SIZE)
+            if not more:
+                raise ValueError("Unexpected end of file")
+            buf, pos = more, 0
+            continue
+        if buf[pos] == "]":
+            return
+        try:
+            factoid, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            more = fh.read(CHUNK_SIZE)
+            if not more:
+                raise
+            buf, pos = buf[pos:] + more, 0
+            continue
+        number += 1
+        yield number, factoid, None
+        pos = end
+        if pos > CHUNK_SIZE:
+            buf, pos = buf[pos:], 0
+
+
+def detect_format(filename):
+    "Return 'ndjson' or 'json' depending on name and first line of filename."
+    if filename.endswith((".ndjson", ".jsonl")):
+        return "ndjson"
+    with open(filename, encoding="utf-8") as fh:
+        first_line = fh.readline()
+    try:
+        data = json.loads(first_line)
+    except ValueError:
+        return "json"
+    if isinstance(data, dict) and "factoids" not in data:
+        return "ndjson"
+    return "json"
+
+
+def read_factoids(fh, fmt):
+    "Return a generator of (number, factoid, error) tuples for file object fh."
+    if fmt == "ndjson":
+        return iter_ndjson(fh)
+    return iter_json(fh)
+
+
+def read_checkpoint(filename, input_file):
+    """Return the number of factoids already imported from input_file
+    according to checkpoint file filename (0 if there is no checkpoint).
+    """
+    if not filename or not os.path.exists(filename):
+        return 0
+    with open(filename, encoding="utf-8") as fh:
+        data = json.load(fh)
+    if data.get("input") != os.path.abspath(input_file):
+        return 0
+    return data.get("done", 0)
+
+
+def write_checkpoint(filename, input_file, done):
+    "Store the number of imported factoids in checkpoint file filename."
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "w", encoding="utf-8") as fh:
+        json.dump({"input": os.path.abspath(input_file), "done": done}, fh)
+    os.replace(tmp_filename, filename)
+
+
+def save_batch(connector, batch, stats):
+    """Save the factoids in batch (a list of (number, factoid) tuples).
+
+    Update stats and return a list of (number, id, message) tuples for all
+    factoids which could not be saved.
+    """
+    errors = []
+    results = connector.update_many([factoid for _, factoid in batch])
+    for (number, factoid), (status, message) in zip(batch, results):
+        if status == "created":
+            stats.created += 1
+        elif status == "updated":
+            stats.updated += 1
+        else:
+            stats.errors += 1
+            errors.append((number, factoid.get("@id"), message))
+    return errors
+
+
+def import_factoids(connector, factoids, batch_size=1000, skip=0, validate=True):
+    """Save factoids via connector in batches of batch_size factoids.
+
+    factoids is an iterable of (number, factoid, error) tuples as returned
+    by read_factoids(). The first skip factoids are ignored (resume).
+    After each batch a (stats, errors) tuple is yielded; errors is a list
+    of (number, id, message) tuples for the factoids of this batch which
+    could not be imported.
+    """
+    stats = ImportStats(skip)
+    batch = []
+    errors = []
+    for number, factoid, error in factoids:
+        if number <= skip:
+            continue
+        if error is None and validate:
+            try:
+                validator.validate_stored_factoid(factoid)
+            except validator.JSONValidationError as err:
+                error = str(err)
+        if error is None:
+            batch.append((number, factoid))
+        else:
+            stats.errors += 1
+            obj_id = factoid.get("@id") if isinstance(factoid, dict) else None
+            errors.append((number, obj_id, error))
+        stats.done = number
+        if len(batch) >= batch_size:
+            errors.extend(save_batch(connector, batch, stats))
+            yield stats, errors
+            batch, errors = [], []
+    if batch:
+        errors.extend(save_batch(connector, batch, stats))
+    yield stats, errors
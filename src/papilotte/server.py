@@ -1,13 +1,18 @@
+import functools
+import inspect
 import sys
 import logging
 from logging.handlers import RotatingFileHandler, SysLogHandler
 import connexion
+from connexion import problem
+from connexion.apis.flask_api import FlaskApi
 from papilotte.resolver import PapiResolver
 import papilotte
 import os
 import toml
 
-from papilotte import configuration
+from papilotte import compression, configuration
+from papilotte.exceptions import ServiceUnavailableError
 
 # logger = logging.getLogger(__name__)
 
@@ -37,6 +42,31 @@ def configure_logging(debug, **log_cfg):
             ))
 
 
+def service_unavailable(error):
+    "Return a '503 Service Unavailable' problem response for error."
+    headers = {}
+    if error.retry_after:
+        headers["Retry-After"] = str(error.retry_after)
+    return FlaskApi.get_response(
+        problem(503, "Service Unavailable", str(error), headers=headers))
+
+
+def use_streamed_bodies(flask_app):
+    """Call the handlers marked with api.stream_body without connexion's
+    request handling, which reads the whole request body first.
+    """
+    for endpoint, view in list(flask_app.view_functions.items()):
+        if getattr(view, "stream_body", False):
+            handler = inspect.unwrap(view)
+
+            @functools.wraps(handler)
+            def direct_view(handler=handler, **kwargs):
+                # handlers may return connexion responses (eg. problem())
+                return FlaskApi.get_response(handler())
+
+            flask_app.view_functions[endpoint] = direct_view
+
+
 def create_app(config_file=None, cli_options={}):
     """Create the app object."""
     config = configuration.get_configuration(config_file, cli_options)
@@ -56,6 +86,9 @@ def create_app(config_file=None, cli_options={}):
         strict_validation=config["server"]["strictValidation"],
         validate_responses=config["server"]["responseValidation"]
     )
+    use_streamed_bodies(app.app)
+    app.add_error_handler(ServiceUnavailableError, service_unavailable)
+    compression.init_app(app.app, config["server"])
     connector_module = config['connector'].pop('connector_module')
     connector_configuration = config.pop('connector')
 
@@ -65,6 +98,7 @@ def create_app(config_file=None, cli_options={}):
     app.app.config['PAPI_COMPLIANCE_LEVEL'] = config['api']['complianceLevel']
     app.app.config['PAPI_METADATA'] = config['metadata']
     app.app.config['PAPI_FORMATS'] = config['api']['formats']
+    app.app.config['PAPI_BULK_BATCH_SIZE'] = config['api']['bulkBatchSize']
     connector_configuration = connector_module.initialize(connector_configuration)
     app.app.config['PAPI_CONNECTOR_CONFIGURATION'] = connector_configuration
     return app
@@ -79,3 +79,49 @@ def validate(factoid, strict=True, spec_file=None):
         format_checker=format_checker,
         resolver=resolver
     )
+
+
+cached_validators = {}
+
+
+def get_validator(schema_name, spec_file=None):
+    """Return a (cached) jsonschema validator for the schema schema_name
+    (eg. 'Factoid' or 'Statement').
+
+    Creating a validator is expensive, so use this for validating many
+    objects. Formats are not checked.
+    """
+    if schema_name not in cached_validators:
+        schemata = get_schema(spec_file)
+        resolver = jsonschema.RefResolver(base_uri="", referrer=schemata, store={"": schemata})
+        cached_validators[schema_name] = jsonschema.Draft7Validator(
+            schemata["components"]["schemas"][schema_name], resolver=resolver
+        )
+    return cached_validators[schema_name]
+
+
+def validate_stored_factoid(factoid, spec_file=None):
+    """Validate a single factoid as accepted by the connectors.
+
+    Unlike the spec, connectors use a list of statements ('statements')
+    instead of a single 'statement'. The first statement is validated as
+    part of the factoid, all others against the Statement schema.
+
+    :raises: JSONValidationError (with a readable message)
+    """
+    if not isinstance(factoid, dict):
+        raise JSONValidationError("A factoid must be a JSON object")
+    statements = factoid.get("statements")
+    if statements and "statement" not in factoid:
+        if not isinstance(statements, list):
+            raise JSONValidationError("'statements' must be a list")
+        factoid = dict(factoid, statement=statements[0])
+        others = statements[1:]
+    else:
+        others = []
+    try:
+        get_validator("Factoid", spec_file).validate(factoid)
+        for stmt in others:
+            get_validator("Statement", spec_file).validate(stmt)
+    except jsonschema.ValidationError as err:
+        raise JSONValidationError(make_readable_validation_msg(err))
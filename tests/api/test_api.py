@@ -4,12 +4,15 @@ Most of the api functions are tested via system tests,
 so here mostly utility function
 """
 import copy
+import json
 import pytest
 
-from papilotte.api import is_valid_id, split_sortby, parse_search_date, fix_ids
+from papilotte.api import (is_valid_id, split_sortby, parse_search_date, fix_ids,
+                           encode_cursor, decode_cursor, make_search_response,
+                           as_utc)
 from papilotte.exceptions import InvalidIdError
 
-from datetime import date
+from datetime import date, datetime, timedelta, timezone
 
 def test_is_valid_id():
     "Return True if id_ only contains allowed characters."
@@ -100,3 +103,45 @@ def test_fix_ids_factoid():
     assert 'id' not in result['statements'][1]
     assert result['statements'][2]['@id'] == 'Stmt1c'
     assert 'id' not in result['statements'][2]
+
+
+def test_encode_decode_cursor():
+    "A cursor token must return the sort value and id of the encoded object."
+    obj = {'@id': 'F00007', 'createdWhen': '2003-02-15T00:21:00'}
+    token = encode_cursor('createdWhen', 'ASC', obj)
+    assert decode_cursor(token, 'createdWhen', 'ASC') == ('2003-02-15T00:21:00', 'F00007')
+    token = encode_cursor('id', 'DESC', obj)
+    assert decode_cursor(token, 'id', 'DESC') == ('F00007', 'F00007')
+
+
+def test_decode_invalid_cursor():
+    "Invalid or non matching tokens must raise a ValueError."
+    with pytest.raises(ValueError):
+        decode_cursor('foo', 'createdWhen', 'ASC')
+    with pytest.raises(ValueError):
+        decode_cursor('', 'createdWhen', 'ASC')
+    token = encode_cursor('createdWhen', 'ASC', {'@id': 'F1', 'createdWhen': ''})
+    with pytest.raises(ValueError):
+        decode_cursor(token, 'createdBy', 'ASC')
+    with pytest.raises(ValueError):
+        decode_cursor(token, 'createdWhen', 'DESC')
+
+
+def test_make_search_response():
+    "Dicts and JSON text returned by a connector must result in the same body."
+    objects = [{'@id': 'P1', 'createdWhen': ''}, {'@id': 'P2', 'createdWhen': ''}]
+    expected = make_search_response('persons', objects, 1, 2, 10, 'createdWhen', 'ASC')
+    assert expected['protocol']['next']
+    response = make_search_response('persons', [json.dumps(o) for o in objects],
+                                    1, 2, 10, 'createdWhen', 'ASC')
+    assert response.mimetype == 'application/json'
+    assert json.loads(response.get_data()) == expected
+
+
+def test_as_utc():
+    "Naive and aware datetimes can be compared after as_utc()."
+    naive = datetime(2003, 2, 15, 0, 12)
+    aware = datetime(2003, 2, 15, 1, 12, tzinfo=timezone(timedelta(hours=1)))
+    assert as_utc(naive) == as_utc(aware)
+    assert as_utc(aware).tzinfo == timezone.utc
+    assert as_utc(naive) <= as_utc(aware.replace(tzinfo=timezone.utc))
@@ -6,6 +6,8 @@ import pytest
 import datetime
 import copy            
 
+from papilotte.mockdata import make_factoids
+
 def test_create_from_ipif(db, data1):
     Factoid = db.entities['Factoid']
     data = data1['factoids'][0]
@@ -178,6 +180,64 @@ def test_update_from_ipif_with_different_id(db, data1):
         f.update_from_ipif(data)
         assert f.id == 'abc'
 
+def test_update_from_ipif_diff(db, data1):
+    "Only changed rows are written; statements are matched by '@id'."
+    Factoid = db.entities['Factoid']
+    Statement = db.entities['Statement']
+    Role = db.entities['Role']
+    Place = db.entities['Place']
+    data = data1['factoids'][0]
+    with orm.db_session:
+        Factoid.create_from_ipif(data)
+    with orm.db_session:
+        stmt_ids = {s['@id']: Statement[s['@id']].role.id for s in data['statements']}
+        num_places = orm.count(p for p in Place)
+
+    # updating a factoid with lookups must not fail (they were deleted and recreated)
+    data = copy.deepcopy(data)
+    data['statements'][0]['name'] = 'A new name'
+    with orm.db_session:
+        assert Factoid[data['@id']].update_from_ipif(data)
+    with orm.db_session:
+        assert Statement[data['statements'][0]['@id']].name == 'A new name'
+        # the lookups were kept
+        for stmt_id, role_id in stmt_ids.items():
+            assert Statement[stmt_id].role.id == role_id
+        assert orm.count(p for p in Place) == num_places
+        # nothing changed: nothing is written
+        assert not Factoid[data['@id']].update_from_ipif(data)
+
+    # a removed statement is deleted together with its orphaned lookups
+    removed = data['statements'].pop()
+    data['statements'][0]['role'] = {'label': 'A new role'}
+    with orm.db_session:
+        Factoid[data['@id']].update_from_ipif(data)
+    with orm.db_session:
+        assert Statement.get(id=removed['@id']) is None
+        assert Role.get(id=stmt_ids[removed['@id']]) is None
+        assert Role.get(id=stmt_ids[data['statements'][0]['@id']]) is None
+        assert Statement[data['statements'][0]['@id']].role.label == 'A new role'
+        assert orm.count(s for s in Statement) == len(data['statements'])
+
+
+def test_ingestion_does_not_copy(db, monkeypatch):
+    "create_from_ipif() and update_from_ipif() neither copy nor modify their input."
+    Factoid = db.entities['Factoid']
+    factoids = list(make_factoids(10))
+    for factoid in factoids[5:]:
+        factoid.pop('@id')
+    expected = copy.deepcopy(factoids)
+
+    def no_deepcopy(*args, **kwargs):
+        raise AssertionError('deepcopy() called during ingestion')
+    monkeypatch.setattr(copy, 'deepcopy', no_deepcopy)
+    with orm.db_session:
+        created = [Factoid.create_from_ipif(f) for f in factoids]
+        for obj, factoid in zip(created, factoids):
+            obj.update_from_ipif(factoid)
+    assert factoids == expected
+
+
 def test_to_ipif(db, data1):
     Factoid = db.entities['Factoid']
     data = data1['factoids'][0]
@@ -13,6 +13,26 @@ def test_make_db(db):
         assert db.get('select count(*) from Factoid') == 0
 
 
+def test_create_indexes(db):
+    "All declared indexes exist in a new database."
+    assert database.create_indexes(db) == []
+    with orm.db_session:
+        db.execute('DROP INDEX "idx_person__createdwhen_id"')
+    assert database.create_indexes(db) == ["idx_person__createdwhen_id"]
+
+
+def test_sort_uses_index(db):
+    "Sorting by createdWhen must not need a temporary b-tree."
+    Factoid = db.entities['Factoid']
+    with orm.db_session:
+        query = orm.select(f for f in Factoid).sort_by(lambda f: (f.createdWhen, f.id))
+        sql = query._construct_sql_and_arguments()[0]
+        plan = db.execute('EXPLAIN QUERY PLAN ' + sql).fetchall()
+    details = ' '.join(row[-1] for row in plan)
+    assert 'idx_factoid__createdwhen_id' in details
+    assert 'TEMP B-TREE' not in details
+
+
 def test_date(db):
     Date = db.entities['Date']
     date1 = datetime.date(1875, 1, 2)
@@ -22,8 +42,8 @@ def test_date(db):
         assert d1.sortDate == date1
 
         # Pony also support a string as date value
-        d1 = Date(sortDate='1875-01-02', label='foobar')
-        assert d1.label == 'foobar'
+        d1 = Date(sortDate='1875-01-02', label='foobaz')
+        assert d1.label == 'foobaz'
         assert d1.sortDate == date1
 
 def test_date_get_or_create(db):
@@ -242,6 +262,34 @@ def test_referential_integrity(db, data1):
         with pytest.raises(orm.ConstraintError):
             s.delete()
 
+def test_safe_delete_without_loading_references(db, monkeypatch):
+    "Orphan checks must not load all referencing statements."
+    Role = db.entities['Role']
+    Statement = db.entities['Statement']
+    PersonURI = db.entities['PersonURI']
+    Person = db.entities['Person']
+    with orm.db_session:
+        role = Role.get_or_create('Author')
+        for i in range(20):
+            Statement(id='S{}'.format(i), role=role)
+        Statement(id='S99', role=Role.get_or_create('Editor'))
+        Person(id='P1', uris=[PersonURI.get_or_create('https://example.com/p')])
+
+    def fail(self):
+        raise AssertionError('collection was loaded')
+    monkeypatch.setattr(orm.core.SetInstance, '__len__', fail)
+    monkeypatch.setattr(orm.core.SetInstance, '__iter__', fail)
+    with orm.db_session:
+        Role.get(label='Author').safe_delete()
+        Role.get(label='Editor').safe_delete()
+        PersonURI['https://example.com/p'].safe_delete()
+    with orm.db_session:
+        assert Role.get(label='Author') is not None
+        assert Role.get(label='Editor') is None
+        assert not Statement['S99'].role
+        assert PersonURI.get(uri='https://example.com/p') is None
+
+
 def _test_ro(db200final):
     "Make sure database db200final is read only."
     Factoid = db200final.entities['Factoid']
@@ -0,0 +1,53 @@
+"""Tests for id allocation (connectors.pony.ids).
+"""
+import hashlib
+import json
+import re
+
+from pony import orm
+
+from papilotte.connectors.pony import ids
+
+
+def test_make_id_shortest_free_prefix(db):
+    "The shortest prefix of the hash which is not used is returned."
+    Person = db.entities['Person']
+    data = {'createdBy': 'foo'}
+    full_hash = hashlib.sha256(json.dumps(data).encode('utf-8')).hexdigest()
+    with orm.db_session:
+        assert Person.make_id(data) == full_hash[:4]
+    with orm.db_session:
+        for i in (4, 5):
+            Person(id=full_hash[:i], createdBy='x')
+            Person(id=full_hash[:4] + 'x' * i, createdBy='x')
+    with orm.db_session:
+        assert Person.make_id(data) == full_hash[:6]
+
+
+def test_make_id_reserved(db):
+    "Ids are never handed out twice, even if the objects were not saved yet."
+    Source = db.entities['Source']
+    data = {'createdBy': 'foo'}
+    with orm.db_session:
+        new_ids = [Source.make_id(data) for _ in range(5)]
+    assert len(set(new_ids)) == 5
+    assert [len(obj_id) for obj_id in new_ids] == [4, 5, 6, 7, 8]
+
+
+def test_make_id_batch(db):
+    "Objects without id created in a single transaction get distinct ids."
+    Person = db.entities['Person']
+    with orm.db_session:
+        for _ in range(10):
+            Person.create_from_ipif({'createdBy': 'foo', 'uris': []})
+    with orm.db_session:
+        assert orm.count(p for p in Person) == 10
+
+
+def test_uuid_style(db):
+    "With id style 'uuid' a random uuid is used."
+    Person = db.entities['Person']
+    ids.set_style(db, 'uuid')
+    with orm.db_session:
+        person = Person.create_from_ipif({'createdBy': 'foo', 'uris': []})
+        assert re.match(r'^[0-9a-f]{32}$', person.id)
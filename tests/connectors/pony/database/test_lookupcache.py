@@ -0,0 +1,121 @@
+"""Tests for the lookup cache (connectors.pony.lookupcache).
+"""
+import datetime
+
+import pytest
+from pony import orm
+
+from papilotte.connectors.pony import lookupcache, versions
+
+
+def no_query(*args, **kwargs):
+    raise AssertionError("database was queried")
+
+
+def test_hit_without_query(db, monkeypatch):
+    "Cached rows are returned without querying the database."
+    Role = db.entities['Role']
+    Date = db.entities['Date']
+    PersonURI = db.entities['PersonURI']
+    with orm.db_session:
+        role_id = Role.get_or_create('Author', 'https://example.com/author').id
+        date_id = Date.get_or_create('1st of May', '1900-05-01').id
+        PersonURI.get_or_create('https://example.com/p1')
+    for entity in (Role, Date, PersonURI):
+        monkeypatch.setattr(entity, 'get', no_query)
+    with orm.db_session:
+        assert Role.get_or_create('Author', 'https://example.com/author').id == role_id
+        assert Date.get_or_create('1st of May', '1900-05-01').id == date_id
+        assert PersonURI.get_or_create('https://example.com/p1').uri == 'https://example.com/p1'
+
+
+def test_warm_up(db, monkeypatch):
+    "Existing rows are loaded on first use."
+    Place = db.entities['Place']
+    with orm.db_session:
+        for i in range(5):
+            Place(label='Place {}'.format(i))
+    with orm.db_session:
+        Place.get_or_create('Place 0')
+        monkeypatch.setattr(Place, 'get', no_query)
+        assert Place.get_or_create('Place 4').label == 'Place 4'
+
+
+def test_lru(db):
+    "The cache holds at most maxsize keys."
+    Role = db.entities['Role']
+    lookupcache.configure(db, 2)
+    with orm.db_session:
+        for label in ('a', 'b', 'c'):
+            Role.get_or_create(label)
+    keys = lookupcache._caches[db].tables['Role'].keys
+    assert list(keys) == [('b', ''), ('c', '')]
+    with orm.db_session:
+        assert Role.get_or_create('a').label == 'a'
+        assert orm.count(r for r in Role) == 3
+
+
+def test_disabled(db, monkeypatch):
+    "With maxsize 0 every lookup queries the database."
+    Role = db.entities['Role']
+    lookupcache.configure(db, 0)
+    with orm.db_session:
+        Role.get_or_create('Author')
+    monkeypatch.setattr(Role, 'get', no_query)
+    with pytest.raises(AssertionError):
+        with orm.db_session:
+            Role.get_or_create('Author')
+
+
+def test_delete(db):
+    "Deleted rows are removed from the cache."
+    Role = db.entities['Role']
+    Statement = db.entities['Statement']
+    with orm.db_session:
+        Statement(id='S1', role=Role.get_or_create('Author'))
+    with orm.db_session:
+        role = Statement['S1'].role
+        Statement['S1'].delete()
+        role.delete_if_unused()
+    with orm.db_session:
+        assert ('Author', '') not in lookupcache._caches[db].tables['Role'].keys
+        role = Role.get_or_create('Author')
+        assert role.label == 'Author'
+        assert orm.count(r for r in Role) == 1
+
+
+def test_rollback(db):
+    "Rows created in a rolled back transaction are not cached."
+    Date = db.entities['Date']
+    with orm.db_session:
+        Date.get_or_create('before')
+    with pytest.raises(ValueError):
+        with orm.db_session:
+            Date.get_or_create('rolled back', '1900-01-01')
+            raise ValueError()
+    with orm.db_session:
+        # the database can reuse the id of the rolled back row
+        other = Date.get_or_create('other', '1950-01-01')
+        assert other.to_ipif() == {'label': 'other', 'sortDate': '1950-01-01'}
+    with orm.db_session:
+        date = Date.get_or_create('rolled back', '1900-01-01')
+        assert date.to_ipif() == {'label': 'rolled back', 'sortDate': '1900-01-01'}
+        assert date.sortDate == datetime.date(1900, 1, 1)
+        assert orm.count(d for d in Date) == 3
+
+
+def test_changed_by_other_process(db):
+    "A changed version of a table (eg. by another process) leads to a reload."
+    Role = db.entities['Role']
+    with orm.db_session:
+        role_id = Role.get_or_create('Author').id
+    with orm.db_session:
+        # another process deletes the row
+        Role[role_id].delete()
+        versions.changed(db, 'Role')
+    with orm.db_session:
+        Role(label='Editor').flush()
+        versions.changed(db, 'Role')
+    with orm.db_session:
+        assert Role.get_or_create('Author').label == 'Author'
+        assert orm.count(r for r in Role) == 2
@@ -0,0 +1,121 @@
+"""Tests for the garbage collection of orphaned rows (connectors.pony.orphans).
+"""
+from pony import orm
+
+from papilotte.connectors.pony import database, fulltext, orphans
+from papilotte.connectors.pony.factoid import FactoidConnector
+
+
+def make_factoid(factoid_id, person_id, source_id, statement_id, role):
+    return {
+        "@id": factoid_id,
+        "createdBy": "Foo Bar",
+        "createdWhen": "2020-01-01T12:00:00",
+        "person": {"@id": person_id, "uris": ["https://example.com/" + person_id]},
+        "source": {"@id": source_id, "uris": ["https://example.com/" + source_id]},
+        "statements": [{
+            "@id": statement_id,
+            "role": {"label": role},
+            "date": {"label": "May 1900", "sortDate": "1900-05-01"},
+            "places": [{"label": "Vienna"}, {"label": role + " place"}],
+            "uris": ["https://example.com/" + statement_id],
+        }],
+    }
+
+
+def count(db, entity_name):
+    with orm.db_session:
+        return orm.count(x for x in db.entities[entity_name])
+
+
+def test_defer_cleanup(db):
+    "With garbage collection orphans are kept until collect_garbage() runs."
+    orphans.enable(db)
+    connector = FactoidConnector({"db": db})
+    connector.create(make_factoid("F1", "P1", "S1", "St1", "Author"))
+    connector.create(make_factoid("F2", "P1", "S2", "St2", "Editor"))
+    connector.delete("F2")
+    assert count(db, "Factoid") == 1
+    assert count(db, "Source") == 2
+    assert count(db, "Statement") == 2
+    assert count(db, "Role") == 2
+    assert count(db, "GcCandidate") == 3
+
+    stats = database.collect_garbage(db, batch_size=2)
+    assert stats["Statement"] == 1
+    assert stats["Person"] == 0
+    assert stats["Source"] == 1
+    assert stats["Role"] == 1
+    assert stats["Place"] == 1
+    assert stats["SourceURI"] == 1
+    assert stats["StatementURI"] == 1
+    with orm.db_session:
+        assert [r.label for r in db.entities["Role"].select()] == ["Author"]
+        assert db.entities["Place"].get(label="Vienna") is not None
+        assert db.entities["Person"].get(id="P1") is not None
+        assert db.entities["Source"].get(id="S2") is None
+        assert orm.count(x for x in db.entities["GcCandidate"]) == 0
+    places = connector.get("F1")["statements"][0]["places"]
+    assert {place["label"] for place in places} == {"Vienna", "Author place"}
+    assert database.collect_garbage(db) == {name: 0 for name in stats}
+
+
+def test_keep_objects_without_factoid(db):
+    "Objects never used by a factoid are not removed."
+    orphans.enable(db)
+    with orm.db_session:
+        db.entities["Person"].create_from_ipif({"@id": "P9", "uris": ["https://example.com/p9"]})
+        db.entities["Role"].get_or_create("Unused")
+    database.collect_garbage(db)
+    with orm.db_session:
+        assert db.entities["Person"].get(id="P9") is not None
+        assert db.entities["PersonURI"].get(uri="https://example.com/p9") is not None
+        # lookup rows are removed if unused
+        assert db.entities["Role"].get(label="Unused") is None
+
+
+def test_update_defers_replaced_person(db):
+    "A person replaced by an update is recorded as candidate."
+    orphans.enable(db)
+    connector = FactoidConnector({"db": db})
+    connector.create(make_factoid("F1", "P1", "S1", "St1", "Author"))
+    connector.update("F1", make_factoid("F1", "P2", "S1", "St1", "Author"))
+    assert count(db, "Person") == 2
+    assert database.collect_garbage(db)["Person"] == 1
+    with orm.db_session:
+        assert db.entities["Person"].get(id="P1") is None
+        assert db.entities["PersonURI"].get(uri="https://example.com/P1") is None
+
+
+def test_fulltext(db):
+    "Deleted objects are removed from the full text index."
+    fulltext.enable(db)
+    orphans.enable(db)
+    connector = FactoidConnector({"db": db})
+    connector.create(make_factoid("F1", "P1", "S1", "St1", "Author"))
+    connector.delete("F1")
+    database.collect_garbage(db)
+    with orm.db_session:
+        for entity_name in ("Person", "Source", "Statement"):
+            assert db.select("SELECT obj_id FROM {}".format(
+                fulltext.table_name(entity_name))) == []
+
+
+def test_delete_without_gc(db):
+    "Without garbage collection FactoidConnector.delete() removes orphans at once."
+    connector = FactoidConnector({"db": db})
+    connector.create(make_factoid("F1", "P1", "S1", "St1", "Author"))
+    connector.delete("F1")
+    for entity_name in ("Person", "Source", "Statement", "Role", "Date", "Place"):
+        assert count(db, entity_name) == 0
+
+
+def test_delete_rechecks_references(db):
+    "Rows referenced again after they were selected are not deleted."
+    connector = FactoidConnector({"db": db})
+    connector.create(make_factoid("F1", "P1", "S1", "St1", "Author"))
+    Statement = db.entities["Statement"]
+    with orm.db_session:
+        assert orphans._delete_rows(Statement, ["St1"], Statement._adict_["factoid"]) == 0
+    places = connector.get("F1")["statements"][0]["places"]
+    assert {place["label"] for place in places} == {"Vienna", "Author place"}
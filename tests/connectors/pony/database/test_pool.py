@@ -0,0 +1,110 @@
+"""Tests for the shared connection pool (connectors.pony.pool).
+"""
+import logging
+import threading
+import time
+
+import pytest
+from pony import orm
+
+from papilotte.connectors import pony as pony_connector
+from papilotte.connectors.pony import database, pool
+from papilotte.exceptions import ConfigurationError
+
+
+@pytest.fixture
+def filedb(tmp_path):
+    """Return a database stored in a file whose connections can be used
+    by other threads (like those of PostgreSQL and MySQL).
+    """
+    db = orm.Database()
+    db.bind(provider="sqlite", filename=str(tmp_path / "papi.sqlite"),
+            create_db=True, check_same_thread=False)
+    database.define_entities(db)
+    db.generate_mapping(create_tables=True)
+    return db
+
+
+def test_reuse_connections(filedb):
+    "Connections are reused by all threads."
+    connection_pool = pool.install(filedb, max_size=2)
+    with orm.db_session:
+        filedb.entities["Role"](label="Author")
+
+    def count():
+        with orm.db_session:
+            assert orm.count(r for r in filedb.entities["Role"]) == 1
+
+    threads = [threading.Thread(target=count) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = pool.stats(filedb)
+    assert stats["created"] <= 2
+    assert stats["size"] == stats["idle"] == len(connection_pool.idle)
+    assert stats["in_use"] == 0
+    assert stats["acquired"] >= 6
+
+
+def test_timeout(filedb):
+    "If all connections are in use, connect() waits for a free one."
+    connection_pool = pool.install(filedb, max_size=1, timeout=0.05)
+    con, is_new = connection_pool.connect()
+    assert is_new
+    with pytest.raises(pool.PoolTimeout):
+        connection_pool.connect()
+    threading.Timer(0.01, connection_pool.release, [con]).start()
+    connection_pool.timeout = 5
+    assert connection_pool.connect() == (con, False)
+    stats = connection_pool.stats()
+    assert stats["timeouts"] == 1
+    assert stats["waits"] == 1
+    assert stats["max_wait"] > 0
+
+
+def test_recycle_and_min_size(filedb):
+    "Idle connections are closed after recycle seconds, but min_size are kept."
+    connection_pool = pool.install(filedb, min_size=1, max_size=3, recycle=0.01)
+    assert connection_pool.stats()["size"] == 1
+    cons = [connection_pool.connect()[0] for _ in range(3)]
+    for con in cons:
+        connection_pool.release(con)
+    time.sleep(0.02)
+    connection_pool.connect()
+    stats = connection_pool.stats()
+    assert stats["recycled"] == 2
+    assert stats["size"] == 1
+
+
+def test_init_sql(filedb):
+    "init_sql is executed on each new connection."
+    pool.install(filedb, max_size=1, init_sql=["PRAGMA cache_size = 123"])
+    with orm.db_session:
+        assert filedb.execute("PRAGMA cache_size").fetchone()[0] == 123
+
+
+def test_validate():
+    "The pool settings are validated."
+    cfg = pony_connector.validate({"poolMaxSize": "5", "poolInitSql": "SET a = 1; SET b = 2"})
+    assert cfg["poolMaxSize"] == 5
+    assert cfg["poolMinSize"] == 0
+    assert cfg["poolTimeout"] == pool.TIMEOUT
+    assert cfg["poolInitSql"] == ["SET a = 1", " SET b = 2"]
+    assert cfg["poolLogInterval"] == pool.LOG_INTERVAL
+    for invalid in ({"poolMaxSize": -1}, {"poolTimeout": 0}, {"poolRecycle": "x"},
+                    {"poolMinSize": 3, "poolMaxSize": 2}):
+        with pytest.raises(ConfigurationError):
+            pony_connector.validate(invalid)
+
+
+def test_reporter(filedb, caplog):
+    "The Reporter logs the statistics periodically."
+    pool.install(filedb, max_size=1)
+    reporter = pool.Reporter(lambda: pool.stats(filedb), interval=0.01)
+    with caplog.at_level(logging.INFO, logger="papilotte.connectors.pony.pool"):
+        reporter.start()
+        time.sleep(0.05)
+        reporter.stop()
+        reporter.join()
+    assert "'max_size': 1" in caplog.text
@@ -0,0 +1,58 @@
+"""Tests for consistent exports (connectors.pony.snapshot).
+"""
+import sqlite3
+import threading
+
+import pytest
+from pony import orm
+
+from papilotte.connectors.pony import database, snapshot
+from papilotte.connectors.pony.person import PersonConnector
+
+
+@pytest.fixture
+def waldb(tmp_path):
+    "Return a database stored in a file in WAL mode with 10 persons."
+    filename = str(tmp_path / "papi.sqlite")
+    # the journal mode is stored in the database file
+    with sqlite3.connect(filename) as connection:
+        connection.execute("PRAGMA journal_mode = WAL")
+    db = database.make_db(provider="sqlite", filename=filename)
+    with orm.db_session:
+        for i in range(10):
+            db.entities["Person"].create_from_ipif({"@id": "P{}".format(i)})
+    return db
+
+
+def delete_in_other_thread(connector, obj_id):
+    thread = threading.Thread(target=connector.delete, args=(obj_id,))
+    thread.start()
+    thread.join()
+
+
+def test_export_reads_snapshot(waldb):
+    "Changes committed during an export are not seen by the export."
+    connector = PersonConnector({"db": waldb})
+    export = connector.export(batch_size=3)
+    first = [next(export) for _ in range(4)]
+    delete_in_other_thread(connector, "P8")
+    result = first + list(export)
+    assert [p["@id"] for p in result] == ["P{}".format(i) for i in range(10)]
+    assert connector.get("P8") is None
+
+
+def test_cache_is_cleared(waldb, monkeypatch):
+    "Objects of earlier batches are removed from the session cache."
+    sizes = []
+    clear_cache = snapshot.clear_cache
+
+    def clear(db):
+        sizes.append(len(db._get_cache().objects))
+        clear_cache(db)
+        assert not db._get_cache().objects
+
+    monkeypatch.setattr(snapshot, "clear_cache", clear)
+    connector = PersonConnector({"db": waldb})
+    assert len(list(connector.export(batch_size=3))) == 10
+    assert len(sizes) == 3
+    assert max(sizes) < 10
@@ -0,0 +1,73 @@
+"""Tests for the unique indexes and upserts of the lookup tables
+(connectors.pony.upsert).
+"""
+import datetime
+
+import pytest
+from pony import orm
+
+from papilotte.connectors.pony import database, upsert
+
+
+def test_unique_indexes(db):
+    "New databases have unique indexes on the keys of all lookup tables."
+    Role = db.entities['Role']
+    with orm.db_session:
+        Role(label='Author')
+    with pytest.raises(orm.TransactionIntegrityError):
+        with orm.db_session:
+            Role(label='Author')
+    for entity_name in database.UNIQUE_INDEXES:
+        assert upsert.is_enabled(db.entities[entity_name])
+
+
+def test_insert(db):
+    "A row is only inserted if no row with the same key exists."
+    Role = db.entities['Role']
+    Date = db.entities['Date']
+    with orm.db_session:
+        role = upsert.insert(Role, {'label': 'Author', 'uri': 'https://example.com/a'})
+        assert role.to_ipif() == {'label': 'Author', 'uri': 'https://example.com/a'}
+        assert upsert.insert(Role, {'label': 'Author', 'uri': 'https://example.com/a'}) is None
+        date = upsert.insert(Date, {'label': 'May 1900', 'sortDate': '1900-05-01'})
+        assert date.sortDate == datetime.date(1900, 5, 1)
+        assert upsert.insert(Date, {'label': 'May 1900', 'sortDate': '1900-05-01'}) is None
+        # a partial index makes dates without sortDate unique, too
+        assert upsert.insert(Date, {'label': 'sometime', 'sortDate': None}) is not None
+        assert upsert.insert(Date, {'label': 'sometime', 'sortDate': None}) is None
+    with orm.db_session:
+        assert Role.get_or_create('Author', 'https://example.com/a').id == role.id
+        assert orm.count(r for r in Role) == 1
+        assert orm.count(d for d in Date) == 2
+
+
+def test_merge_duplicates(tmp_path):
+    "create_indexes() merges duplicates of old databases and adds the unique indexes."
+    filename = str(tmp_path / 'papi.sqlite')
+    db = database.make_db(filename=filename)
+    with orm.db_session:
+        db.execute('DROP INDEX "uq_place__label_uri"')
+    db = database.make_db(filename=filename, create_tables=False)
+    Place = db.entities['Place']
+    Statement = db.entities['Statement']
+    assert not upsert.is_enabled(Place)
+    with orm.db_session:
+        vienna1 = Place(label='Vienna')
+        vienna2 = Place(label='Vienna')
+        Statement(id='S1', places=[vienna1])
+        Statement(id='S2', places=[vienna2])
+        Statement(id='S3', places=[vienna1, vienna2, Place(label='Graz')])
+    # tables with duplicates are skipped on startup
+    db = database.make_db(filename=filename)
+    assert not upsert.is_enabled(db.entities['Place'])
+
+    assert database.create_indexes(db) == ['uq_place__label_uri']
+    Place = db.entities['Place']
+    Statement = db.entities['Statement']
+    assert upsert.is_enabled(Place)
+    with orm.db_session:
+        assert orm.count(p for p in Place) == 2
+        vienna = Place.get(label='Vienna')
+        assert vienna.id == vienna1.id
+        assert {s.id for s in vienna.statements} == {'S1', 'S2', 'S3'}
+        assert len(Statement['S3'].places) == 2
@@ -0,0 +1,49 @@
+"""Tests for the versions of data and lookup tables (connectors.pony.versions).
+"""
+import pytest
+from pony import orm
+
+from papilotte.connectors.pony import database, versions
+
+
+def test_commit_and_rollback(db):
+    "Versions increase when a transaction is committed, not on rollback."
+    calls = []
+    versions.add_listener(db, lambda db, session, changes: calls.append(changes))
+    assert database.write_version(db) == 0
+    with orm.db_session:
+        db.entities["Person"].create_from_ipif({"@id": "P1"})
+    version = database.write_version(db)
+    assert version > 0
+    assert calls[-1] == {versions.DATA: (0, version)}
+
+    with pytest.raises(ZeroDivisionError):
+        with orm.db_session:
+            db.entities["Person"].create_from_ipif({"@id": "P2"})
+            orm.flush()
+            1 / 0
+    assert database.write_version(db) == version
+    assert calls[-1] is None
+
+
+def test_names_are_independent(db):
+    "A change of a lookup table does not change the data version."
+    with orm.db_session:
+        db.entities["Role"].get_or_create("Author")
+    with orm.db_session:
+        assert versions.stored(db, "Role") > 0
+        assert versions.stored(db, versions.DATA) == 0
+
+
+def test_prune(db, monkeypatch):
+    "Old rows are pruned, but the last row of each name is kept."
+    monkeypatch.setattr(versions, "PRUNE_EVERY", 5)
+    with orm.db_session:
+        db.entities["Role"].get_or_create("Author")
+    for i in range(10):
+        with orm.db_session:
+            db.entities["Person"].create_from_ipif({"@id": "P{}".format(i)})
+    with orm.db_session:
+        assert versions.stored(db, "Role") == 1
+        assert versions.stored(db, versions.DATA) == 11
+        assert orm.count(c for c in db.entities["ChangeLog"]) < 11
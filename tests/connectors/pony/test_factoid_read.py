@@ -7,7 +7,7 @@ import pytest
 
 from pony import orm
 
-from papilotte.connectors.pony import factoid
+from papilotte.connectors.pony import factoid, paging
 @pytest.fixture()
 def cfg_10_identical_factoids(mockcfg):
     """Return a cfg dict containing a db prepopulated with 10 nearly identical factoids
@@ -94,6 +94,151 @@ def test_search_sorting(db200final_cfg):
             sort_fields, reverse=True
         ), "sorting for {} does not work".format(fieldname)
 
+def test_search_cursor(db200final_cfg):
+    "Paging with a cursor must return the same objects as paging with page."
+    connector = factoid.FactoidConnector(db200final_cfg)
+    for fieldname in ("@id", "createdBy", "createdWhen", "modifiedBy", "modifiedWhen"):
+        sort_by = "id" if fieldname == "@id" else fieldname
+        for sort_order in ("ASC", "DESC"):
+            expected = connector.search(size=300, page=1, sort_by=sort_by,
+                                        sort_order=sort_order)
+            result = connector.search(size=30, page=1, sort_by=sort_by,
+                                      sort_order=sort_order)
+            while len(result) < len(expected):
+                last = result[-1]
+                cursor = (last[fieldname], last["@id"])
+                next_page = connector.search(size=30, page=1, sort_by=sort_by,
+                                             sort_order=sort_order, cursor=cursor)
+                assert next_page, "cursor paging stopped early for {}".format(fieldname)
+                result.extend(next_page)
+            assert [o["@id"] for o in result] == [o["@id"] for o in expected]
+
+
+@pytest.fixture()
+def cfg_null_sort_values(mockcfg):
+    "Return a cfg dict containing a db with factoids without modifiedWhen."
+    Factoid = mockcfg["db"].entities["Factoid"]
+    with orm.db_session():
+        for i in range(9):
+            data = {
+                "@id": "F{}".format(i),
+                "createdBy": "Creator 1",
+                "createdWhen": datetime.datetime(2015, 1, 1).isoformat(),
+                "source": {'@id': 'Source 1'},
+                "person": {'@id': 'Person 1'},
+                "statements": [{'@id': 'Statement {}'.format(i)}]
+            }
+            if i % 2:
+                data["modifiedWhen"] = datetime.datetime(2015, 1, 1 + i % 3).isoformat()
+            Factoid.create_from_ipif(data)
+    yield mockcfg
+
+
+def test_search_cursor_null_values(cfg_null_sort_values):
+    "Cursor paging works across NULL sort values."
+    connector = factoid.FactoidConnector(cfg_null_sort_values)
+    for sort_order in ("ASC", "DESC"):
+        expected = connector.search(size=20, page=1, sort_by="modifiedWhen",
+                                    sort_order=sort_order)
+        result = connector.search(size=2, page=1, sort_by="modifiedWhen",
+                                  sort_order=sort_order)
+        while len(result) < len(expected):
+            last = result[-1]
+            result.extend(connector.search(size=2, page=1, sort_by="modifiedWhen",
+                                           sort_order=sort_order,
+                                           cursor=(last["modifiedWhen"], last["@id"])))
+        assert [o["@id"] for o in result] == [o["@id"] for o in expected]
+
+
+def test_seek_nulls_last(cfg_null_sort_values, monkeypatch):
+    "On databases sorting NULL last (PostgreSQL) seek() follows this order."
+    monkeypatch.setattr(paging, "NULLS_LAST", {"SQLite"})
+    connector = factoid.FactoidConnector(cfg_null_sort_values)
+    Factoid = connector.db.entities["Factoid"]
+    objects = connector.search(size=20, page=1, sort_by="@id")
+    for sort_order in ("ASC", "DESC"):
+        # the order of PostgreSQL
+        def key(obj, sort_order=sort_order):
+            value = obj["modifiedWhen"]
+            if sort_order == "ASC":
+                return (value == "", value, obj["@id"])
+            return (value != "", [-ord(c) for c in value], obj["@id"])
+        ordered = sorted(objects, key=key)
+        for i, last in enumerate(ordered):
+            with orm.db_session():
+                query = connector.sorted_query(sort_by="modifiedWhen", sort_order=sort_order)
+                query = paging.seek(query, Factoid, "modifiedWhen", sort_order,
+                                    (last["modifiedWhen"], last["@id"]))
+                assert {f.id for f in query} == {o["@id"] for o in ordered[i + 1:]}
+
+
+def test_search_with_count(db200final_cfg):
+    "search_with_count() must return the same as search() and count()."
+    connector = factoid.FactoidConnector(db200final_cfg)
+    for filters in ({}, {"p": "P0001"}, {"st": "Stmt0001"}):
+        for page in (1, 2, 50):
+            result, total = connector.search_with_count(size=5, page=page, **filters)
+            expected = connector.search(size=5, page=page, **filters)
+            assert [o["@id"] for o in result] == [o["@id"] for o in expected]
+            if result:
+                assert total == connector.count(**filters)
+        first_page, _ = connector.search_with_count(size=5, page=1, **filters)
+        last = first_page[-1]
+        result, total = connector.search_with_count(
+            size=5, page=1, cursor=(last["createdWhen"], last["@id"]), **filters)
+        expected = connector.search(size=5, page=2, **filters)
+        assert [o["@id"] for o in result] == [o["@id"] for o in expected]
+        assert total == connector.count(**filters)
+
+
+def test_search_with_count_no_window_functions(db200final_cfg, monkeypatch):
+    "Without window functions search_with_count() falls back to 2 queries."
+    monkeypatch.setattr(paging, "supports_window_functions", lambda db: False)
+    connector = factoid.FactoidConnector(db200final_cfg)
+    result, total = connector.search_with_count(size=30, page=2, p="P0001")
+    expected = connector.search(size=30, page=2, p="P0001")
+    assert [o["@id"] for o in result] == [o["@id"] for o in expected]
+    assert total == connector.count(p="P0001")
+
+
+def test_window_query(db200final_cfg):
+    "The window is added to the query itself, next to ORDER BY and LIMIT."
+    connector = factoid.FactoidConnector(db200final_cfg)
+    with orm.db_session:
+        query = connector.sorted_query("createdWhen", "DESC")
+        sql, _, _ = paging._window_query(query, 10, 20)
+    assert sql.count("SELECT") == 1
+    assert "COUNT(*) OVER ()" in sql
+    assert sql.index("OVER ()") < sql.index("ORDER BY") < sql.index("LIMIT")
+
+
+def test_search_with_count_unknown_pony_version(db200final_cfg, monkeypatch):
+    "With an untested pony version search_with_count() falls back to 2 queries."
+    connector = factoid.FactoidConnector(db200final_cfg)
+    expected = connector.search_with_count(size=30, page=2, sort_order="DESC")
+    monkeypatch.setattr(paging, "PONY_VERSIONS", ("99.",))
+    with orm.db_session:
+        assert paging._window_query(connector.sorted_query(), 10, 0) is None
+    assert connector.search_with_count(size=30, page=2, sort_order="DESC") == expected
+
+
+def test_search_reduced(db200final_cfg):
+    "With depth='reduced' person, source and statements only contain their ids."
+    connector = factoid.FactoidConnector(db200final_cfg)
+    full = connector.search(size=20, page=2)
+    result, total = connector.search_with_count(size=20, page=2, depth="reduced")
+    assert total == 200
+    assert len(result) == len(full)
+    for reduced_factoid, full_factoid in zip(result, full):
+        assert reduced_factoid["@id"] == full_factoid["@id"]
+        assert reduced_factoid["createdWhen"] == full_factoid["createdWhen"]
+        assert reduced_factoid["person"] == {"@id": full_factoid["person"]["@id"]}
+        assert reduced_factoid["source"] == {"@id": full_factoid["source"]["@id"]}
+        assert reduced_factoid["statements"] == [
+            {"@id": stmt["@id"]} for stmt in full_factoid["statements"]]
+        assert reduced_factoid["statement-refs"] == full_factoid["statement-refs"]
+
+
 def test_search_sorting_second_value(cfg_10_identical_factoids):
     "If sortBy values are identical use id as secondary sort value."
     connector = factoid.FactoidConnector(cfg_10_identical_factoids)
@@ -109,3 +254,25 @@ def test_count(db200final_cfg):
     conector = factoid.FactoidConnector(db200final_cfg)
     assert conector.count() == 200
 
+
+def test_get_many(db200final_cfg):
+    "get_many() returns the factoids in the order of the ids, None for unknown ids."
+    connector = factoid.FactoidConnector(db200final_cfg)
+    ids = ['F00010', 'F99999', 'F00001', 'F00010']
+    result = connector.get_many(ids)
+    assert [f and f['@id'] for f in result] == ['F00010', None, 'F00001', 'F00010']
+    assert result[2] == connector.get('F00001')
+    result = connector.get_many(ids, fields=['@id', 'createdBy'])
+    assert result[0] == {'@id': 'F00010', 'createdBy': connector.get('F00010')['createdBy']}
+    assert connector.get_many([]) == []
+
+
+def test_export(db200final_cfg):
+    "export() must return all matching factoids ordered by id in batches."
+    connector = factoid.FactoidConnector(db200final_cfg)
+    expected = connector.search(size=300, page=1, sort_by="id", depth="reduced")
+    result = list(connector.export(30, depth="reduced"))
+    assert result == expected
+    result = list(connector.export(30, st="Stmt0001"))
+    assert [f["@id"] for f in result] == sorted(
+        f["@id"] for f in connector.search(size=300, page=1, st="Stmt0001"))
@@ -0,0 +1,109 @@
+"""Tests for papilotte.connectors.pony.fulltext
+"""
+import os
+import tempfile
+
+import pytest
+from pony import orm
+
+from papilotte import mockdata
+from papilotte.connectors.pony import (database, fulltext, FactoidConnector,
+                                       PersonConnector, SourceConnector,
+                                       StatementConnector)
+
+
+@pytest.fixture(scope="module")
+def fts_db():
+    "Return a database with 50 factoids and an enabled full text index."
+    with tempfile.TemporaryDirectory() as tmp_path:
+        db = database.make_db(provider="sqlite", filename=os.path.join(tmp_path, "test.db"))
+        with orm.db_session:
+            for factoid in mockdata.make_factoids(50):
+                db.entities["Factoid"].create_from_ipif(factoid)
+        fulltext.enable(db)
+        yield db
+
+
+def search_ids(connector, **filters):
+    "Return the ids of all objects found by connector."
+    return sorted(obj["@id"] for obj in connector.search(size=500, page=1, **filters))
+
+
+@pytest.mark.parametrize("connector_class, filters", [
+    (FactoidConnector, {"f": "F0001"}),
+    (FactoidConnector, {"f": "f0004"}),
+    (FactoidConnector, {"st": "place 00004"}),
+    (FactoidConnector, {"st": "https://example.com/places/00005"}),
+    (FactoidConnector, {"st": "statement TYPE 0000"}),
+    (FactoidConnector, {"p": "https://example.com/persons/3a"}),
+    (FactoidConnector, {"s": "source 0001"}),
+    (PersonConnector, {"p": "p0002"}),
+    (PersonConnector, {"st": "Related person"}),
+    (SourceConnector, {"s": "S0003"}),
+    (SourceConnector, {"s": "https://example.com/sources/3b"}),
+    (StatementConnector, {"st": "GROUP 0000"}),
+    (StatementConnector, {"st": "Historical Date 00007"}),
+    (StatementConnector, {"st": "https://example.com/roles/00004"}),
+    (StatementConnector, {"statementContent": "content 0001"}),
+    (StatementConnector, {"name": "ent 0002", "st": "Role"}),
+    # too short for the index
+    (StatementConnector, {"st": "4"}),
+])
+def test_same_result(fts_db, connector_class, filters):
+    "The result must be the same with and without full text index."
+    connector = connector_class({"db": fts_db})
+    result = search_ids(connector, **filters)
+    fulltext.disable(fts_db)
+    try:
+        expected = search_ids(connector, **filters)
+    finally:
+        fulltext.enable(fts_db)
+    assert result == expected
+    assert result
+
+
+def test_uses_index(fts_db):
+    "The fulltext filters must query the index."
+    with orm.db_session:
+        query = StatementConnector({"db": fts_db}).filter(st="Place 0004")
+        sql = query._construct_sql_and_arguments()[0]
+    assert "papi_fulltext_statement" in sql
+
+
+def test_index_is_updated(fts_db):
+    "Creating, updating and deleting objects must update the index."
+    connector = FactoidConnector({"db": fts_db})
+    factoid = {
+        "@id": "Fts1",
+        "createdBy": "Foo",
+        "createdWhen": "2020-01-01T10:00:00",
+        "person": {"@id": "FtsP1", "uris": ["https://example.com/fts/p1"]},
+        "source": {"@id": "FtsS1", "label": "Xylophone book"},
+        # st= only finds statements with date, role, memberOf and statementType
+        "statements": [{"@id": "FtsSt1", "statementContent": "Quokka sighting",
+                        "date": {"label": "1801"}, "role": {"label": "Observer"},
+                        "memberOf": {"label": "Zoo"}, "statementType": {"label": "Note"}}],
+    }
+    connector.create(factoid)
+    assert search_ids(connector, st="quokka") == ["Fts1"]
+    assert search_ids(connector, s="xylophone") == ["Fts1"]
+    assert search_ids(connector, p="https://example.com/fts/p1") == ["Fts1"]
+
+    factoid["statements"][0]["statementContent"] = "Wombat sighting"
+    connector.update("Fts1", factoid)
+    assert search_ids(connector, st="quokka") == []
+    assert search_ids(connector, st="wombat") == ["Fts1"]
+
+    with orm.db_session:
+        fts_db.entities["Factoid"]["Fts1"].deep_delete()
+    with orm.db_session:
+        assert fts_db.select("SELECT count(*) FROM papi_fulltext_statement "
+                             "WHERE obj_id = 'FtsSt1'")[0] == 0
+
+
+def test_rebuild(fts_db):
+    stats = fulltext.rebuild(fts_db)
+    assert stats["Factoid"] == 50
+    with orm.db_session:
+        assert stats["Statement"] == fts_db.entities["Statement"].select().count()
+    assert search_ids(StatementConnector({"db": fts_db}), st="Stmt0001")
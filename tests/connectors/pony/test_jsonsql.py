@@ -0,0 +1,97 @@
+"""Tests for papilotte.connectors.pony.jsonsql
+"""
+import json
+
+import pytest
+
+from pony import orm
+
+from papilotte.connectors.pony import jsonsql
+
+
+def test_is_supported(db200final):
+    assert jsonsql.is_supported(db200final)
+
+
+@pytest.mark.parametrize("entity_name", ["Factoid", "Person", "Source", "Statement"])
+def test_same_as_to_ipif(db200final, entity_name):
+    "The json built by the database must be equal to to_ipif()."
+    entity = db200final.entities[entity_name]
+    with orm.db_session:
+        objects = orm.select(x for x in entity).sort_by(lambda x: x.id)[:]
+        expected = [obj.to_ipif() for obj in objects]
+        result = jsonsql.to_json(db200final, entity_name, [obj.id for obj in objects])
+    assert [json.loads(doc) for doc in result] == expected
+
+
+def test_keeps_order_of_ids(db200final):
+    with orm.db_session:
+        result = jsonsql.to_json(db200final, "Person", ["P00003", "P00001", "P00002"])
+    assert [json.loads(doc)["@id"] for doc in result] == ["P00003", "P00001", "P00002"]
+
+
+def test_empty_list(db200final):
+    with orm.db_session:
+        assert jsonsql.to_json(db200final, "Factoid", []) == []
+
+
+def test_unset_values(db):
+    "Missing dates, roles etc. must be serialized the same way as by to_ipif()."
+    Factoid = db.entities["Factoid"]
+    data = {
+        "@id": "F1",
+        "createdBy": "Foo",
+        "createdWhen": "2020-01-02T03:04:05",
+        "person": {"@id": "P1"},
+        "source": {"@id": "S1"},
+        "statements": [
+            {"@id": "St1", "date": {"label": "1801"}, "role": {"uri": "http://example.com/r"},
+             "places": [{"label": "Graz"}, {"uri": "http://example.com/p"}]},
+            {"@id": "St2"},
+        ],
+    }
+    with orm.db_session:
+        factoid = Factoid.create_from_ipif(data)
+        expected = factoid.to_ipif()
+        result = jsonsql.to_json(db, "Factoid", ["F1"])
+    assert json.loads(result[0]) == expected
+
+
+@pytest.mark.parametrize("module_name, connector_name", [
+    ("factoid", "FactoidConnector"),
+    ("person", "PersonConnector"),
+    ("source", "SourceConnector"),
+    ("statement", "StatementConnector"),
+])
+def test_search_serialization_database(db200final, module_name, connector_name):
+    "search_with_count() returns the same documents for both serialization modes."
+    from importlib import import_module
+    module = import_module("papilotte.connectors.pony." + module_name)
+    python_connector = getattr(module, connector_name)({"db": db200final})
+    db_connector = getattr(module, connector_name)(
+        {"db": db200final, "serialization": "database"})
+    expected, expected_total = python_connector.search_with_count(25, 2)
+    result, total = db_connector.search_with_count(25, 2)
+    assert total == expected_total
+    assert [json.loads(doc) for doc in result] == expected
+
+
+@pytest.mark.parametrize("module_name, connector_name", [
+    ("factoid", "FactoidConnector"),
+    ("person", "PersonConnector"),
+    ("source", "SourceConnector"),
+    ("statement", "StatementConnector"),
+])
+def test_get_many_serialization_database(db200final, module_name, connector_name):
+    "get_many() returns the same documents for both serialization modes."
+    from importlib import import_module
+    module = import_module("papilotte.connectors.pony." + module_name)
+    python_connector = getattr(module, connector_name)({"db": db200final})
+    db_connector = getattr(module, connector_name)(
+        {"db": db200final, "serialization": "database"})
+    ids = [obj["@id"] for obj in python_connector.search(5, 1)]
+    ids = [ids[3], "unknown", ids[0], ids[3]]
+    expected = python_connector.get_many(ids)
+    assert expected[0] == python_connector.get(ids[0]) and expected[1] is None
+    result = db_connector.get_many(ids)
+    assert [doc if doc is None else json.loads(doc) for doc in result] == expected
@@ -0,0 +1,88 @@
+"""Tests for papilotte.connectors.pony.labelindex
+"""
+import pytest
+from pony import orm
+
+from papilotte.connectors.pony import labelindex, versions, StatementConnector
+
+
+def test_label_index_search():
+    index = labelindex.LabelIndex(0)
+    index.add(1, "Graz", "http://example.com/graz")
+    index.add(2, "Grazer Feld", "")
+    index.add(3, "", "http://example.com/wien")
+    index.add(4, "Wien", None)
+    assert index.search("graz") == {1, 2}
+    assert index.search("ER F") == {2}
+    assert index.search("gr") == {1, 2}
+    assert index.search("http://example.com/wien") == {3}
+    # uris must match exactly
+    assert index.search("example.com/wien") == set()
+    index.remove(2)
+    assert index.search("graz") == {1}
+
+
+@pytest.mark.parametrize("entity_name", [
+    "Role", "Place", "MemberGroup", "StatementType", "RelatesToPerson"])
+@pytest.mark.parametrize("needle", ["0001", "00", "e", "https://example.com/places/00004",
+                                    "https://example.com/roles/00004", "foo"])
+def test_resolve(db200final, entity_name, needle):
+    "resolve() must return the same rows as the label/uri conditions."
+    entity = db200final.entities[entity_name]
+    with orm.db_session:
+        expected = sorted(orm.select(
+            x.id for x in entity if needle.lower() in x.label.lower() or x.uri == needle))
+        result = labelindex.resolve(db200final, entity_name, needle)
+    if len(expected) > labelindex.MAX_IDS:
+        assert result is None
+    else:
+        assert result == expected
+
+
+def test_index_is_updated(db):
+    "get_or_create() and safe_delete() must update the index without reload."
+    Role = db.entities["Role"]
+    with orm.db_session:
+        Role.get_or_create(label="Abbot")
+    with orm.db_session:
+        index = labelindex.get_index(db, "Role")
+        role = Role.get_or_create(label="Prior", uri="http://example.com/prior")
+    with orm.db_session:
+        assert labelindex.get_index(db, "Role") is index
+        assert labelindex.resolve(db, "Role", "prio") == [role.id]
+        assert labelindex.resolve(db, "Role", "http://example.com/prior") == [role.id]
+    with orm.db_session:
+        stmt = db.entities["Statement"](id="St1", role=Role[role.id])
+        stmt.flush()
+        stmt.role.safe_delete()
+        stmt.delete()
+    with orm.db_session:
+        assert labelindex.get_index(db, "Role") is index
+        assert labelindex.resolve(db, "Role", "prio") == []
+
+
+def test_index_is_reloaded(db):
+    "Changes made by other processes or rollbacks must lead to a reload."
+    Role = db.entities["Role"]
+    with orm.db_session:
+        Role.get_or_create(label="Abbot")
+        index = labelindex.get_index(db, "Role")
+    with orm.db_session:
+        Role.get_or_create(label="Prior")
+        orm.rollback()
+    with orm.db_session:
+        assert labelindex.resolve(db, "Role", "prior") == []
+    # another process
+    with orm.db_session:
+        db.execute("INSERT INTO Role (label, uri) VALUES ('Cellarer', '')")
+        versions.changed(db, "Role")
+    with orm.db_session:
+        assert labelindex.get_index(db, "Role") is not index
+        assert len(labelindex.resolve(db, "Role", "cellarer")) == 1
+
+
+def test_role_filter_uses_index(db200final):
+    with orm.db_session:
+        query = StatementConnector({"db": db200final}).filter(role="Role 0000")
+        sql = query._construct_sql_and_arguments()[0]
+    assert '"Role"' not in sql
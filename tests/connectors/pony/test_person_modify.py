@@ -84,3 +84,37 @@ def test_delete_non_existing_object(mockcfg):
     with pytest.raises(orm.ObjectNotFound):
         connector.delete("foobarfoo")
 
+
+
+def test_write_version(mockcfg, mockperson1):
+    "Each create, update and delete must change the write version."
+    connector = person.PersonConnector(mockcfg)
+    versions = [connector.get_write_version()]
+    connector.create(mockperson1)
+    versions.append(connector.get_write_version())
+    connector.update("Foo99", dict(mockperson1, createdBy="Bar Foo"))
+    versions.append(connector.get_write_version())
+    connector.delete("Foo99")
+    versions.append(connector.get_write_version())
+    assert versions == sorted(set(versions))
+
+
+def test_update_unchanged(mockcfg, mockperson1):
+    "An update without any changes does not write anything."
+    connector = person.PersonConnector(mockcfg)
+    connector.create(mockperson1)
+    version = connector.get_write_version()
+    assert connector.update("Foo99", mockperson1)["uris"] == mockperson1["uris"]
+    assert connector.get_write_version() == version
+
+
+def test_get_last_modified(mockcfg, mockperson1):
+    connector = person.PersonConnector(mockcfg)
+    connector.create(mockperson1)
+    assert connector.get_last_modified("Foo99") == (True, None)
+    mockperson1["modifiedWhen"] = "2020-01-02T10:00:00"
+    connector.update("Foo99", mockperson1)
+    expected = (True, datetime.datetime(2020, 1, 2, 10))
+    assert connector.get_last_modified("Foo99") == expected
+    assert connector.get_last_modified("https://example.com/persons/1") == expected
+    assert connector.get_last_modified("Foo") == (False, None)
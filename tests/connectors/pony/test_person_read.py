@@ -107,6 +107,75 @@ def test_search_sorting(db200final_cfg):
             sort_fields, reverse=True
         ), "sorting for {} does not work".format(fieldname)
 
+def test_search_cursor(db200final_cfg):
+    "Paging with a cursor must return the same objects as paging with page."
+    connector = person.PersonConnector(db200final_cfg)
+    for fieldname in ("@id", "createdBy", "createdWhen", "modifiedBy", "modifiedWhen"):
+        sort_by = "id" if fieldname == "@id" else fieldname
+        for sort_order in ("ASC", "DESC"):
+            expected = connector.search(size=300, page=1, sort_by=sort_by,
+                                        sort_order=sort_order)
+            result = connector.search(size=30, page=1, sort_by=sort_by,
+                                      sort_order=sort_order)
+            while len(result) < len(expected):
+                last = result[-1]
+                cursor = (last[fieldname], last["@id"])
+                next_page = connector.search(size=30, page=1, sort_by=sort_by,
+                                             sort_order=sort_order, cursor=cursor)
+                assert next_page, "cursor paging stopped early for {}".format(fieldname)
+                result.extend(next_page)
+            assert [o["@id"] for o in result] == [o["@id"] for o in expected]
+
+
+def test_search_with_count(db200final_cfg):
+    "search_with_count() must return the same as search() and count()."
+    connector = person.PersonConnector(db200final_cfg)
+    for filters in ({}, {"p": "P0001"}, {"st": "Stmt0001"}):
+        for page in (1, 2, 50):
+            result, total = connector.search_with_count(size=5, page=page, **filters)
+            expected = connector.search(size=5, page=page, **filters)
+            assert [o["@id"] for o in result] == [o["@id"] for o in expected]
+            if result:
+                assert total == connector.count(**filters)
+        first_page, _ = connector.search_with_count(size=5, page=1, **filters)
+        last = first_page[-1]
+        result, total = connector.search_with_count(
+            size=5, page=1, cursor=(last["createdWhen"], last["@id"]), **filters)
+        expected = connector.search(size=5, page=2, **filters)
+        assert [o["@id"] for o in result] == [o["@id"] for o in expected]
+        assert total == connector.count(**filters)
+
+
+def test_get_many(db200final_cfg):
+    "get_many() returns the persons in the order of the ids, None for unknown ids."
+    connector = person.PersonConnector(db200final_cfg)
+    result = connector.get_many(['P00002', 'P99999', 'P00001'])
+    assert result == [connector.get('P00002'), None, connector.get('P00001')]
+
+
+def test_get_many_with_uri(db200final_cfg):
+    "get_many() accepts uris instead of ids like get()."
+    connector = person.PersonConnector(db200final_cfg)
+    ids = ['https://example.com/persons/2a', 'P00001', 'https://example.com/persons/2b',
+           'https://example.com/persons/unknown']
+    result = connector.get_many(ids, fields=['@id'])
+    assert result == [{'@id': 'P00002'}, {'@id': 'P00001'}, {'@id': 'P00002'}, None]
+    assert connector.get_many(ids[:1]) == [connector.get(ids[0])]
+
+
+def test_export(db200final_cfg):
+    "export() must return all matching persons ordered by id, independent of batch size."
+    connector = person.PersonConnector(db200final_cfg)
+    for filters in ({}, {"p": "P0001"}):
+        expected = connector.search(size=300, page=1, sort_by="id", **filters)
+        for batch_size in (7, 300):
+            result = list(connector.export(batch_size, **filters))
+            assert [o["@id"] for o in result] == [o["@id"] for o in expected]
+    result = list(connector.export(50, fields=["@id", "uris"]))
+    assert len(result) == connector.count()
+    assert set(result[0]) == {"@id", "uris"}
+
+
 def test_search_sorting_second_value(db10cfg_identical_persons):
     "If sortBy values are identical use id as secondary sort value."
     connector = person.PersonConnector(db10cfg_identical_persons)
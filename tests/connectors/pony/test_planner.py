@@ -0,0 +1,98 @@
+"""Tests for papilotte.connectors.pony.planner
+"""
+import datetime
+
+import pytest
+from pony import orm
+
+from papilotte.connectors.pony import filter_queries, planner
+
+
+def test_needed_entities():
+    assert planner.needed_entities({}) == set()
+    assert planner.needed_entities({"sourceId": "S1", "role": ""}) == {"Source"}
+    assert planner.needed_entities({"p": "x", "role": "abbot", "f": "F"}) == {
+        "Person",
+        "Statement",
+        "Factoid",
+    }
+
+
+@orm.db_session
+def test_plan_without_statement_filters(db200final):
+    "Statements must not be touched if no statement filter is set."
+    query, lines = planner.plan(db200final, "Factoid", sourceId="S00002")
+    sql = query._construct_sql_and_arguments()[0]
+    assert lines == ["Factoid: all", "  IN Source (factoid.source): filter sourceId"]
+    assert '"Statement"' not in sql
+    assert "DISTINCT" not in sql
+    assert '"Person"' not in sql
+
+
+@orm.db_session
+def test_plan_with_statement_filters(db200final):
+    query, lines = planner.plan(db200final, "Person", role="Role 0000")
+    sql = query._construct_sql_and_arguments()[0]
+    assert lines == [
+        "Person: all",
+        "  EXISTS Factoid (person.factoids):",
+        "    Factoid: all",
+        "      EXISTS Statement (factoid.statements): filter role",
+    ]
+    assert "EXISTS" in sql
+    assert "DISTINCT" not in sql
+
+
+def test_explain(db200final):
+    with orm.db_session:
+        text = planner.explain(db200final, "Statement", personId="P00003")
+    assert text.startswith(
+        "Statement: all\n  IN Factoid (statement.factoid):\n    Factoid: all\n"
+        "      IN Person (factoid.person): filter personId\n\nSELECT"
+    )
+
+
+def old_filter(db, entity_name, **filters):
+    "The filter query as it was built before the planner was introduced."
+    subquery_person = filter_queries.person_query(db, **filters)
+    subquery_source = filter_queries.source_query(db, **filters)
+    subquery_statement = filter_queries.statement_query(db, **filters)
+    subquery_factoid = filter_queries.factoid_query(db, **filters)
+    if entity_name == "Statement":
+        Statement = db.entities["Statement"]
+        return orm.select(s for s in Statement
+                          if s in subquery_statement
+                          and s.factoid in subquery_factoid
+                          and s.factoid.person in subquery_person
+                          and s.factoid.source in subquery_source)
+    Factoid = db.entities["Factoid"]
+    factoids = orm.select(f for f in Factoid
+                          if f in subquery_factoid
+                          and f.person in subquery_person
+                          and f.source in subquery_source
+                          for stmt in f.statements
+                          if stmt in subquery_statement)
+    if entity_name == "Person":
+        return orm.select(f.person for f in factoids)
+    if entity_name == "Source":
+        return orm.select(f.source for f in factoids)
+    return factoids
+
+
+@pytest.mark.parametrize("entity_name", ["Person", "Source", "Factoid", "Statement"])
+@pytest.mark.parametrize(
+    "filters",
+    [
+        {"personId": "P00003"},
+        {"sourceId": "S00002", "f": "F0001"},
+        {"role": "Role 0000", "p": "P0000"},
+        {"from_": datetime.date(1803, 3, 30), "label": "Source"},
+        {"st": "Stmt0001", "factoidId": "F00012"},
+    ],
+)
+def test_plan_same_result(db200final, entity_name, filters):
+    "The planner must return the same objects as the old join query."
+    with orm.db_session:
+        query, _ = planner.plan(db200final, entity_name, **filters)
+        expected = old_filter(db200final, entity_name, **filters)
+        assert sorted(x.id for x in query) == sorted(x.id for x in expected)
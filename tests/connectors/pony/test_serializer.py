@@ -0,0 +1,106 @@
+"""Tests for papilotte.connectors.pony.serializer
+"""
+import pytest
+
+from pony import orm
+
+from papilotte.connectors.pony import serializer
+
+
+@pytest.fixture
+def count_queries(db200final):
+    "Return a list which is extended by each sql statement sent to db200final."
+    statements = []
+    exec_sql = db200final._exec_sql
+
+    def counting_exec_sql(sql, *args, **kwargs):
+        statements.append(sql)
+        return exec_sql(sql, *args, **kwargs)
+
+    db200final._exec_sql = counting_exec_sql
+    yield statements
+    db200final._exec_sql = exec_sql
+
+
+@pytest.mark.parametrize("entity_name, func", [
+    ("Factoid", serializer.factoids_to_ipif),
+    ("Person", serializer.persons_to_ipif),
+    ("Source", serializer.sources_to_ipif),
+    ("Statement", serializer.statements_to_ipif),
+])
+def test_same_as_to_ipif(db200final, entity_name, func):
+    "The batched serializer must return exactly the same as to_ipif()."
+    entity = db200final.entities[entity_name]
+    with orm.db_session:
+        expected = [obj.to_ipif() for obj in orm.select(x for x in entity).sort_by(
+            lambda x: x.id)]
+    with orm.db_session:
+        objects = orm.select(x for x in entity).sort_by(lambda x: x.id)[:]
+        result = func(db200final, objects)
+    assert result == expected
+
+
+def test_empty_list(db200final):
+    "Serializing an empty list must work."
+    with orm.db_session:
+        assert serializer.factoids_to_ipif(db200final, []) == []
+        assert serializer.statements_to_ipif(db200final, []) == []
+
+
+@pytest.mark.parametrize("entity_name, func", [
+    ("Factoid", serializer.factoids_to_ipif),
+    ("Person", serializer.persons_to_ipif),
+    ("Source", serializer.sources_to_ipif),
+    ("Statement", serializer.statements_to_ipif),
+])
+def test_number_of_queries(db200final, count_queries, entity_name, func):
+    "The number of queries must not depend on the number of objects."
+    entity = db200final.entities[entity_name]
+    numbers = []
+    for size in (5, 150):
+        with orm.db_session:
+            objects = orm.select(x for x in entity).sort_by(lambda x: x.id)[:size]
+            count_queries.clear()
+            func(db200final, objects)
+            numbers.append(len(count_queries))
+    assert numbers[0] == numbers[1]
+
+
+def test_field_tree():
+    assert serializer.field_tree(None) is None
+    assert serializer.field_tree([]) is None
+    assert serializer.field_tree(["@id", "statements.date", "statements.role.label"]) == {
+        "@id": None, "statements": {"date": None, "role": {"label": None}}}
+    # a full object includes all its subfields
+    assert serializer.field_tree(["statements", "statements.date"]) == {"statements": None}
+    assert serializer.field_tree(["statements.date", "statements"]) == {"statements": None}
+
+
+@pytest.mark.parametrize("fields", [
+    ["@id"],
+    ["@id", "createdBy", "person.uris"],
+    ["@id", "statements.date", "statements.statementContent"],
+    ["@id", "statements", "source-ref", "statement-refs"],
+    ["@id", "statement-refs", "statements.places.label"],
+])
+def test_factoids_fields(db200final, fields):
+    "With fields set, the serializer returns the pruned full documents."
+    tree = serializer.field_tree(fields)
+    with orm.db_session:
+        objects = orm.select(x for x in db200final.entities["Factoid"]).sort_by(
+            lambda x: x.id)[:20]
+        expected = serializer.prune(serializer.factoids_to_ipif(db200final, objects), tree)
+        result = serializer.factoids_to_ipif(db200final, objects, tree)
+    assert result == expected
+
+
+def test_fields_number_of_queries(db200final, count_queries):
+    "Not requested relations must not be loaded."
+    with orm.db_session:
+        objects = orm.select(x for x in db200final.entities["Factoid"])[:20]
+        count_queries.clear()
+        serializer.factoids_to_ipif(db200final, objects, serializer.field_tree(["@id"]))
+        assert count_queries == []
+        serializer.factoids_to_ipif(
+            db200final, objects, serializer.field_tree(["@id", "statements.statementContent"]))
+        assert len(count_queries) == 1
@@ -63,6 +63,15 @@ def test_get_with_uri(db200final_cfg):
     pers = connector.get('https://example.com/sources/2b')
     assert pers['@id'] == 'S00002'
 
+
+def test_get_many_with_uri(db200final_cfg):
+    "get_many() accepts uris instead of ids like get()."
+    connector = source.SourceConnector(db200final_cfg)
+    ids = ['https://example.com/sources/2a', 'S00001', 'https://example.com/sources/2b', 'S99999']
+    result = connector.get_many(ids, fields=['@id'])
+    assert result == [{'@id': 'S00002'}, {'@id': 'S00001'}, {'@id': 'S00002'}, None]
+
+
 def test_search_paging(db200final_cfg):
     "Test search() without filtering."
     connector = source.SourceConnector(db200final_cfg)
@@ -110,6 +119,45 @@ def test_search_sorting(db200final_cfg):
         ), "sorting for {} does not work".format(fieldname)
 
 
+def test_search_cursor(db200final_cfg):
+    "Paging with a cursor must return the same objects as paging with page."
+    connector = source.SourceConnector(db200final_cfg)
+    for fieldname in ("@id", "label", "createdBy", "createdWhen", "modifiedBy", "modifiedWhen"):
+        sort_by = "id" if fieldname == "@id" else fieldname
+        for sort_order in ("ASC", "DESC"):
+            expected = connector.search(size=300, page=1, sort_by=sort_by,
+                                        sort_order=sort_order)
+            result = connector.search(size=30, page=1, sort_by=sort_by,
+                                      sort_order=sort_order)
+            while len(result) < len(expected):
+                last = result[-1]
+                cursor = (last[fieldname], last["@id"])
+                next_page = connector.search(size=30, page=1, sort_by=sort_by,
+                                             sort_order=sort_order, cursor=cursor)
+                assert next_page, "cursor paging stopped early for {}".format(fieldname)
+                result.extend(next_page)
+            assert [o["@id"] for o in result] == [o["@id"] for o in expected]
+
+
+def test_search_with_count(db200final_cfg):
+    "search_with_count() must return the same as search() and count()."
+    connector = source.SourceConnector(db200final_cfg)
+    for filters in ({}, {"p": "P0001"}, {"st": "Stmt0001"}):
+        for page in (1, 2, 50):
+            result, total = connector.search_with_count(size=5, page=page, **filters)
+            expected = connector.search(size=5, page=page, **filters)
+            assert [o["@id"] for o in result] == [o["@id"] for o in expected]
+            if result:
+                assert total == connector.count(**filters)
+        first_page, _ = connector.search_with_count(size=5, page=1, **filters)
+        last = first_page[-1]
+        result, total = connector.search_with_count(
+            size=5, page=1, cursor=(last["createdWhen"], last["@id"]), **filters)
+        expected = connector.search(size=5, page=2, **filters)
+        assert [o["@id"] for o in result] == [o["@id"] for o in expected]
+        assert total == connector.count(**filters)
+
+
 def test_search_sorting_second_value(cfg_10_identical_sources):
     "If sortBy values are identical use id as secondary sort value."
     connector = source.SourceConnector(cfg_10_identical_sources)
@@ -0,0 +1,135 @@
+import gzip
+
+import pytest
+from flask import Flask, Response
+
+from papilotte import compression, configuration
+from papilotte.exceptions import ConfigurationError
+
+
+def make_app(**options):
+    cfg = configuration.get_default_configuration()["server"]
+    cfg.update(options)
+    app = Flask(__name__)
+    compressor = compression.init_app(app, cfg)
+
+    @app.route("/data")
+    def data():
+        return Response('{"foo": "' + "x" * 1000 + '"}', mimetype="application/json",
+                        headers={"ETag": '"abc"'})
+
+    @app.route("/small")
+    def small():
+        return Response('{"foo": 1}', mimetype="application/json")
+
+    @app.route("/stream")
+    def stream():
+        return Response((str(i) + "\n" for i in range(1000)), mimetype="application/x-ndjson")
+
+    @app.route("/image")
+    def image():
+        return Response(b"\0" * 1000, mimetype="image/png")
+
+    return app, compressor
+
+
+def test_gzip():
+    app, _ = make_app(compressionEncodings=["gzip"])
+    with app.test_client() as client:
+        response = client.get("/data", headers={"Accept-Encoding": "gzip, deflate"})
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert "Accept-Encoding" in response.headers["Vary"]
+        assert gzip.decompress(response.data).startswith(b'{"foo": "xxx')
+        # the ETag is weakened
+        assert response.headers["ETag"] == 'W/"abc"'
+
+
+def test_streamed_response():
+    app, compressor = make_app(compressionEncodings=["gzip"])
+    with app.test_client() as client:
+        response = client.get("/stream", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["Content-Encoding"] == "gzip"
+        lines = gzip.decompress(response.data).decode("ascii").splitlines()
+        assert lines == [str(i) for i in range(1000)]
+        # streams are not cached
+        assert compressor.misses == 0
+
+
+def test_no_accept_encoding():
+    app, _ = make_app()
+    with app.test_client() as client:
+        response = client.get("/data")
+        assert "Content-Encoding" not in response.headers
+        assert "Accept-Encoding" in response.headers["Vary"]
+        assert response.headers["ETag"] == '"abc"'
+        response = client.get("/data", headers={"Accept-Encoding": "gzip;q=0, identity"})
+        assert "Content-Encoding" not in response.headers
+
+
+def test_min_size_and_mimetype():
+    app, _ = make_app()
+    with app.test_client() as client:
+        response = client.get("/small", headers={"Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in response.headers
+        response = client.get("/image", headers={"Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in response.headers
+
+
+def test_disabled():
+    app, compressor = make_app(compression=False)
+    assert compressor is None
+    with app.test_client() as client:
+        response = client.get("/data", headers={"Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in response.headers
+
+
+def test_cache():
+    app, compressor = make_app(compressionEncodings=["gzip"], compressionCacheSize=1)
+    with app.test_client() as client:
+        first = client.get("/data", headers={"Accept-Encoding": "gzip"}).data
+        second = client.get("/data", headers={"Accept-Encoding": "gzip"}).data
+    assert first == second
+    assert compressor.misses == 1
+    assert compressor.hits == 1
+    assert list(compressor.cache) == [("abc", "gzip")]
+    compressor.compress("gzip", compression._gzip, b"foo", "def")
+    assert list(compressor.cache) == [("def", "gzip")]
+
+
+@pytest.mark.parametrize(
+    "accept, expected",
+    [
+        ("gzip", "gzip"),
+        ("br, gzip", "br"),
+        ("zstd;q=1.0, br;q=0.5, gzip", "zstd"),
+        ("*", "br"),
+        ("br;q=0, *", "zstd"),
+        ("identity", None),
+    ],
+)
+def test_negotiate(accept, expected, monkeypatch):
+    # pretend all encodings are available; the functions are not called
+    monkeypatch.setattr(
+        compression, "available_encodings",
+        lambda: {"br": None, "zstd": None, "gzip": compression._gzip},
+    )
+    compressor = compression.Compressor()
+    app = Flask(__name__)
+    with app.test_request_context(headers={"Accept-Encoding": accept}):
+        from flask import request
+
+        assert compressor.negotiate(request.accept_encodings)[0] == expected
+
+
+def test_unavailable_encodings_are_ignored(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    monkeypatch.setattr(compression, "zstandard", None)
+    compressor = compression.Compressor(encodings=["br", "zstd", "gzip"])
+    assert [name for name, _ in compressor.encodings] == ["gzip"]
+
+
+def test_invalid_configuration():
+    cfg = configuration.get_default_configuration()
+    cfg["server"]["compressionEncodings"] = ["deflate"]
+    with pytest.raises(ConfigurationError):
+        configuration.validate(cfg, "test")
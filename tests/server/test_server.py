@@ -44,4 +44,19 @@ def test_create_app():
     assert cfg['PAPI_MAX_SIZE'] == 200
     assert cfg['PAPI_COMPLIANCE_LEVEL'] == 1
     assert cfg['PAPI_METADATA']['contact'] == "No contact information available"
-     
\ No newline at end of file
+     
+def test_service_unavailable(monkeypatch):
+    "A PoolTimeout is answered with 503 and a Retry-After header."
+    from papilotte.connectors.pony import pool
+    from papilotte.connectors.pony.person import PersonConnector
+
+    def get(*args, **kwargs):
+        raise pool.PoolTimeout("No database connection available")
+
+    # the first database access of a GET request
+    monkeypatch.setattr(PersonConnector, "get_last_modified", get)
+    app = server.create_app()
+    response = app.app.test_client().get("/api/persons/P1")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(pool.RETRY_AFTER)
+    assert response.json["detail"] == "No database connection available"
@@ -1,4 +1,6 @@
 import copy
+import gzip
+import json
 
 import pytest
 from flask import current_app as app
@@ -44,4 +46,35 @@ def test_protocol(mockclient_cl0):
     data = r.json
     assert data["protocol"]["page"] == 1
     assert data["protocol"]["size"] == 30
-    assert data["protocol"]["totalHits"] == 200
\ No newline at end of file
+    assert data["protocol"]["totalHits"] == 200
+
+def test_get_factoid_by_id_conditional(mockclient_cl0):
+    "A matching If-None-Match must lead to a 304 response."
+    etag = mockclient_cl0.get(TEST_URL + "/F00001").headers["ETag"]
+    response = mockclient_cl0.get(TEST_URL + "/F00001", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+
+def test_export_factoids(mockclient_cl0):
+    "The export returns all factoids as NDJSON, optionally gzipped."
+    response = mockclient_cl0.get(TEST_URL + "/export?depth=reduced")
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    docs = [json.loads(line) for line in response.data.decode("utf-8").splitlines()]
+    assert len(docs) == 200
+    assert [f["@id"] for f in docs] == sorted(f["@id"] for f in docs)
+    assert docs[0]["person"] == {"@id": docs[0]["person-ref"]["@id"]}
+
+    response = mockclient_cl0.get(TEST_URL + "/export?statementId=Stmt00001",
+                                  headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    lines = gzip.decompress(response.data).decode("utf-8").splitlines()
+    assert [json.loads(line)["@id"] for line in lines] == ["F00001"]
+
+    etag = response.headers["ETag"]
+    response = mockclient_cl0.get(TEST_URL + "/export?statementId=Stmt00001",
+                                  headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    response = mockclient_cl0.get(TEST_URL + "/export?p=P00001")
+    assert response.status_code == 400
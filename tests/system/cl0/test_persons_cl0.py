@@ -5,6 +5,7 @@ from flask import current_app as app
 from pony import orm
 
 from papilotte.api import persons
+from papilotte.connectors.pony.person import PersonConnector
 
 TEST_URL = '/api/persons'
 
@@ -37,6 +38,16 @@ def test_get_person_by_id(mockclient_cl0, person1):
     assert refs[1]['source-ref']['@id'] == 'S00051'
     assert refs[1]['statement-refs'][0]['@id'] == 'Stmt00450'
 
+def test_get_person_by_id_fields(mockclient_cl0, person1):
+    "Only the fields set via fields= (and @id) are returned."
+    response = mockclient_cl0.get(TEST_URL + "/P00001?fields=uris,factoid-refs.@id")
+    assert response.status_code == 200
+    assert response.json == {
+        "@id": "P00001",
+        "uris": person1["uris"],
+        "factoid-refs": [{"@id": "F00075"}, {"@id": "F00150"}]
+    }
+
 def test_get_invalid_filter(mockclient_cl0):
     """Each comliance level has a set of allowed filters.
     Test 's' which is not allowed with cl0
@@ -52,4 +63,96 @@ def test_protocol(mockclient_cl0):
     data = r.json
     assert data["protocol"]["page"] == 1
     assert data["protocol"]["size"] == 30
-    assert data["protocol"]["totalHits"] == 75
\ No newline at end of file
+    assert data["protocol"]["totalHits"] == 75
+
+def test_get_person_by_id_conditional(mockclient_cl0):
+    "Test ETag, Last-Modified and 304 responses."
+    response = mockclient_cl0.get(TEST_URL + "/P00002")
+    etag = response.headers["ETag"]
+    assert not etag.startswith("W/")
+    assert response.headers["Last-Modified"]
+
+    response = mockclient_cl0.get(TEST_URL + "/P00002", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.data == b""
+
+    response = mockclient_cl0.get(TEST_URL + "/P00002", headers={"If-None-Match": '"foo"'})
+    assert response.status_code == 200
+
+    # the representation depends on fields
+    response = mockclient_cl0.get(TEST_URL + "/P00002?fields=uris",
+                                  headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+    # P00002 was modified at 2003-02-15T00:12:00
+    last_modified = mockclient_cl0.get(TEST_URL + "/P00002").headers["Last-Modified"]
+    assert last_modified == "Sat, 15 Feb 2003 00:12:00 GMT"
+    response = mockclient_cl0.get(TEST_URL + "/P00002",
+                                  headers={"If-Modified-Since": last_modified})
+    assert response.status_code == 304
+    response = mockclient_cl0.get(TEST_URL + "/P00002",
+                                  headers={"If-Modified-Since": "Mon, 01 Jan 1900 00:00:00 GMT"})
+    assert response.status_code == 200
+
+    # no validators for missing objects
+    response = mockclient_cl0.get(TEST_URL + "/foo1234bar", headers={"If-None-Match": "*"})
+    assert response.status_code == 404
+
+
+def test_get_person_by_id_not_modified_without_loading(mockclient_cl0, monkeypatch):
+    "A 304 response is sent without loading the object."
+    etag = mockclient_cl0.get(TEST_URL + "/P00002").headers["ETag"]
+
+    def get(*args, **kwargs):
+        raise AssertionError("the person must not be loaded")
+
+    monkeypatch.setattr(PersonConnector, "get", get)
+    response = mockclient_cl0.get(TEST_URL + "/P00002", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+
+def test_get_person_by_id_without_write_version(mockclient_cl0, monkeypatch):
+    "Without write version the ETag is a hash of the representation."
+    monkeypatch.setattr(PersonConnector, "get_write_version", lambda self: None)
+    etag = mockclient_cl0.get(TEST_URL + "/P00002").headers["ETag"]
+    response = mockclient_cl0.get(TEST_URL + "/P00002", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+
+
+def test_get_persons_conditional(mockclient_cl0):
+    "Lists have a weak ETag depending on the query."
+    response = mockclient_cl0.get(TEST_URL + "?size=5")
+    etag = response.headers["ETag"]
+    assert etag.startswith("W/")
+    response = mockclient_cl0.get(TEST_URL + "?size=5", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    response = mockclient_cl0.get(TEST_URL + "?size=6", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+
+
+def test_compressed_responses(mockclient_cl0):
+    "Responses are gzipped on request; conditional requests still work."
+    import gzip
+    import json
+
+    response = mockclient_cl0.get(TEST_URL + "?size=20", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    data = json.loads(gzip.decompress(response.data))
+    assert len(data["persons"]) == 20
+    etag = response.headers["ETag"]
+    response = mockclient_cl0.get(TEST_URL + "?size=20",
+                                  headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert response.status_code == 304
+
+    # the strong ETag of a single object becomes weak if compressed
+    plain = mockclient_cl0.get(TEST_URL + "/P00002")
+    response = mockclient_cl0.get(TEST_URL + "/P00002", headers={"Accept-Encoding": "gzip"})
+    assert json.loads(gzip.decompress(response.data)) == plain.json
+    assert response.headers["ETag"] == "W/" + plain.headers["ETag"]
+    response = mockclient_cl0.get(TEST_URL + "/P00002",
+                                  headers={"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
@@ -50,6 +50,66 @@ def test_get_pagination(mockclient_cl1):
     assert len(r.json["factoids"]) == 50
 
 
+
+def test_get_pagination_cursor(mockclient_cl1):
+    """Test paging with cursor= using the token from protocol.next.
+    """
+    r = mockclient_cl1.get(TEST_URL + "?size=150")
+    assert r.status_code == 200
+    expected_ids = [f["@id"] for f in r.json["factoids"]]
+    token = r.json["protocol"]["next"]
+
+    r = mockclient_cl1.get(TEST_URL + "?size=150&cursor=" + token)
+    assert r.status_code == 200
+    assert len(r.json["factoids"]) == 50
+    assert "next" not in r.json["protocol"]
+    expected_ids.extend([f["@id"] for f in r.json["factoids"]])
+
+    r = mockclient_cl1.get(TEST_URL + "?size=200")
+    assert [f["@id"] for f in r.json["factoids"]] == expected_ids
+
+    # a token is bound to the sort order it was created for
+    r = mockclient_cl1.get(TEST_URL + "?size=150&sortBy=createdBy&cursor=" + token)
+    assert r.status_code == 400
+
+    r = mockclient_cl1.get(TEST_URL + "?cursor=foo")
+    assert r.status_code == 400
+
+def test_get_depth(mockclient_cl1):
+    "Test depth=reduced and depth=full."
+    r = mockclient_cl1.get(TEST_URL + "?size=10&depth=reduced")
+    assert r.status_code == 200
+    for factoid in r.json["factoids"]:
+        assert list(factoid["person"]) == ["@id"]
+        assert list(factoid["source"]) == ["@id"]
+        assert all(list(stmt) == ["@id"] for stmt in factoid["statements"])
+
+    r = mockclient_cl1.get(TEST_URL + "?size=10&depth=full")
+    assert r.status_code == 200
+    assert "factoid-refs" in r.json["factoids"][0]["person"]
+
+    r = mockclient_cl1.get(TEST_URL + "?depth=foo")
+    assert r.status_code == 400
+
+def test_get_fields(mockclient_cl1):
+    "Test sparse fieldsets (fields=)."
+    r = mockclient_cl1.get(
+        TEST_URL + "?size=10&fields=statements.date,statements.statementContent")
+    assert r.status_code == 200
+    assert "next" in r.json["protocol"]
+    for factoid in r.json["factoids"]:
+        # @id and the sort field are always returned
+        assert set(factoid) == {"@id", "createdWhen", "statements"}
+        for stmt in factoid["statements"]:
+            assert set(stmt) <= {"date", "statementContent"}
+
+    # the cursor still works
+    token = r.json["protocol"]["next"]
+    r2 = mockclient_cl1.get(TEST_URL + "?size=10&fields=@id&cursor=" + token)
+    r3 = mockclient_cl1.get(TEST_URL + "?size=10&page=2")
+    assert r2.json["factoids"] == [{"@id": f["@id"], "createdWhen": f["createdWhen"]}
+                                   for f in r3.json["factoids"]]
+
 def test_get_valid_sort_by(mockclient_cl1):
     "Try out a valid value for sortBy"
     r = mockclient_cl1.get(TEST_URL + "?sortBy=createdBy")
@@ -162,4 +162,24 @@ def test_get_with_filter_person_statement(mockclient_cl1):
     assert r.status_code == 200
     assert r.json["statements"][0]["@id"] == "Stmt00183"
     r = mockclient_cl1.get(TEST_URL + "?size=100&st=Stmt00055&p=P00064")
-    assert r.status_code == 404
\ No newline at end of file
+    assert r.status_code == 404
+
+def test_get_many(mockclient_cl1):
+    "POST /statements/_mget returns the statements in request order, null for misses."
+    ids = ["Stmt00062", "unknown", "Stmt00001"]
+    r = mockclient_cl1.post(TEST_URL + "/_mget", json={"ids": ids})
+    assert r.status_code == 200
+    result = r.json["statements"]
+    assert [s and s["@id"] for s in result] == ["Stmt00062", None, "Stmt00001"]
+    assert result[2] == mockclient_cl1.get(TEST_URL + "/Stmt00001").json
+
+    r = mockclient_cl1.post(TEST_URL + "/_mget?fields=name", json={"ids": ids[:1]})
+    assert set(r.json["statements"][0]) == {"@id", "name"}
+
+
+def test_get_many_too_many_ids(mockclient_cl1):
+    "Not more than maxSize ids can be requested at once."
+    r = mockclient_cl1.post(TEST_URL + "/_mget", json={"ids": ["Stmt00001"] * 801})
+    assert r.status_code == 400
+    r = mockclient_cl1.post(TEST_URL + "/_mget", json={"foo": []})
+    assert r.status_code == 400
@@ -0,0 +1,155 @@
+"""Tests for papilotte.client against a local server.
+"""
+import copy
+import io
+import json
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+
+from papilotte import client, importer, mockdata, server
+
+
+class Recorder:
+    """WSGI middleware which records all requests.
+
+    If flaky is True, the first PUT to each url is answered with 503.
+    """
+
+    def __init__(self, app, flaky=False):
+        self.app = app
+        self.flaky = flaky
+        self.seen = set()
+        self.requests = []
+
+    def __call__(self, environ, start_response):
+        path = environ["PATH_INFO"]
+        self.requests.append((environ["REQUEST_METHOD"], path))
+        if self.flaky and environ["REQUEST_METHOD"] == "PUT" and path not in self.seen:
+            self.seen.add(path)
+            start_response("503 Service Unavailable", [("Content-Type", "text/plain")])
+            return [b"try again"]
+        return self.app(environ, start_response)
+
+
+@pytest.fixture
+def live_server(cfgfile_cl2):
+    "Run a cl2 server in a thread; return a (baseurl, flask app) tuple."
+    app = server.create_app(cfgfile_cl2).app
+    httpd = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.start()
+    yield "http://127.0.0.1:{}/api".format(httpd.server_port), app
+    httpd.shutdown()
+    thread.join()
+
+
+def make_factoids(num, num_persons=4):
+    """Return num new factoids sharing num_persons persons and sources.
+
+    Each factoid has a single statement, as the api does not accept more.
+    """
+    factoids = list(mockdata.make_factoids(20 + num))[20:]
+    for i, factoid in enumerate(factoids):
+        factoid["statements"] = factoid["statements"][:1]
+        factoid["person"] = copy.deepcopy(factoids[i % num_persons]["person"])
+        factoid["source"] = copy.deepcopy(factoids[i % num_persons]["source"])
+    return factoids
+
+
+def as_ndjson(factoids):
+    return importer.iter_ndjson(io.StringIO("\n".join(json.dumps(f) for f in factoids)))
+
+
+def test_import_factoids(live_server):
+    "Factoids are sent concurrently, persons and sources only once."
+    baseurl, app = live_server
+    app.wsgi_app = recorder = Recorder(app.wsgi_app)
+    factoids = make_factoids(12)
+    remote = client.RemoteImporter(baseurl, workers=4)
+    results = [(stats.done, errors) for stats, errors
+               in remote.import_factoids(as_ndjson(factoids), batch_size=5)]
+    assert results == [(5, []), (10, []), (12, [])]
+    assert remote.sent == {
+        (path, f[key]["@id"]): None for f in factoids[:4]
+        for key, path in (("person", "persons"), ("source", "sources"))}
+    assert remote.pending == {}
+
+    persons = [r for r in recorder.requests if r[1].startswith("/api/persons/")]
+    sources = [r for r in recorder.requests if r[1].startswith("/api/sources/")]
+    assert len(persons) == 4
+    assert len(sources) == 4
+    with app.test_client() as test_client:
+        data = test_client.get("/api/factoids/" + factoids[5]["@id"]).json
+        assert data["person"]["@id"] == factoids[1]["person"]["@id"]
+        assert data["person"]["uris"] == factoids[1]["person"]["uris"]
+        assert test_client.get("/api/factoids?size=100").json["protocol"]["totalHits"] == 32
+
+
+def test_import_retries(live_server):
+    "Requests answered with 503 are retried."
+    baseurl, app = live_server
+    app.wsgi_app = recorder = Recorder(app.wsgi_app, flaky=True)
+    factoids = make_factoids(3)
+    session = client.make_session(workers=2, retries=2, backoff=0)
+    remote = client.RemoteImporter(baseurl, session, workers=2)
+    stats, errors = list(remote.import_factoids(as_ndjson(factoids)))[-1]
+    assert errors == []
+    assert stats.done == 3
+    puts = [r for r in recorder.requests if r[0] == "PUT"]
+    assert len(puts) == 2 * (3 + 3 + 3)
+
+
+def test_import_max_sent(live_server):
+    "Only the last max_sent persons and sources are remembered."
+    baseurl, app = live_server
+    app.wsgi_app = recorder = Recorder(app.wsgi_app)
+    factoids = make_factoids(8, num_persons=2)
+    remote = client.RemoteImporter(baseurl, workers=1, max_sent=2)
+    # with batch_size 1 each factoid is finished before the next one is sent
+    stats, errors = list(remote.import_factoids(as_ndjson(factoids), batch_size=1))[-1]
+    assert errors == []
+    assert stats.done == 8
+    assert len(remote.sent) == 2
+    # each factoid evicts the person and source of the previous one
+    persons = [r for r in recorder.requests if r[1].startswith("/api/persons/")]
+    assert len(persons) == 8
+
+
+def test_import_errors(live_server):
+    "Failed persons and invalid ids are reported for each factoid."
+    baseurl, app = live_server
+    factoids = make_factoids(5, num_persons=2)
+    factoids[0]["person"]["uris"] = "not a list"
+    factoids[3]["@id"] = "F 4"
+    factoids[4]["statements"].append({"@id": "Stmt2"})
+    session = client.make_session(retries=0)
+    remote = client.RemoteImporter(baseurl, session)
+    results = list(remote.import_factoids(as_ndjson(factoids), skip=0))
+    errors = results[-1][1]
+    assert [(number, obj_id) for number, obj_id, _ in errors] == [
+        (1, factoids[0]["@id"]), (3, factoids[2]["@id"]), (4, "F 4"),
+        (5, factoids[4]["@id"])]
+    assert "Cannot save person" in errors[0][2]
+    assert "RFC 3986" in errors[2][2]
+    assert "exactly one statement" in errors[3][2]
+
+    remote = client.RemoteImporter(baseurl, session, auto_escape=True)
+    stats, errors = list(remote.import_factoids(as_ndjson(factoids[3:4])))[-1]
+    assert errors == []
+    with app.test_client() as test_client:
+        assert test_client.get("/api/factoids/F%204").status_code == 200
+
+
+def test_import_resume(live_server):
+    "The first factoids are skipped if a checkpoint exists."
+    baseurl, app = live_server
+    factoids = make_factoids(6)
+    remote = client.RemoteImporter(baseurl)
+    results = [(stats.done, stats.processed) for stats, _
+               in remote.import_factoids(as_ndjson(factoids), batch_size=4, skip=4)]
+    assert results == [(6, 2)]
+    with app.test_client() as test_client:
+        assert test_client.get("/api/factoids/" + factoids[3]["@id"]).status_code == 404
+        assert test_client.get("/api/factoids/" + factoids[4]["@id"]).status_code == 200
@@ -1,6 +1,8 @@
 import copy
+import json
 
 import pytest
+from flask import Request
 from flask import current_app as app
 from pony import orm
 
@@ -107,3 +109,87 @@ def test_delete_factoid(mockclient_cl2):
     # solitaire factoid to test deletion purpose
     r = mockclient_cl2.delete(TEST_URL + '/F00009')
     assert r.status_code == 204
+
+
+def test_bulk_factoids(mockclient_cl2):
+    "POST /factoids/_bulk creates and updates factoids and reports each line."
+    new = copy.deepcopy(mock_ipif)
+    new["@id"] = "Bulk1"
+    changed = copy.deepcopy(new)
+    changed["createdBy"] = "Bulk creator"
+    changed["statement"] = {"@id": "Bulk statement 1"}
+    lines = [
+        json.dumps(new),
+        "",
+        "this is not json",
+        json.dumps({"@id": "Bulk2"}),
+        json.dumps(changed),
+    ]
+    r = mockclient_cl2.post(TEST_URL + "/_bulk", data="\n".join(lines),
+                            content_type="application/x-ndjson")
+    assert r.status_code == 200
+    assert r.mimetype == "application/x-ndjson"
+    report = [json.loads(line) for line in r.data.decode("utf-8").splitlines()]
+    assert [(s["line"], s["status"]) for s in report] == [
+        (1, "created"), (3, "error"), (4, "error"), (5, "updated")]
+    assert report[0]["@id"] == "Bulk1"
+    assert "person" in report[2]["error"]
+
+    data = mockclient_cl2.get(TEST_URL + "/Bulk1").json
+    assert data["createdBy"] == "Bulk creator"
+    assert [s["@id"] for s in data["statements"]] == ["Bulk statement 1"]
+
+
+def test_bulk_factoids_batches(mockclient_cl2):
+    "Factoids are saved in batches; a failing factoid does not affect the others."
+    flask_app = mockclient_cl2.application
+    flask_app.config["PAPI_BULK_BATCH_SIZE"] = 2
+    docs = []
+    for i in range(5):
+        factoid = copy.deepcopy(mock_ipif)
+        factoid["@id"] = "Batch{}".format(i)
+        factoid["statement"] = {"@id": "Batch statement {}".format(i)}
+        docs.append(factoid)
+    # a statement already used by another factoid cannot be reused
+    docs[2]["statement"] = {"@id": "Stmt00001"}
+    r = mockclient_cl2.post(TEST_URL + "/_bulk",
+                            data="\n".join(json.dumps(f) for f in docs),
+                            content_type="application/x-ndjson")
+    report = [json.loads(line) for line in r.data.decode("utf-8").splitlines()]
+    assert [s["status"] for s in report] == ["created", "created", "error", "created", "created"]
+    assert mockclient_cl2.get(TEST_URL + "/Batch3").status_code == 200
+    assert mockclient_cl2.get(TEST_URL + "/Batch2").status_code == 404
+
+
+def test_no_bulk_for_cl1(mockclient_cl1):
+    "Bulk requests are not allowed in compliance level 1."
+    r = mockclient_cl1.post(TEST_URL + "/_bulk", data="{}",
+                            content_type="application/x-ndjson")
+    assert r.status_code == 501
+
+
+def test_update_existing_statements(mockclient_cl2, factoid1):
+    "PUT an existing factoid with a changed statement (lookups are kept)."
+    data = copy.deepcopy(factoid1)
+    data['statement'] = data.pop('statements')[0]
+    data['statement']['name'] = 'Changed name'
+    r = mockclient_cl2.put(TEST_URL + '/F00001', json=data)
+    assert r.status_code == 200
+    stmt = r.json['statements'][0]
+    assert stmt['name'] == 'Changed name'
+    assert stmt['role'] == factoid1['statements'][0]['role']
+    assert [s['@id'] for s in r.json['statements']] == [data['statement']['@id']]
+
+
+def test_bulk_body_is_streamed(mockclient_cl2, monkeypatch):
+    "The body of a bulk request is read line by line, not buffered as a whole."
+    def get_data(*args, **kwargs):
+        raise AssertionError("the body must not be buffered")
+
+    monkeypatch.setattr(Request, "get_data", get_data)
+    factoid = copy.deepcopy(mock_ipif)
+    factoid["@id"] = "Stream1"
+    r = mockclient_cl2.post(TEST_URL + "/_bulk", data=json.dumps(factoid),
+                            content_type="application/x-ndjson")
+    assert r.status_code == 200
+    assert json.loads(r.data.decode("utf-8"))["status"] == "created"
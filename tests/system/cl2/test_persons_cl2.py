@@ -107,3 +107,19 @@ def test_referential_integrity(mockclient_cl2, person1):
     r = mockclient_cl2.delete(TEST_URL + "/P00002")
     assert r.status_code == 409
     assert "at least one factoid" in r.json["detail"]
+
+
+def test_etag_changes_on_update(mockclient_cl2):
+    "Any write must invalidate ETags."
+    response = mockclient_cl2.get(TEST_URL + "/P00002")
+    etag = response.headers["ETag"]
+    newdata = response.json
+    newdata.pop("factoid-refs")
+    list_etag = mockclient_cl2.get(TEST_URL).headers["ETag"]
+    newdata["uris"] = ["https://example.com/persons2x"]
+    assert mockclient_cl2.put(TEST_URL + "/P00002", json=newdata).status_code == 200
+    response = mockclient_cl2.get(TEST_URL + "/P00002", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json["uris"] == ["https://example.com/persons2x"]
+    response = mockclient_cl2.get(TEST_URL, headers={"If-None-Match": list_etag})
+    assert response.status_code == 200
@@ -0,0 +1,136 @@
+"""Tests for the papilotte command line interface.
+"""
+import json
+import os
+
+import pytest
+import toml
+from click.testing import CliRunner
+from pony import orm
+
+from papilotte import cli, importer, mockdata
+from papilotte.connectors.pony import database
+
+
+@pytest.fixture
+def cfgfile(tmp_path):
+    "Return path to a configuration file using a database with 10 factoids."
+    dbfile = str(tmp_path / "test.db")
+    db = database.make_db(provider="sqlite", filename=dbfile)
+    with orm.db_session:
+        for factoid in mockdata.make_factoids(10):
+            db.entities["Factoid"].create_from_ipif(factoid)
+    db.disconnect()
+    filename = str(tmp_path / "papilotte.toml")
+    with open(filename, "w") as fh:
+        toml.dump({"server": {}, "logging": {}, "api": {}, "metadata": {},
+                   "connector": {"provider": "sqlite", "filename": dbfile}}, fh)
+    return filename
+
+
+def test_rebuild_fulltext(cfgfile):
+    runner = CliRunner()
+    result = runner.invoke(cli.main, ["rebuild-fulltext", "-c", cfgfile])
+    assert result.exit_code == 0, result.output
+    assert "Factoid: 10 objects indexed" in result.output
+
+
+def test_gc(cfgfile):
+    runner = CliRunner()
+    result = runner.invoke(cli.main, ["gc", "-c", cfgfile, "-b", "2"])
+    assert result.exit_code == 0, result.output
+    assert "Person: 0 rows deleted" in result.output
+    assert "Role: 0 rows deleted" in result.output
+
+
+def test_create_indexes(cfgfile):
+    dbfile = toml.load(cfgfile)["connector"]["filename"]
+    db = database.make_db(provider="sqlite", filename=dbfile)
+    with orm.db_session:
+        db.execute('DROP INDEX "idx_factoid__createdwhen_id"')
+        db.execute('DROP INDEX "idx_date__sortdate"')
+    db.disconnect()
+    runner = CliRunner()
+    result = runner.invoke(cli.main, ["db", "create-indexes", "-c", cfgfile])
+    assert result.exit_code == 0, result.output
+    assert result.output.splitlines() == [
+        "Created index idx_date__sortdate",
+        "Created index idx_factoid__createdwhen_id",
+    ]
+    result = runner.invoke(cli.main, ["db", "create-indexes", "-c", cfgfile])
+    assert result.output == "All indexes exist.\n"
+
+
+@pytest.fixture
+def empty_cfgfile(tmp_path):
+    "Return path to a configuration file using an empty database."
+    filename = str(tmp_path / "papilotte.toml")
+    with open(filename, "w") as fh:
+        toml.dump({"server": {}, "logging": {}, "api": {}, "metadata": {},
+                   "connector": {"provider": "sqlite",
+                                 "filename": str(tmp_path / "import.db")}}, fh)
+    return filename
+
+
+def count_factoids(cfgfile):
+    dbfile = toml.load(cfgfile)["connector"]["filename"]
+    db = database.make_db(provider="sqlite", filename=dbfile)
+    with orm.db_session:
+        num = db.entities["Factoid"].select().count()
+    db.disconnect()
+    return num
+
+
+@pytest.mark.parametrize("fmt", ["json", "ndjson"])
+def test_import(empty_cfgfile, tmp_path, fmt):
+    factoids = list(mockdata.make_factoids(25))
+    input_file = str(tmp_path / "factoids.txt")
+    with open(input_file, "w") as fh:
+        if fmt == "json":
+            json.dump({"factoids": factoids}, fh, indent=2)
+        else:
+            for factoid in factoids:
+                fh.write(json.dumps(factoid) + "\n")
+    runner = CliRunner()
+    result = runner.invoke(cli.main, ["import", "-c", empty_cfgfile, "-b", "10", input_file])
+    assert result.exit_code == 0, result.output
+    # result.output also contains stderr (click < 8.2 can only keep it apart
+    # with mix_stderr, which was removed in 8.2)
+    lines = [line for line in result.output.splitlines() if "factoids processed" in line]
+    assert lines[0].startswith("10 factoids processed (10 created, 0 updated, 0 errors)")
+    assert lines[2].startswith("25 factoids processed (25 created, 0 updated, 0 errors)")
+    assert result.output.splitlines()[-1] == "Import finished."
+    assert count_factoids(empty_cfgfile) == 25
+    assert not os.path.exists(input_file + ".checkpoint")
+
+    # importing again updates the factoids
+    result = runner.invoke(cli.main, ["import", "-c", empty_cfgfile, "-f", fmt, input_file])
+    assert result.exit_code == 0, result.output
+    assert "25 created" not in result.output
+
+
+def test_import_resume(empty_cfgfile, tmp_path):
+    input_file = str(tmp_path / "factoids.ndjson")
+    lines = [json.dumps(f) for f in mockdata.make_factoids(20)]
+    lines.insert(17, "{broken")
+    with open(input_file, "w") as fh:
+        fh.write("\n".join(lines))
+    # pretend the first 15 factoids were imported before a crash
+    importer.write_checkpoint(input_file + ".checkpoint", input_file, 15)
+    runner = CliRunner()
+    result = runner.invoke(cli.main, ["import", "-c", empty_cfgfile, input_file])
+    assert result.exit_code == 0, result.output
+    assert "Resuming after factoid 15" in result.output
+    assert "21 factoids processed (5 created, 0 updated, 1 errors)" in result.output
+    assert "Factoid 18 (None): Invalid JSON" in result.output
+    assert count_factoids(empty_cfgfile) == 5
+
+
+def test_import_invalid_file(empty_cfgfile, tmp_path):
+    input_file = str(tmp_path / "factoids.json")
+    with open(input_file, "w") as fh:
+        fh.write('{"factoids": [{"@id": "F1"}, {"@id": ')
+    runner = CliRunner()
+    result = runner.invoke(cli.main, ["import", "-c", empty_cfgfile, input_file])
+    assert result.exit_code == 1
+    assert "Cannot read" in result.output
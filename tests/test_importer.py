@@ -0,0 +1,59 @@
+"""Tests for papilotte.importer.
+"""
+import io
+import json
+
+import pytest
+
+from papilotte import importer, mockdata
+
+
+@pytest.mark.parametrize("chunk_size", [7, 100, 64 * 1024])
+def test_iter_json(monkeypatch, chunk_size):
+    "Factoids are parsed one by one, independent of the chunk size."
+    monkeypatch.setattr(importer, "CHUNK_SIZE", chunk_size)
+    factoids = list(mockdata.make_factoids(15))
+    for text in (json.dumps({"factoids": factoids}, indent=2),
+                 json.dumps(factoids),
+                 json.dumps({"meta": {"x": 1}, "factoids": factoids})):
+        result = list(importer.iter_json(io.StringIO(text)))
+        assert [number for number, _, _ in result] == list(range(1, 16))
+        assert [factoid for _, factoid, _ in result] == factoids
+    assert list(importer.iter_json(io.StringIO('{"factoids": [ ]}'))) == []
+
+
+def test_iter_json_invalid():
+    with pytest.raises(ValueError):
+        list(importer.iter_json(io.StringIO('{"foo": 1}')))
+    with pytest.raises(ValueError):
+        list(importer.iter_json(io.StringIO('{"factoids": [{"@id": 1}, {"@id"')))
+
+
+def test_iter_ndjson():
+    text = '{"@id": "F1"}\n\n{"@id": \n{"@id": "F3"}\n'
+    result = list(importer.iter_ndjson(io.StringIO(text)))
+    assert result[0] == (1, {"@id": "F1"}, None)
+    assert result[1][0] == 2 and result[1][1] is None
+    assert result[1][2].startswith("Invalid JSON")
+    assert result[2] == (3, {"@id": "F3"}, None)
+
+
+def test_detect_format(tmp_path):
+    factoids = list(mockdata.make_factoids(2))
+    filename = str(tmp_path / "a.json")
+    with open(filename, "w") as fh:
+        json.dump({"factoids": factoids}, fh)
+    assert importer.detect_format(filename) == "json"
+    with open(filename, "w") as fh:
+        fh.write("\n".join(json.dumps(f) for f in factoids))
+    assert importer.detect_format(filename) == "ndjson"
+    assert importer.detect_format(str(tmp_path / "b.ndjson")) == "ndjson"
+
+
+def test_checkpoint(tmp_path):
+    checkpoint = str(tmp_path / "import.checkpoint")
+    assert importer.read_checkpoint(checkpoint, "a.json") == 0
+    importer.write_checkpoint(checkpoint, "a.json", 2000)
+    assert importer.read_checkpoint(checkpoint, "a.json") == 2000
+    # a checkpoint of another input file is ignored
+    assert importer.read_checkpoint(checkpoint, "b.json") == 0